@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework.authtoken",
     "django_filters",
@@ -90,6 +91,21 @@ DATABASES = {
     }
 }
 
+# Cache for API responses. Local memory by default; point CACHE_BACKEND at
+# django.core.cache.backends.filebased.FileBasedCache and CACHE_LOCATION at a directory to share it between workers
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="credable-api"),
+    }
+}
+# Entries are retired by the ingestion generation, so the timeout only bounds how long stale pages occupy the cache
+API_CACHE_TIMEOUT = config("API_CACHE_TIMEOUT", cast=int, default=3600)
+# Largest ?page_size= the list and search endpoints accept
+API_MAX_PAGE_SIZE = config("API_MAX_PAGE_SIZE", cast=int, default=1000)
+# Rows fetched per server-side cursor round trip by the export endpoint
+EXPORT_CHUNK_SIZE = config("EXPORT_CHUNK_SIZE", cast=int, default=10_000)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
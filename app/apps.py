@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "app"
+
+    def ready(self):
+        # Registers the __ilike lookup used by the customer filters and search
+        from app import lookups  # noqa: F401
@@ -0,0 +1,19 @@
+import hashlib
+
+from app.models import IngestionGeneration
+
+# The ETL loader always bumps this row, see etl/load.py
+GENERATION_ID = 1
+
+
+def current_generation() -> int:
+    """The ingestion generation, 0 until the first load; a primary-key lookup, far cheaper than the list query"""
+    return IngestionGeneration.objects.filter(pk=GENERATION_ID).values_list("value", flat=True).first() or 0
+
+
+def response_cache_key(request, generation: int) -> str:
+    """Key for a cached response, covering every query parameter (filters, search, ordering, cursor, page size).
+    The host is part of it because the pagination links in the cached body are absolute URLs."""
+    params = sorted((name, sorted(values)) for name, values in request.query_params.lists())
+    digest = hashlib.sha256(repr((request.get_host(), request.path, params)).encode()).hexdigest()
+    return f"api-response:{generation}:{digest}"
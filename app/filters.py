@@ -1,6 +1,10 @@
 import django_filters
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
 
-from app.models import Customer
+from app.models import SEARCH_CONFIG, Customer, CustomerRollup
 
 
 class CustomerFilter(django_filters.FilterSet):
@@ -11,5 +15,42 @@ class CustomerFilter(django_filters.FilterSet):
 
     start_date = django_filters.DateFilter(field_name="ingested_at", lookup_expr="gte")
     end_date = django_filters.DateFilter(field_name="ingested_at", lookup_expr="lte")
-    city = django_filters.CharFilter(lookup_expr="icontains")
-    country = django_filters.CharFilter(lookup_expr="icontains")
+    # ILIKE rather than icontains, so the pg_trgm indexes can answer it
+    city = django_filters.CharFilter(lookup_expr="ilike")
+    country = django_filters.CharFilter(lookup_expr="ilike")
+
+
+class CustomerRollupFilter(django_filters.FilterSet):
+    """CustomerFilter's parameters for the rollup; the dates select subscription months rather than ingestion times"""
+
+    class Meta:
+        model = CustomerRollup
+        fields = ["start_date", "end_date", "city", "country"]
+
+    start_date = django_filters.DateFilter(method="filter_start_date")
+    end_date = django_filters.DateFilter(field_name="subscription_month", lookup_expr="lte")
+    city = django_filters.CharFilter(lookup_expr="ilike")
+    country = django_filters.CharFilter(lookup_expr="ilike")
+
+    def filter_start_date(self, queryset, name, value):
+        # Months are stored by their first day, so a start date inside a month keeps that month
+        return queryset.filter(subscription_month__gte=value.replace(day=1))
+
+
+class FullTextSearchFilter(filters.BaseFilterBackend):
+    """Matches the `q` parameter against Customer.search_vector (web search syntax: "quoted phrases", or, -word)
+    and orders the matches by rank, best first"""
+
+    search_param = "q"
+
+    def filter_queryset(self, request, queryset, view):
+        terms = request.query_params.get(self.search_param, "").strip()
+        if not terms:
+            raise ValidationError({self.search_param: "This query parameter is required."})
+
+        query = SearchQuery(terms, config=SEARCH_CONFIG, search_type="websearch")
+        return (
+            queryset.filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "index")
+        )
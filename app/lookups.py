@@ -0,0 +1,17 @@
+from django.db.models import CharField, Lookup
+
+
+@CharField.register_lookup
+class ILikeContains(Lookup):
+    """Case-insensitive substring match written as a bare `column ILIKE '%value%'`, the form a pg_trgm GIN index
+    serves. Django's icontains compares UPPER(column::text) instead, which no index on the column can answer."""
+
+    lookup_name = "ilike"
+
+    def get_db_prep_lookup(self, value, connection):
+        return "%s", [f"%{connection.ops.prep_for_like_query(value)}%"]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} ILIKE {rhs}", [*lhs_params, *rhs_params]
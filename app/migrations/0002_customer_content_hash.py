@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="content_hash",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
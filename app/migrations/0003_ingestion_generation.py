@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0002_customer_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestionGeneration",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("value", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "ingestion_generation",
+            },
+        ),
+    ]
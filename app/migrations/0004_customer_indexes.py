@@ -0,0 +1,55 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:43
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+TRIGRAM_SEARCH_FIELDS = ("first_name", "last_name", "email", "company", "city", "country")
+TRIGRAM_INDEXES = [
+    django.contrib.postgres.indexes.GinIndex(fields=[field], name=f"customer_{field}_trgm", opclasses=["gin_trgm_ops"])
+    for field in TRIGRAM_SEARCH_FIELDS
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """pg_trgm ships with PostgreSQL's contrib package; without it searches fall back to sequential scans.
+    Once it is installed, re-run this migration (migrate app 0003, then migrate) to build the indexes."""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    customer = apps.get_model("app", "Customer")
+    for index in TRIGRAM_INDEXES:
+        schema_editor.add_index(customer, index)
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    for index in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {schema_editor.quote_name(index.name)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0003_ingestion_generation"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(fields=["ingested_at"], name="customer_ingested_at_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(fields=["subscription_date"], name="customer_subscription_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(fields=["country", "city"], name="customer_country_city_idx"),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[migrations.AddIndex(model_name="customer", index=index) for index in TRIGRAM_INDEXES],
+            database_operations=[migrations.RunPython(create_trigram_indexes, drop_trigram_indexes)],
+        ),
+    ]
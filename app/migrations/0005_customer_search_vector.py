@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:46
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0004_customer_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.CombinedSearchVector(
+                    django.contrib.postgres.search.CombinedSearchVector(
+                        django.contrib.postgres.search.SearchVector(
+                            "first_name", "last_name", config="simple", weight="A"
+                        ),
+                        "||",
+                        django.contrib.postgres.search.SearchVector("company", config="simple", weight="B"),
+                        django.contrib.postgres.search.SearchConfig("simple"),
+                    ),
+                    "||",
+                    django.contrib.postgres.search.SearchVector(
+                        "email", "city", "country", config="simple", weight="C"
+                    ),
+                    django.contrib.postgres.search.SearchConfig("simple"),
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=django.contrib.postgres.indexes.GinIndex(fields=["search_vector"], name="customer_search_vector_idx"),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:04
+
+from django.db import migrations, models
+
+# Counts the customers loaded before the rollup existed; later loads maintain it themselves
+BACKFILL_SQL = """
+    INSERT INTO customer_rollup (country, city, subscription_month, customer_count)
+    SELECT country, city, date_trunc('month', subscription_date)::date, count(*)
+    FROM customer
+    GROUP BY 1, 2, 3;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0005_customer_search_vector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CustomerRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("country", models.CharField(max_length=100)),
+                ("city", models.CharField(max_length=100)),
+                ("subscription_month", models.DateField()),
+                ("customer_count", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "customer_rollup",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("country", "city", "subscription_month"),
+                        name="customer_rollup_group",
+                    )
+                ],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:13
+
+import datetime
+
+from django.db import migrations, models
+
+
+def _month_partition_sql(month: datetime.date) -> str:
+    following = (month + datetime.timedelta(days=32)).replace(day=1)
+    return (
+        f"CREATE TABLE customer_{month:%Y_%m} PARTITION OF customer "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00+00') TO ('{following:%Y-%m-%d} 00:00+00')"
+    )
+
+
+def _copy_and_index(apps, schema_editor, source: str, primary_key: str):
+    """Fills the new customer table from `source`, drops `source` and builds the keys and indexes of the model"""
+    customer = apps.get_model("app", "Customer")
+    # The generated search_vector is computed again on insert
+    columns = ", ".join(
+        schema_editor.quote_name(field.column) for field in customer._meta.concrete_fields if not field.generated
+    )
+    schema_editor.execute(f"INSERT INTO customer ({columns}) SELECT {columns} FROM {source}")
+    schema_editor.execute(f"DROP TABLE {source}")
+    schema_editor.execute(f"ALTER TABLE customer ADD PRIMARY KEY ({primary_key})")
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        has_trigram = cursor.fetchone() is not None
+    for index in customer._meta.indexes:
+        if has_trigram or "gin_trgm_ops" not in getattr(index, "opclasses", ()):
+            schema_editor.add_index(customer, index)
+
+
+def partition_customer_table(apps, schema_editor):
+    """Rebuilds customer as a table range-partitioned by ingested_at, one partition per month that has rows plus the
+    current and next month, and a default partition for anything outside them. Rewrites the whole table once."""
+    schema_editor.execute("ALTER TABLE customer RENAME TO customer_unpartitioned")
+    schema_editor.execute(
+        "CREATE TABLE customer (LIKE customer_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED) "
+        "PARTITION BY RANGE (ingested_at)"
+    )
+    schema_editor.execute("CREATE TABLE customer_default PARTITION OF customer DEFAULT")
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', ingested_at AT TIME ZONE 'UTC')::date FROM customer_unpartitioned"
+        )
+        months = {month for (month,) in cursor.fetchall()}
+    this_month = datetime.datetime.now(datetime.timezone.utc).date().replace(day=1)
+    months |= {this_month, (this_month + datetime.timedelta(days=32)).replace(day=1)}
+    for month in sorted(months):
+        schema_editor.execute(_month_partition_sql(month))
+
+    _copy_and_index(apps, schema_editor, "customer_unpartitioned", primary_key="index, ingested_at")
+
+
+def unpartition_customer_table(apps, schema_editor):
+    schema_editor.execute("ALTER TABLE customer RENAME TO customer_partitioned")
+    schema_editor.execute("CREATE TABLE customer (LIKE customer_partitioned INCLUDING DEFAULTS INCLUDING GENERATED)")
+    _copy_and_index(apps, schema_editor, "customer_partitioned", primary_key="index")
+    schema_editor.execute("ALTER TABLE customer ADD CONSTRAINT customer_customer_id_key UNIQUE (customer_id)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0006_customer_rollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CustomerKey",
+            fields=[
+                ("index", models.IntegerField(primary_key=True, serialize=False)),
+                ("customer_id", models.CharField(max_length=64, unique=True)),
+            ],
+            options={
+                "db_table": "customer_key",
+            },
+        ),
+        migrations.RunSQL(
+            "INSERT INTO customer_key (index, customer_id) SELECT index, customer_id FROM customer",
+            migrations.RunSQL.noop,
+        ),
+        # customer_id stays unique through customer_key; the partitioned table cannot enforce it itself
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="customer",
+                    name="customer_id",
+                    field=models.CharField(max_length=64),
+                ),
+            ],
+            database_operations=[migrations.RunPython(partition_customer_table, unpartition_customer_table)],
+        ),
+    ]
@@ -1,14 +1,35 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 
+# Columns the API searches with ILIKE '%term%'; each gets a pg_trgm GIN index
+TRIGRAM_SEARCH_FIELDS = ("first_name", "last_name", "email", "company", "city", "country")
+# The "simple" configuration lower-cases words without stemming, which suits names and places
+SEARCH_CONFIG = "simple"
+
 
 class Customer(models.Model):
+    """Partitioned by month of ingested_at (customer_YYYY_MM, plus customer_default for anything else), see migration
+    0007 and etl/partitions.py. Its primary key is (index, ingested_at) in the database; uniqueness of index and
+    customer_id across partitions is kept by CustomerKey."""
 
     class Meta:
         db_table = "customer"
         ordering = ["-ingested_at"]
+        indexes = [
+            models.Index(fields=["ingested_at"], name="customer_ingested_at_idx"),
+            models.Index(fields=["subscription_date"], name="customer_subscription_date_idx"),
+            models.Index(fields=["country", "city"], name="customer_country_city_idx"),
+            # Created only where pg_trgm is available, see migration 0004
+            *[
+                GinIndex(fields=[field], opclasses=["gin_trgm_ops"], name=f"customer_{field}_trgm")
+                for field in TRIGRAM_SEARCH_FIELDS
+            ],
+            GinIndex(fields=["search_vector"], name="customer_search_vector_idx"),
+        ]
 
     index = models.IntegerField(primary_key=True)
-    customer_id = models.CharField(max_length=64, unique=True)
+    customer_id = models.CharField(max_length=64)
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     company = models.CharField(max_length=255)
@@ -25,6 +46,66 @@ class Customer(models.Model):
 
     source_file = models.CharField(max_length=255)
     ingested_at = models.DateTimeField()
+    # Set by the ETL from the record's business fields; upserts only rewrite rows whose hash changed
+    content_hash = models.BigIntegerField(blank=True, null=True)
+    # Computed by PostgreSQL on every insert and update, so ETL loads fill it without knowing about it
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector("first_name", "last_name", weight="A", config=SEARCH_CONFIG)
+            + SearchVector("company", weight="B", config=SEARCH_CONFIG)
+            + SearchVector("email", "city", "country", weight="C", config=SEARCH_CONFIG)
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.customer_id})"
+
+
+class CustomerKey(models.Model):
+    """The index and customer_id of every customer in the table. A partitioned table can only enforce keys that
+    include the partition column, so the ETL loader claims each key here first and skips rows whose key is taken."""
+
+    class Meta:
+        db_table = "customer_key"
+
+    index = models.IntegerField(primary_key=True)
+    customer_id = models.CharField(max_length=64, unique=True)
+
+    def __str__(self):
+        return f"{self.index} ({self.customer_id})"
+
+
+class IngestionGeneration(models.Model):
+    """Single-row counter the ETL loader increments in the same transaction as every load that wrote customers.
+    Cached API responses are keyed on it, so a load makes all of them stale at once."""
+
+    class Meta:
+        db_table = "ingestion_generation"
+
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"generation {self.value}"
+
+
+class CustomerRollup(models.Model):
+    """Customers per country, city and subscription month. The ETL loader applies the delta of every load in the same
+    transaction as the rows, so the totals always match the customer table."""
+
+    class Meta:
+        db_table = "customer_rollup"
+        constraints = [
+            models.UniqueConstraint(fields=["country", "city", "subscription_month"], name="customer_rollup_group"),
+        ]
+
+    country = models.CharField(max_length=100)
+    city = models.CharField(max_length=100)
+    # First day of the month
+    subscription_month = models.DateField()
+    customer_count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.country} / {self.city} / {self.subscription_month:%Y-%m}: {self.customer_count}"
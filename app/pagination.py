@@ -1,6 +1,22 @@
-from rest_framework.pagination import CursorPagination
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomerCursorPagination(CursorPagination):
     page_size = 20
     ordering = "-ingested_at"
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class CustomerSearchPagination(PageNumberPagination):
+    # Results are ordered by rank, which a cursor cannot seek on
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class CustomerRollupPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
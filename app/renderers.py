@@ -0,0 +1,17 @@
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(BaseRenderer):
+    """Same output as DRF's compact JSONRenderer, encoded by orjson. Datetimes in UTC end in "Z" and dates are
+    ISO 8601, as DRF's DateTimeField and DateField write them, so rows from .values() need no serializer."""
+
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b""
+        return orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_UTC_Z)
@@ -6,4 +6,14 @@ from app.models import Customer
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
-        fields = "__all__"
+        exclude = ["content_hash", "search_vector"]
+
+
+# The serializer's fields in its order, for list views that fetch plain dicts with .values()
+CUSTOMER_FIELDS = [
+    field.name for field in Customer._meta.concrete_fields if field.name not in CustomerSerializer.Meta.exclude
+]
+
+
+class CustomerSearchSerializer(CustomerSerializer):
+    rank = serializers.FloatField(read_only=True)
@@ -1,17 +1,32 @@
+import io
+import json
 from datetime import date, datetime
+from unittest import mock
 
+import polars as pl
 import pytz
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
-from app.models import Customer
+from app.cache import current_generation
+from app.filters import CustomerFilter
+from app.models import SEARCH_CONFIG, Customer, CustomerRollup, IngestionGeneration
+from app.pagination import CustomerCursorPagination
+from app.serializers import CustomerSerializer
+from app.views import CustomerListView
 
 
 class CustomerListViewTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.url = reverse("customer-list-view")
 
@@ -82,3 +97,304 @@ class CustomerListViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data["results"]), 1)
         self.assertEqual(response.data["results"][0]["first_name"], "Bob")
+
+    def test_content_hash_is_not_exposed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("content_hash", response.data["results"][0])
+
+    def test_repeated_request_is_served_from_cache(self):
+        first = self.client.get(f"{self.url}?city=Berlin&ordering=first_name")
+        self.assertEqual(first["X-Cache"], "MISS")
+
+        # Same parameters in another order: only the token and the generation lookups reach the database
+        with self.assertNumQueries(2):
+            second = self.client.get(f"{self.url}?ordering=first_name&city=Berlin")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.data, first.data)
+
+        other = self.client.get(f"{self.url}?city=Munich")
+        self.assertEqual(other["X-Cache"], "MISS")
+        self.assertEqual(other.data["results"][0]["first_name"], "Bob")
+
+    def test_load_invalidates_cached_responses(self):
+        self.client.get(self.url)
+        self.customer1.delete()
+
+        self.assertEqual(len(self.client.get(self.url).data["results"]), 2)
+
+        # The ETL loader bumps the generation after writing rows
+        IngestionGeneration.objects.create(pk=1, value=1)
+        self.assertEqual(current_generation(), 1)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_fast_path_matches_serializer_output(self):
+        self.customer2.ingested_at = datetime(2025, 3, 22, 8, 30, 15, 123456, tzinfo=pytz.UTC)
+        self.customer2.save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "application/json")
+
+        serialized = CustomerSerializer(Customer.objects.order_by("-ingested_at"), many=True).data
+        expected = json.loads(JSONRenderer().render(serialized))
+        self.assertEqual(json.loads(response.content)["results"], expected)
+        self.assertEqual(expected[0]["ingested_at"], "2025-03-22T08:30:15.123456Z")
+
+    def test_page_size_is_capped(self):
+        response = self.client.get(f"{self.url}?page_size=1")
+        self.assertEqual([customer["first_name"] for customer in response.data["results"]], ["Bob"])
+
+        # Cursor links work on the plain rows too
+        response = self.client.get(response.data["next"])
+        self.assertEqual([customer["first_name"] for customer in response.data["results"]], ["Alice"])
+
+        with mock.patch.object(CustomerCursorPagination, "max_page_size", 1):
+            response = self.client.get(f"{self.url}?page_size=1000")
+        self.assertEqual(len(response.data["results"]), 1)
+
+
+class CustomerSearchViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("customer-search-view")
+
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        for index, (first_name, last_name, company, city) in enumerate(
+            [
+                ("Alice", "Smith", "Alpha Corp", "Berlin"),
+                ("Bob", "Alice", "Beta Inc", "Munich"),
+                ("Carol", "Jones", "Alice Holdings", "Berlin"),
+            ],
+            start=1,
+        ):
+            Customer.objects.create(
+                index=index,
+                customer_id=f"CUST00{index}",
+                first_name=first_name,
+                last_name=last_name,
+                company=company,
+                city=city,
+                country="Germany",
+                email=f"{first_name.lower()}@example.com",
+                subscription_date=date(2024, 5, index),
+                source_file="customers.csv",
+                ingested_at=datetime(2025, 3, 20 + index, tzinfo=pytz.UTC),
+            )
+
+    def test_matches_are_ranked_by_field_weight(self):
+        response = self.client.get(f"{self.url}?q=alice")
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        # Names outrank the company
+        self.assertEqual([customer["index"] for customer in results], [1, 2, 3])
+        self.assertGreater(results[0]["rank"], results[2]["rank"])
+        self.assertNotIn("search_vector", results[0])
+
+    def test_all_words_must_match(self):
+        response = self.client.get(f"{self.url}?q=alice berlin")
+        self.assertEqual([customer["index"] for customer in response.data["results"]], [1, 3])
+
+    def test_combines_with_filters(self):
+        response = self.client.get(f"{self.url}?q=alice&city=Munich")
+        self.assertEqual([customer["first_name"] for customer in response.data["results"]], ["Bob"])
+
+    def test_query_is_required(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("q", response.data)
+
+
+class CustomerExportViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        for index, city in enumerate(["Berlin", "Munich", "Berlin"], start=1):
+            Customer.objects.create(
+                index=index,
+                customer_id=f"CUST00{index}",
+                first_name=f"First{index}",
+                last_name="Smith",
+                company="Alpha, Corp",
+                city=city,
+                country="Germany",
+                email=f"customer{index}@example.com",
+                subscription_date=date(2024, 5, index),
+                source_file="customers.csv",
+                ingested_at=datetime(2025, 3, 20 + index, tzinfo=pytz.UTC),
+            )
+
+    def export(self, export_format: str, query: str = ""):
+        response = self.client.get(reverse("customer-export-view", args=[export_format]) + query)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_csv_export_streams_all_chunks_with_one_header(self):
+        response, body = self.export("csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="customers.csv"', response["Content-Disposition"])
+
+        frame = pl.read_csv(io.BytesIO(body))
+        self.assertEqual(frame["index"].to_list(), [1, 2, 3])
+        self.assertEqual(frame["company"][0], "Alpha, Corp")
+        self.assertEqual(frame["ingested_at"][0], "2025-03-21T00:00:00.000000+00:00")
+        self.assertNotIn("content_hash", frame.columns)
+
+    def test_ndjson_export_honours_filters(self):
+        _, body = self.export("ndjson", "?city=Berlin")
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([record["index"] for record in records], [1, 3])
+        self.assertEqual(records[0]["subscription_date"], "2024-05-01")
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_parquet_export_keeps_types(self):
+        _, body = self.export("parquet", "?start_date=2025-03-22")
+        frame = pl.read_parquet(io.BytesIO(body))
+        self.assertEqual(frame["index"].to_list(), [2, 3])
+        self.assertEqual(frame.schema["subscription_date"], pl.Date)
+        self.assertEqual(frame.schema["ingested_at"], pl.Datetime("us", "UTC"))
+
+    def test_empty_export_still_has_columns(self):
+        _, body = self.export("parquet", "?city=Paris")
+        self.assertEqual(pl.read_parquet(io.BytesIO(body)).columns[:2], ["index", "customer_id"])
+        _, body = self.export("csv", "?city=Paris")
+        self.assertTrue(body.startswith(b"index,customer_id,"))
+
+    def test_unknown_format_is_not_found(self):
+        response = self.client.get(reverse("customer-export-view", args=["xlsx"]))
+        self.assertEqual(response.status_code, 404)
+
+
+class CustomerRollupViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("customer-rollup-view")
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        # What the ETL loader leaves behind
+        CustomerRollup.objects.bulk_create(
+            CustomerRollup(country=country, city=city, subscription_month=month, customer_count=count)
+            for country, city, month, count in [
+                ("Germany", "Berlin", date(2024, 5, 1), 3),
+                ("Germany", "Berlin", date(2024, 6, 1), 2),
+                ("Germany", "Munich", date(2024, 6, 1), 4),
+                ("France", "Paris", date(2024, 6, 1), 1),
+                ("France", "Lyon", date(2024, 6, 1), 0),
+            ]
+        )
+
+    def test_counts_per_country(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["results"], [{"country": "France", "customers": 1}, {"country": "Germany", "customers": 9}]
+        )
+
+    def test_group_by_city_and_month_with_filters(self):
+        response = self.client.get(f"{self.url}?group_by=city,month&country=germ&start_date=2024-06-15")
+        self.assertEqual(
+            json.loads(response.content)["results"],
+            [
+                {"city": "Berlin", "month": "2024-06-01", "customers": 2},
+                {"city": "Munich", "month": "2024-06-01", "customers": 4},
+            ],
+        )
+
+    def test_empty_groups_are_left_out(self):
+        response = self.client.get(f"{self.url}?group_by=city&country=France")
+        self.assertEqual([row["city"] for row in response.data["results"]], ["Paris"])
+
+    def test_unknown_group_is_rejected(self):
+        response = self.client.get(f"{self.url}?group_by=country,email")
+        self.assertEqual(response.status_code, 400)
+
+
+class CustomerIndexTest(TestCase):
+    """Checks the query plans of the API's queries against 1M customers"""
+
+    ROWS = 1_000_000
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            # The rows span January to mid-April 2025, one partition per month as the ETL would create them
+            for month in range(1, 5):
+                cursor.execute(
+                    f"CREATE TABLE customer_2025_{month:02} PARTITION OF customer "
+                    f"FOR VALUES FROM ('2025-{month:02}-01 00:00+00') TO ('2025-{month + 1:02}-01 00:00+00')"
+                )
+            cursor.execute(
+                """
+                INSERT INTO customer (
+                    index, customer_id, first_name, last_name, company, city, country,
+                    email, subscription_date, source_file, ingested_at
+                )
+                SELECT
+                    i, 'C' || i, 'First' || mod(i, 7919), 'Last' || mod(i, 6007), 'Company ' || mod(i, 10007),
+                    'City ' || mod(i, 5003), 'Country ' || mod(i, 199), 'customer' || i || '@example.com',
+                    DATE '2020-01-01' + mod(i, 1800), 'bench.csv', TIMESTAMPTZ '2025-01-01' + i * INTERVAL '9 seconds'
+                FROM generate_series(1, %s) AS i
+                """,
+                [cls.ROWS],
+            )
+            cursor.execute("ANALYZE customer")
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            cls.has_trigram = cursor.fetchone() is not None
+
+    def page_plan(self, params: dict, ordering: str = "-ingested_at") -> str:
+        queryset = CustomerFilter(params, queryset=Customer.objects.all()).qs.order_by(ordering)
+        return queryset[:21].explain()
+
+    # Each partition carries its own copy of the model's indexes, named customer_<partition>_<suffix>
+    def test_first_page_reads_ingested_at_index(self):
+        plan = self.page_plan({})
+        self.assertIn("customer_2025_04_ingested_at_idx", plan)
+        self.assertNotIn("Seq Scan", plan)
+
+    def test_date_range_reads_one_partition(self):
+        plan = self.page_plan({"start_date": "2025-02-05", "end_date": "2025-02-06"})
+        self.assertIn("customer_2025_02_ingested_at_idx", plan)
+        for partition in ("customer_2025_01", "customer_2025_03", "customer_default"):
+            self.assertNotIn(partition, plan)
+        self.assertNotIn("Seq Scan", plan)
+
+    def test_ordering_reads_subscription_date_index(self):
+        self.assertIn("_subscription_date_idx", self.page_plan({}, ordering="subscription_date"))
+
+    def test_country_and_city_read_composite_index(self):
+        plan = Customer.objects.filter(country="Country 7", city="City 42").explain()
+        self.assertIn("customer_2025_01_country_city_idx", plan)
+
+    def test_city_filter_is_a_plain_ilike(self):
+        queryset = CustomerFilter({"city": "ity 42"}, queryset=Customer.objects.all()).qs
+        self.assertIn('"customer"."city" ILIKE', str(queryset.query))
+        # Wildcards in the term are matched literally
+        self.assertFalse(CustomerFilter({"city": "%"}, queryset=Customer.objects.all()).qs.exists())
+
+    def test_full_text_search_reads_search_vector_index(self):
+        query = SearchQuery("First42 Last42", config=SEARCH_CONFIG, search_type="websearch")
+        plan = Customer.objects.filter(search_vector=query).explain()
+        self.assertIn("customer_2025_01_search_vector_idx", plan)
+
+    def test_search_reads_trigram_indexes(self):
+        if not self.has_trigram:
+            self.skipTest("pg_trgm is not installed on this PostgreSQL server")
+        search = Q()
+        for field in CustomerListView.search_fields:
+            search |= Q(**{field: "ity 4221"})
+        plan = Customer.objects.filter(search).order_by("-ingested_at")[:21].explain()
+        self.assertIn("_city_trgm", plan)
+        self.assertNotIn("Seq Scan", plan)
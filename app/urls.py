@@ -1,7 +1,10 @@
 from django.urls import path
 
-from app.views import CustomerListView
+from app.views import CustomerExportView, CustomerListView, CustomerRollupView, CustomerSearchView
 
 urlpatterns = [
     path("api/customers/", CustomerListView.as_view(), name="customer-list-view"),
+    path("api/customers/search/", CustomerSearchView.as_view(), name="customer-search-view"),
+    path("api/customers/rollups/", CustomerRollupView.as_view(), name="customer-rollup-view"),
+    path("api/customers/export/<str:export_format>/", CustomerExportView.as_view(), name="customer-export-view"),
 ]
@@ -1,18 +1,60 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BigIntegerField, F, Sum
+from django.db.models.functions import Cast
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, generics
 from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
 
-from app.filters import CustomerFilter
-from app.models import Customer
-from app.pagination import CustomerCursorPagination
-from app.serializers import CustomerSerializer
+from app.cache import current_generation, response_cache_key
+from app.export import EXPORT_FORMATS, customer_batches
+from app.filters import CustomerFilter, CustomerRollupFilter, FullTextSearchFilter
+from app.models import Customer, CustomerRollup
+from app.pagination import CustomerCursorPagination, CustomerRollupPagination, CustomerSearchPagination
+from app.renderers import ORJSONRenderer
+from app.serializers import CUSTOMER_FIELDS, CustomerSearchSerializer, CustomerSerializer
 
 
-class CustomerListView(generics.ListAPIView):
-    queryset = Customer.objects.all()
+class CachedListMixin:
+    """Serves repeated list requests from the cache until the next ETL load"""
+
+    def list(self, request, *args, **kwargs):
+        # The data only changes when the ETL loads, which bumps the generation and so retires every cached page
+        cache_key = response_cache_key(request, current_generation())
+        data = cache.get(cache_key)
+        if data is not None:
+            response = Response(data)
+            response["X-Cache"] = "HIT"
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        cache.set(cache_key, response.data, settings.API_CACHE_TIMEOUT)
+        response["X-Cache"] = "MISS"
+        return response
+
+
+class ValuesListMixin:
+    """Lists rows fetched with .values() as plain dicts, which the renderer encodes directly. The queryset must select
+    exactly the serializer's fields; serializer_class stays for the schema and the browsable API."""
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(list(queryset))
+
+
+class CustomerListView(CachedListMixin, ValuesListMixin, generics.ListAPIView):
+    queryset = Customer.objects.values(*CUSTOMER_FIELDS)
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
     serializer_class = CustomerSerializer
     pagination_class = CustomerCursorPagination
     filter_backends = [
@@ -22,4 +64,83 @@ class CustomerListView(generics.ListAPIView):
     ]
     filterset_class = CustomerFilter
     ordering_fields = ["ingested_at", "subscription_date", "city", "first_name"]
-    search_fields = ["first_name", "last_name", "email", "company", "city", "country"]
+    # __ilike instead of SearchFilter's default icontains, see app/lookups.py
+    search_fields = [
+        "first_name__ilike",
+        "last_name__ilike",
+        "email__ilike",
+        "company__ilike",
+        "city__ilike",
+        "country__ilike",
+    ]
+
+
+class CustomerSearchView(CachedListMixin, ValuesListMixin, generics.ListAPIView):
+    """Ranked full-text search over names, company, email, city and country, e.g. ?q=alice berlin"""
+
+    # FullTextSearchFilter adds the rank to each row
+    queryset = Customer.objects.values(*CUSTOMER_FIELDS)
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+    serializer_class = CustomerSearchSerializer
+    pagination_class = CustomerSearchPagination
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter]
+    filterset_class = CustomerFilter
+
+
+class CustomerRollupView(CachedListMixin, ValuesListMixin, generics.ListAPIView):
+    """Customer counts per ?group_by= (any of country, city, month; default country) from the rollup the ETL
+    maintains, e.g. ?group_by=country,month&start_date=2024-01-01"""
+
+    queryset = CustomerRollup.objects.all()
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [ORJSONRenderer]
+    pagination_class = CustomerRollupPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = CustomerRollupFilter
+    group_by_choices = ("country", "city", "month")
+
+    def get_group_by(self) -> list[str]:
+        group_by = [name.strip() for name in self.request.query_params.get("group_by", "country").split(",")]
+        if any(name not in self.group_by_choices for name in group_by):
+            raise ValidationError({"group_by": f"Expected a comma-separated subset of {list(self.group_by_choices)}"})
+        return list(dict.fromkeys(group_by))
+
+    def filter_queryset(self, queryset):
+        group_by = self.get_group_by()
+        # Grouping columns keep their own names; month is an alias, as model fields cannot be aliased to themselves
+        fields = [name for name in group_by if name != "month"]
+        aliases = {"month": F("subscription_month")} if "month" in group_by else {}
+        return (
+            super()
+            .filter_queryset(queryset)
+            .values(*fields, **aliases)
+            # PostgreSQL sums bigints as numeric
+            .annotate(customers=Cast(Sum("customer_count"), BigIntegerField()))
+            .filter(customers__gt=0)
+            .order_by(*group_by)
+        )
+
+
+class CustomerExportView(generics.GenericAPIView):
+    """Streams every customer matching the CustomerFilter parameters as CSV, NDJSON or Parquet in one response"""
+
+    queryset = Customer.objects.order_by("index")
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = CustomerFilter
+
+    def get(self, request, export_format: str):
+        if export_format not in EXPORT_FORMATS:
+            raise NotFound(f"Unsupported export format '{export_format}', expected one of {list(EXPORT_FORMATS)}")
+
+        content_type, stream = EXPORT_FORMATS[export_format]
+        # Rows are only read while the response is sent, one chunk at a time
+        response = StreamingHttpResponse(
+            stream(customer_batches(self.filter_queryset(self.get_queryset()))), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="customers.{export_format}"'
+        return response
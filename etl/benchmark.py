@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+
+import polars as pl
+import structlog
+from ingest import LOG_DIR, DataIngestor
+from load import BUMP_GENERATION_SQL, LOAD_MODES, ROLLUP_DELTA_CTE, DataLoader, get_db_connection
+from transform import DataTransformer
+
+logger = structlog.get_logger()
+
+# Same columns as customers-100.csv
+CUSTOMER_SCHEMA = (
+    "Index",
+    "Customer Id",
+    "First Name",
+    "Last Name",
+    "Company",
+    "City",
+    "Country",
+    "Phone 1",
+    "Phone 2",
+    "Email",
+    "Subscription Date",
+    "Website",
+)
+FORMATS = ("csv", "json", "ndjson")
+STAGES = ("transform", "parse", "load")
+
+# Generated customers start at this index so the load stage can find and delete them afterwards
+BENCHMARK_INDEX_OFFSET = 1_900_000_000
+DUPLICATE_EVERY = 100  # every 100th row repeats the previous one, so dedup has work to do
+GENERATE_BATCH_SIZE = 1_000_000
+
+FIRST_NAMES = ["Alice", "Bob", "Carol", "Dmitri", "Esther", "Farid", "Grace", "Hiro", "Ines", "Jamal"]
+LAST_NAMES = ["Smith", "Jones", "Garcia", "Nguyen", "Okafor", "Schmidt", "Rossi", "Kowalski", "Tanaka", "Silva"]
+COMPANY_SUFFIXES = ["Ltd", "Inc", "LLC", "and Sons", "Group", "PLC"]
+# Padded on purpose, so the transform has whitespace to trim
+CITIES = ["Berlin", " Munich", "Paris ", "Lagos", "Osaka", " Lima ", "Austin", "Nairobi"]
+COUNTRIES = ["Germany", "France", "Nigeria", "Japan", "Peru", "United States", "Kenya"]
+
+
+def _pick(values: list[str], salt: int) -> pl.Expr:
+    return (pl.col("key").hash(salt) % len(values)).cast(pl.Int64).replace_strict(dict(enumerate(values)))
+
+
+def synthetic_customers(start: int, stop: int) -> pl.DataFrame:
+    """Rows start..stop-1 of a deterministic customer data set shaped like customers-100.csv"""
+    row = pl.int_range(start, stop, eager=True, dtype=pl.Int64)
+    key = row - (row % DUPLICATE_EVERY == DUPLICATE_EVERY - 1).cast(pl.Int64)
+
+    return pl.DataFrame({"key": key}).select(
+        (pl.col("key") + BENCHMARK_INDEX_OFFSET).alias("Index"),
+        pl.format("BENCH{}", pl.col("key").cast(pl.Utf8).str.zfill(10)).alias("Customer Id"),
+        _pick(FIRST_NAMES, 1).alias("First Name"),
+        _pick(LAST_NAMES, 2).alias("Last Name"),
+        pl.format("{} {}", _pick(LAST_NAMES, 3), _pick(COMPANY_SUFFIXES, 4)).alias("Company"),
+        _pick(CITIES, 5).alias("City"),
+        _pick(COUNTRIES, 6).alias("Country"),
+        pl.format("+1-555-{}", (pl.col("key") * 7919 % 10_000_000).cast(pl.Utf8).str.zfill(7)).alias("Phone 1"),
+        pl.format("001-{}", (pl.col("key") * 104_729 % 10_000_000_000).cast(pl.Utf8).str.zfill(10)).alias("Phone 2"),
+        pl.format("customer{}@example.com", pl.col("key")).alias("Email"),
+        (pl.date(2020, 1, 1) + pl.duration(days=pl.col("key") % 1800))
+        .dt.strftime("%Y-%m-%d")
+        .alias("Subscription Date"),
+        pl.format("https://www.example{}.com/", pl.col("key") % 5000).alias("Website"),
+    )
+
+
+def generate_file(path: Path, rows: int, file_format: str) -> Path:
+    """Writes the synthetic data set GENERATE_BATCH_SIZE rows at a time, so 50M-row files fit in memory"""
+    with open(path, "wb") as f:
+        if file_format == "json":
+            f.write(b"[")
+        for number, start in enumerate(range(0, rows, GENERATE_BATCH_SIZE)):
+            batch = synthetic_customers(start, min(start + GENERATE_BATCH_SIZE, rows))
+            if file_format == "csv":
+                batch.write_csv(f, include_header=number == 0)
+            elif file_format == "ndjson":
+                batch.write_ndjson(f)
+            else:
+                # Strip each batch's array brackets so the batches join into one JSON array
+                if number:
+                    f.write(b",")
+                f.write(batch.write_json().encode("utf-8")[1:-1])
+        if file_format == "json":
+            f.write(b"]")
+    return path
+
+
+def _peak_rss_mb() -> float:
+    # On Linux ru_maxrss survives exec, so a spawned child would report its parent's peak; VmHWM starts fresh
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _read_transformed(path: Path) -> pl.DataFrame:
+    transformer = DataTransformer()
+    if path.suffix == ".csv":
+        frame = pl.scan_csv(path)
+    elif path.suffix == ".ndjson":
+        frame = transformer.flatten_frame(pl.scan_ndjson(path))
+    else:
+        frame = transformer.flatten_frame(pl.read_json(path))
+    return transformer.transform(frame, source_file=path.name)
+
+
+class _NullLoader:
+    """Keeps the parse stage away from the database"""
+
+    @staticmethod
+    def load_to_db(df: pl.DataFrame | None) -> bool:
+        return True
+
+
+def _delete_benchmark_rows():
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cursor:
+            # Takes the deleted customers back out of the rollup and the key table as well
+            cursor.execute(
+                f"""
+                WITH removed AS (
+                    DELETE FROM customer WHERE index >= %s RETURNING country, city, subscription_date
+                ),
+                released AS (
+                    DELETE FROM customer_key WHERE index >= %s
+                ),
+                delta AS (
+                    SELECT country, city, subscription_date, -1 AS customers FROM removed
+                ),
+                {ROLLUP_DELTA_CTE}
+                SELECT count(*) FROM removed;
+                """,
+                (BENCHMARK_INDEX_OFFSET, BENCHMARK_INDEX_OFFSET),
+            )
+            if cursor.fetchone()[0]:
+                cursor.execute(BUMP_GENERATION_SQL)
+    finally:
+        conn.close()
+
+
+def _run_stage(stage: str, path: Path, output_dir: str, load_mode: str) -> dict:
+    """Runs one stage in the current (fresh) process and times only the part the stage is about"""
+    baseline_rss_mb = _peak_rss_mb()
+
+    if stage == "transform":
+        started_at = time.perf_counter()
+        _read_transformed(path)
+        wall_s = time.perf_counter() - started_at
+
+    elif stage == "parse":
+        ingestor = DataIngestor(download_dir=str(path.parent), transformed_dir=output_dir)
+        ingestor.loader = _NullLoader()
+        started_at = time.perf_counter()
+        if not ingestor.process_file(path):
+            raise RuntimeError(f"DataIngestor could not process {path.name}")
+        wall_s = time.perf_counter() - started_at
+
+    else:
+        df = _read_transformed(path)
+        _delete_benchmark_rows()
+        loader = DataLoader(load_mode=load_mode)
+        started_at = time.perf_counter()
+        loaded = loader.load_to_db(df)
+        wall_s = time.perf_counter() - started_at
+        loader.close()
+        _delete_benchmark_rows()
+        if not loaded:
+            raise RuntimeError("DataLoader.load_to_db failed, see the sql_bulk_insert_failed event")
+
+    return {
+        "wall_s": round(wall_s, 3),
+        "baseline_rss_mb": round(baseline_rss_mb, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def _run_stage_in_child(*args) -> dict:
+    # A fresh process per stage, so peak RSS belongs to that stage alone and no cache carries over between stages
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_run_stage, *args).result()
+
+
+def run_benchmark(
+    row_counts: list[int],
+    formats: list[str],
+    stages: list[str],
+    load_modes: list[str],
+    work_dir: str,
+) -> dict:
+    results = []
+    output_dir = os.path.join(work_dir, "transformed")
+    os.makedirs(output_dir, exist_ok=True)
+
+    for rows in row_counts:
+        for file_format in formats:
+            path = Path(work_dir, f"customers-{rows}.{file_format}")
+            if not path.exists():
+                started_at = time.perf_counter()
+                generate_file(path, rows, file_format)
+                logger.info(
+                    "benchmark_file_generated", file=path.name, seconds=round(time.perf_counter() - started_at, 2)
+                )
+
+            for stage in stages:
+                for load_mode in load_modes if stage == "load" else [None]:
+                    result = {"stage": stage, "format": file_format, "rows": rows}
+                    if load_mode:
+                        result["load_mode"] = load_mode
+                    try:
+                        measured = _run_stage_in_child(stage, path, output_dir, load_mode)
+                        result.update(
+                            ok=True,
+                            rows_per_sec=round(rows / measured["wall_s"]) if measured["wall_s"] else None,
+                            **measured,
+                        )
+                    except Exception as e:
+                        result.update(ok=False, error=str(e))
+                    logger.info("benchmark_stage_measured", **result)
+                    results.append(result)
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "polars": pl.__version__,
+        },
+        "results": results,
+    }
+
+
+def _result_key(result: dict) -> tuple:
+    return result["stage"], result["format"], result["rows"], result.get("load_mode")
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """Stages whose throughput fell more than tolerance (0.2 = 20%) below the baseline report's"""
+    previous = {_result_key(result): result for result in baseline["results"] if result.get("ok")}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get(_result_key(result))
+        if before is None:
+            continue
+        if not result.get("ok") or result["rows_per_sec"] < before["rows_per_sec"] * (1 - tolerance):
+            regressions.append(
+                {
+                    "stage": result["stage"],
+                    "format": result["format"],
+                    "rows": result["rows"],
+                    "load_mode": result.get("load_mode"),
+                    "baseline_rows_per_sec": before["rows_per_sec"],
+                    "rows_per_sec": result.get("rows_per_sec"),
+                }
+            )
+    return regressions
+
+
+def row_count(value: str) -> int:
+    """Parses 10000, 10k, 1M or 50m"""
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = value[-1].lower()
+    if suffix in multipliers:
+        return int(float(value[:-1]) * multipliers[suffix])
+    return int(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ETL stages on synthetic customer files")
+    parser.add_argument("--rows", type=row_count, nargs="+", default=[10_000, 100_000], help="e.g. 10k 1M 50M")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=["csv", "json"])
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=["transform", "parse"],
+        help="'load' writes to the PostgreSQL configured by DB_* and deletes the benchmark rows afterwards",
+    )
+    parser.add_argument("--load-modes", nargs="+", choices=LOAD_MODES, default=["copy"])
+    parser.add_argument("--work-dir", help="Where generated files are kept and reused (default: a temporary dir)")
+    parser.add_argument("--report", default=os.path.join(LOG_DIR, "benchmark_report.json"))
+    parser.add_argument("--baseline", help="Earlier report to compare rows/sec against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed rows/sec drop against the baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = run_benchmark(args.rows, args.formats, args.stages, args.load_modes, args.work_dir or tmp_dir)
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info("benchmark_report_written", report=args.report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        if regressions:
+            logger.error("benchmark_regressions_found", regressions=regressions)
+            sys.exit(1)
+        logger.info("benchmark_no_regressions", baseline=args.baseline)
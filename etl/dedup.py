@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+from collections.abc import Callable
+
+import polars as pl
+import structlog
+from decouple import config
+
+logger = structlog.get_logger()
+
+DEDUP_PATH = config("ETL_DEDUP_PATH", default="etl/dedup.sqlite3")
+
+# customer_key holds every loaded index and customer_id once, so a row repeating either one can never land
+KEY_COLUMNS = ("index", "customer_id")
+
+
+class DedupIndex:
+    """On-disk set of the customer keys that were already loaded, consulted before each load so rows the database
+    would reject or skip are dropped in-process. The SQLite file can be shared by several processes.
+
+    The set only grows, while PostgreSQL releases keys when a partition is archived or the table is truncated or
+    restored. Given `loaded_keys`, filter_new confirms its hits against customer_key and forgets the stale ones."""
+
+    def __init__(self, path: str = DEDUP_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS seen_index (key INTEGER PRIMARY KEY)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS seen_customer_id (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.checked = 0
+        self.batch_duplicates = 0
+        self.seen_before = 0
+        self.released = 0
+
+    @staticmethod
+    def _key_columns(df: pl.DataFrame) -> list[str]:
+        return [col for col in KEY_COLUMNS if col in df.columns]
+
+    def _seen_rows(self, keys: pl.DataFrame) -> pl.Series:
+        """Row numbers of the frame whose index or customer_id is already in the index"""
+        key_columns = keys.columns[1:]
+        placeholders = ", ".join("?" * keys.width)
+        clauses = " OR ".join(f"EXISTS (SELECT 1 FROM seen_{col} s WHERE s.key = c.[{col}])" for col in key_columns)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS candidate (row INTEGER, [index] INTEGER, customer_id TEXT)"
+            )
+            self._conn.executemany(
+                f"INSERT INTO candidate (row, {', '.join(f'[{col}]' for col in key_columns)}) VALUES ({placeholders})",
+                keys.iter_rows(),
+            )
+            rows = self._conn.execute(f"SELECT row FROM candidate c WHERE {clauses}").fetchall()
+            # Rolling back empties the candidate table for the next frame
+            self._conn.rollback()
+        return pl.Series("row", [row for (row,) in rows], dtype=pl.Int64)
+
+    def _confirm(self, hits: pl.DataFrame, loaded_keys: Callable[[str, list], set]) -> pl.Series:
+        """Row numbers of the hits whose index or customer_id PostgreSQL still holds; the other keys are forgotten"""
+        still_loaded = pl.repeat(False, hits.height, eager=True)
+        for col in hits.columns[1:]:
+            values = hits.get_column(col)
+            present = pl.Series(list(loaded_keys(col, values.drop_nulls().to_list())), dtype=values.dtype)
+            in_db = values.is_in(present)
+            still_loaded = still_loaded | in_db
+            stale = values.filter(~in_db).drop_nulls()
+            if stale.len():
+                with self._lock, self._conn:
+                    self._conn.executemany(f"DELETE FROM seen_{col} WHERE key = ?", ((v,) for v in stale))
+        return hits.get_column("row").filter(still_loaded)
+
+    def filter_new(self, df: pl.DataFrame, loaded_keys: Callable[[str, list], set] | None = None) -> pl.DataFrame:
+        """Drops rows whose keys were loaded before or repeat an earlier row of the same frame. `loaded_keys(column,
+        values)` returns the values customer_key still holds; without it the local set is trusted as is."""
+        key_columns = self._key_columns(df)
+        if not key_columns or df.is_empty():
+            return df
+
+        keys = df.select(
+            pl.int_range(pl.len(), dtype=pl.Int64).alias("row"),
+            *[pl.col(col).cast(pl.Int64 if col == "index" else pl.Utf8) for col in key_columns],
+        )
+        # Keep the first row per key inside the frame, like the database would
+        is_first = keys.select(pl.all_horizontal([pl.col(col).is_first_distinct() for col in key_columns])).to_series()
+        seen = self._seen_rows(keys.filter(is_first))
+        released = 0
+        if loaded_keys is not None and seen.len():
+            confirmed = self._confirm(keys.filter(pl.col("row").is_in(seen)), loaded_keys)
+            released = seen.len() - confirmed.len()
+            seen = confirmed
+        result = df.filter(is_first & ~keys["row"].is_in(seen))
+
+        batch_duplicates = df.height - int(is_first.sum())
+        self.checked += df.height
+        self.batch_duplicates += batch_duplicates
+        self.seen_before += seen.len()
+        self.released += released
+        logger.info(
+            "dedup_filtered",
+            rows=df.height,
+            batch_duplicates=batch_duplicates,
+            seen_before=seen.len(),
+            released=released,
+            passed=result.height,
+        )
+        return result
+
+    def record(self, df: pl.DataFrame):
+        """Adds the keys of a frame that made it into the database"""
+        with self._lock, self._conn:
+            for col in self._key_columns(df):
+                values = df.get_column(col).cast(pl.Int64 if col == "index" else pl.Utf8).drop_nulls()
+                self._conn.executemany(f"INSERT OR IGNORE INTO seen_{col} (key) VALUES (?)", ((v,) for v in values))
+
+    def metrics(self) -> dict:
+        dropped = self.batch_duplicates + self.seen_before
+        return {
+            "checked": self.checked,
+            "batch_duplicates": self.batch_duplicates,
+            "seen_before": self.seen_before,
+            # Local hits PostgreSQL had released, which were loaded again
+            "released": self.released,
+            # Share of rows that never had to travel to PostgreSQL
+            "hit_rate": round(dropped / self.checked, 4) if self.checked else None,
+        }
+
+    def close(self):
+        logger.info("dedup_index_metrics", **self.metrics())
+        self._conn.close()
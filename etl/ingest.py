@@ -1,15 +1,40 @@
 import argparse
-import json
+import asyncio
+import bz2
+import gzip
+import io
+import itertools
 import logging
+import multiprocessing
 import os
+import queue
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import BinaryIO
 
 import polars as pl
 import structlog
+import zstandard
 from alerts import AlertHandler
 from decouple import config
-from load import DataLoader
-from sftp_client import SFTPClientManager
+from dedup import DEDUP_PATH, DedupIndex
+from load import LOAD_MODE, LOAD_MODES, AsyncDataLoader, DataLoader
+from manifest import FileManifest, file_sha256
+from metrics import METRICS_DIR, METRICS_ENABLED, NULL_METRICS, RunMetrics
+from paramiko import SFTPAttributes
+from sftp_client import (
+    ASYNC_DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_CONCURRENCY,
+    PART_SUFFIX,
+    PROGRESS_SUFFIX,
+    AsyncSFTPClientManager,
+    PooledSFTPClientManager,
+    SFTPClientManager,
+)
 from tenacity import RetryError
 from transform import DataTransformer
 
@@ -29,99 +54,811 @@ logger = structlog.get_logger()
 LOG_DIR = "etl/logs"  # We could move this to .env. Keeping it here for simplicity
 DOWNLOAD_DIR = "etl/downloads"  # We could move this to .env. Keeping it here for simplicity
 TRANSFORMED_DIR = "etl/transformed"  # We could move this to .env. Keeping it here for simplicity
+CHUNK_SIZE = config("ETL_CHUNK_SIZE", cast=int, default=0)  # 0 reads each file in one go
+INCREMENTAL = config("ETL_INCREMENTAL", cast=bool, default=False)
+STAGED = config("ETL_STAGED", cast=bool, default=False)
+ASYNC = config("ETL_ASYNC", cast=bool, default=False)
+TRANSFORM_WORKERS = config("ETL_TRANSFORM_WORKERS", cast=int, default=1)
+LOAD_WORKERS = config("ETL_LOAD_WORKERS", cast=int, default=1)
+QUEUE_SIZE = config("ETL_QUEUE_SIZE", cast=int, default=4)
+DEDUP = config("ETL_DEDUP", cast=bool, default=False)
+FILE_WORKERS = config("ETL_FILE_WORKERS", cast=int, default=1)  # > 1 parses downloaded files in worker processes
+
+# "source" keeps CSV as CSV and writes every JSON flavour as NDJSON; the columnar formats are much smaller and faster
+# to reread. Uncompressed IPC files can be memory-mapped by pl.read_ipc / pl.scan_ipc.
+OUTPUT_FORMATS = ("source", "csv", "ndjson", "parquet", "ipc")
+OUTPUT_EXTENSIONS = {"csv": ".csv", "ndjson": ".ndjson", "parquet": ".parquet", "ipc": ".arrow"}
+OUTPUT_FORMAT = config("ETL_OUTPUT_FORMAT", default="source")
+PARQUET_COMPRESSION = config("ETL_PARQUET_COMPRESSION", default="zstd")
+PARQUET_ROW_GROUP_SIZE = config("ETL_PARQUET_ROW_GROUP_SIZE", cast=int, default=0)  # 0 keeps the Polars default
+IPC_COMPRESSION = config("ETL_IPC_COMPRESSION", default="uncompressed")
 
 os.makedirs(LOG_DIR, exist_ok=True)
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 os.makedirs(TRANSFORMED_DIR, exist_ok=True)
 
 
+def _open_zstd(file_path: Path, mode: str) -> BinaryIO:
+    # zstandard's reader has no readline, which the line-based batch readers need
+    return io.BufferedReader(zstandard.open(file_path, mode))
+
+
+# customers.csv.gz and the like are decompressed while they are parsed; the suffix before this one picks the parser
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".zst": _open_zstd}
+
+
+def is_compressed(file_path: Path) -> bool:
+    return file_path.suffix.lower() in COMPRESSED_OPENERS and len(file_path.suffixes) > 1
+
+
+def source_path(file_path: Path) -> Path:
+    """The path without its compression suffix, e.g. customers.csv for customers.csv.gz"""
+    return file_path.with_suffix("") if is_compressed(file_path) else file_path
+
+
+def open_source(file_path: Path) -> BinaryIO:
+    """Opens a downloaded file for reading, decompressing it on the fly when it is compressed"""
+    if is_compressed(file_path):
+        return COMPRESSED_OPENERS[file_path.suffix.lower()](file_path, "rb")
+    return open(file_path, "rb")
+
+
 class DataIngestor:
-    def __init__(self, download_dir=DOWNLOAD_DIR, transformed_dir=TRANSFORMED_DIR, alert_handler=None):
+    def __init__(
+        self,
+        download_dir=DOWNLOAD_DIR,
+        transformed_dir=TRANSFORMED_DIR,
+        alert_handler=None,
+        load_mode=LOAD_MODE,
+        chunk_size=CHUNK_SIZE,
+        output_format=OUTPUT_FORMAT,
+        parquet_compression=PARQUET_COMPRESSION,
+        parquet_row_group_size=PARQUET_ROW_GROUP_SIZE,
+        ipc_compression=IPC_COMPRESSION,
+        file_workers=FILE_WORKERS,
+        dedup=DEDUP,
+        dedup_path=DEDUP_PATH,
+        metrics=None,
+    ):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format '{output_format}', expected one of {OUTPUT_FORMATS}")
         self.download_dir = download_dir
         self.transformed_dir = transformed_dir
         self.alert_handler = alert_handler or AlertHandler()
-        self.transformer = DataTransformer()
-        self.loader = DataLoader()
-
-    def _save_cleaned(self, base_filename: str, df: pl.DataFrame, original_extension: str):
+        self.chunk_size = chunk_size
+        self.output_format = output_format
+        self.parquet_compression = parquet_compression
+        self.parquet_row_group_size = parquet_row_group_size or None
+        self.ipc_compression = ipc_compression
+        self.file_workers = max(file_workers, 1)
+        self.metrics = metrics or NULL_METRICS
+        self.transformer = DataTransformer(metrics=self.metrics)
+        self.loader = DataLoader(
+            load_mode=load_mode, dedup_index=DedupIndex(dedup_path) if dedup else None, metrics=self.metrics
+        )
+        # Everything a worker process needs to build its own ingestor; the alert handler must be picklable
+        self.worker_config = {
+            "download_dir": download_dir,
+            "transformed_dir": transformed_dir,
+            "alert_handler": self.alert_handler,
+            "load_mode": load_mode,
+            "chunk_size": chunk_size,
+            "output_format": output_format,
+            "parquet_compression": parquet_compression,
+            "parquet_row_group_size": parquet_row_group_size,
+            "ipc_compression": ipc_compression,
+            "dedup": dedup,
+            "dedup_path": dedup_path,
+        }
+
+    def _output_extension(self, original_extension: str) -> str | None:
+        if self.output_format != "source":
+            return OUTPUT_EXTENSIONS[self.output_format]
+        if original_extension.lower() in (".json", ".ndjson", ".jsonl"):
+            return ".ndjson"
+        if original_extension.lower() == ".csv":
+            return ".csv"
+        return None
+
+    def _write_frame(self, df: pl.DataFrame, target, extension: str, include_header: bool = True):
+        source_file = df["source_file"][0] if "source_file" in df.columns and df.height else None
+        with self.metrics.timer("save", source_file) as record:
+            start = target.tell() if self.metrics.enabled and not isinstance(target, str) else 0
+            if extension == ".csv":
+                df.write_csv(target, include_header=include_header)
+            elif extension == ".ndjson":
+                df.write_ndjson(target)
+            elif extension == ".parquet":
+                df.write_parquet(
+                    target, compression=self.parquet_compression, row_group_size=self.parquet_row_group_size
+                )
+            elif extension == ".arrow":
+                df.write_ipc(target, compression=self.ipc_compression)
+
+            if self.metrics.enabled:
+                written = os.path.getsize(target) if isinstance(target, str) else target.tell() - start
+                record.update(rows=df.height, bytes=written)
+
+    def _save_cleaned(self, base_filename: str, df: pl.DataFrame, original_extension: str) -> bool:
         try:
-            output_path = os.path.join(self.transformed_dir, f"{base_filename}_transformed{original_extension}")
-
-            if original_extension.lower() == ".json":
-                df.write_json(output_path)
-            elif original_extension.lower() == ".csv":
-                df.write_csv(output_path)
-            else:
+            extension = self._output_extension(original_extension)
+            if extension is None:
                 self.alert_handler.alert("unsupported_output_format", format=original_extension)
-                return
+                return False
+
+            output_path = os.path.join(self.transformed_dir, f"{base_filename}_transformed{extension}")
+            self._write_frame(df, output_path, extension)
 
             logger.info("cleaned_file_saved", output_file=output_path, records=df.shape[0])
-            self.loader.load_to_db(df)
+            return self.loader.load_to_db(df)
 
         except Exception as e:
             self.alert_handler.alert("transformed_file_save_failed", file=base_filename, error=str(e))
+            return False
+
+    def _save_cleaned_chunks(self, base_filename: str, chunks: Iterable[pl.DataFrame], extension: str = ".csv") -> bool:
+        """Appends each transformed chunk to the output file and loads it, so only one chunk is held in memory.
+
+        Parquet and IPC files cannot be appended to, so those formats get one part file per chunk in a
+        `<name>_transformed/` directory, which `pl.scan_parquet` / `pl.scan_ipc` read back as a single frame.
+        """
+        extension = self._output_extension(extension)
+        output_path = os.path.join(self.transformed_dir, f"{base_filename}_transformed")
+        records = 0
+        loaded = True
+
+        if extension in (".parquet", ".arrow"):
+            os.makedirs(output_path, exist_ok=True)
+            for stale_part in Path(output_path).glob("part-*"):
+                stale_part.unlink()
+            for number, chunk in enumerate(chunks):
+                if not chunk.is_empty():
+                    self._write_frame(chunk, os.path.join(output_path, f"part-{number:05d}{extension}"), extension)
+                    loaded = self.loader.load_to_db(chunk) and loaded
+                records += chunk.height
+        else:
+            output_path += extension
+            with open(output_path, "wb") as f:
+                for number, chunk in enumerate(chunks):
+                    self._write_frame(chunk, f, extension, include_header=number == 0)
+                    records += chunk.height
+                    if not chunk.is_empty():
+                        loaded = self.loader.load_to_db(chunk) and loaded
+
+        logger.info("cleaned_file_saved", output_file=output_path, records=records)
+        return loaded
+
+    @staticmethod
+    def _iter_ndjson_batches(file_path: Path, chunk_size: int) -> Iterator[pl.DataFrame]:
+        """Reads chunk_size lines at a time; later batches reuse the schema inferred from the first one"""
+        schema = None
+        with open_source(file_path) as f:
+            while lines := list(itertools.islice(f, chunk_size)):
+                batch = pl.read_ndjson(io.BytesIO(b"".join(lines)), schema=schema)
+                schema = batch.schema
+                yield batch
+
+    @staticmethod
+    def _iter_compressed_csv_batches(file_path: Path, chunk_size: int) -> Iterator[pl.DataFrame]:
+        """Parses about chunk_size lines at a time as they are decompressed. A batch only ends once every quote in it
+        is closed, so a quoted field spanning lines stays whole; later batches reuse the first one's schema."""
+        schema = None
+        with open_source(file_path) as f:
+            header = f.readline()
+            while lines := list(itertools.islice(f, chunk_size)):
+                quotes = sum(line.count(b'"') for line in lines)
+                while quotes % 2 and (line := f.readline()):
+                    lines.append(line)
+                    quotes += line.count(b'"')
+                batch = pl.read_csv(io.BytesIO(header + b"".join(lines)), schema=schema)
+                schema = batch.schema
+                yield batch
+
+    @staticmethod
+    def _iter_csv_batches(file_path: Path, chunk_size: int) -> Iterator[pl.DataFrame]:
+        if is_compressed(file_path):
+            yield from DataIngestor._iter_compressed_csv_batches(file_path, chunk_size)
+            return
+        reader = pl.read_csv_batched(file_path, batch_size=chunk_size)
+        while batches := reader.next_batches(1):
+            yield from batches
+
+    def parse_csv(self, file_path: Path) -> bool:
+        if self.chunk_size:
+            return self.parse_csv_chunked(file_path)
 
-    def parse_csv(self, file_path: Path):
         try:
-            df = pl.read_csv(file_path)
-            logger.info("csv_parsed", file=file_path.name, rows=df.shape[0])
+            if is_compressed(file_path):
+                # Read in one go like the scan below, from the decompressed stream rather than an inflated copy
+                with open_source(file_path) as f:
+                    source = pl.read_csv(f)
+            else:
+                # The scan, cleaning and dedup run as a single query plan, so the raw file is never materialized
+                source = pl.scan_csv(file_path)
+            cleaned_df = self.transformer.transform(source, source_file=file_path.name)
+            logger.info("csv_parsed", file=file_path.name, records=cleaned_df.shape[0])
 
-            cleaned_df = self.transformer.transform(df, source_file=file_path.name)
-            self._save_cleaned(file_path.stem, cleaned_df, original_extension=".csv")
+            return self._save_cleaned(file_path.name, cleaned_df, original_extension=".csv")
 
         except Exception as e:
             self.alert_handler.alert("csv_parse_error", file=file_path.name, error=str(e))
+            return False
 
-    def parse_json(self, file_path: Path):
+    def parse_csv_chunked(self, file_path: Path) -> bool:
         try:
-            with open(file_path, encoding="utf-8") as f:
-                records = json.load(f)
+            batches = self._iter_csv_batches(file_path, self.chunk_size)
+            chunks = self.transformer.transform_batches(batches, source_file=file_path.name)
+            loaded = self._save_cleaned_chunks(file_path.name, chunks)
+            logger.info("csv_parsed", file=file_path.name, chunk_size=self.chunk_size)
+            return loaded
 
-            flattened = [self.transformer.flatten(r) for r in records]
+        except Exception as e:
+            self.alert_handler.alert("csv_parse_error", file=file_path.name, error=str(e))
+            return False
 
-            df = pl.DataFrame(flattened)
+    def parse_json(self, file_path: Path) -> bool:
+        try:
+            with open_source(file_path) as f:
+                df = self.transformer.flatten_frame(pl.read_json(f))
             logger.info("json_parsed", file=file_path.name, records=df.shape[0])
 
             cleaned_df = self.transformer.transform(df, source_file=file_path.name)
-            self._save_cleaned(file_path.stem, cleaned_df, original_extension=".json")
+            return self._save_cleaned(file_path.name, cleaned_df, original_extension=".json")
 
         except Exception as e:
             self.alert_handler.alert("json_parse_error", file=file_path.name, error=str(e))
+            return False
 
-    def process_downloaded_files(self):
-        for file_path in Path(self.download_dir).glob("*"):
-            if file_path.suffix.lower() == ".csv":
-                self.parse_csv(file_path)
-            elif file_path.suffix.lower() == ".json":
-                self.parse_json(file_path)
+    def parse_ndjson(self, file_path: Path) -> bool:
+        if self.chunk_size:
+            return self.parse_ndjson_chunked(file_path)
+
+        try:
+            if is_compressed(file_path):
+                with open_source(file_path) as f:
+                    source = pl.read_ndjson(f)
             else:
-                logger.warning("unsupported_file_skipped", file=file_path.name)
+                source = pl.scan_ndjson(file_path)
+            lf = self.transformer.flatten_frame(source)
+            cleaned_df = self.transformer.transform(lf, source_file=file_path.name)
+            logger.info("json_parsed", file=file_path.name, records=cleaned_df.shape[0])
+
+            return self._save_cleaned(file_path.name, cleaned_df, original_extension=".ndjson")
+
+        except Exception as e:
+            self.alert_handler.alert("json_parse_error", file=file_path.name, error=str(e))
+            return False
+
+    def parse_ndjson_chunked(self, file_path: Path) -> bool:
+        try:
+            batches = map(self.transformer.flatten_frame, self._iter_ndjson_batches(file_path, self.chunk_size))
+            chunks = self.transformer.transform_batches(batches, source_file=file_path.name)
+            loaded = self._save_cleaned_chunks(file_path.name, chunks, extension=".ndjson")
+            logger.info("json_parsed", file=file_path.name, chunk_size=self.chunk_size)
+            return loaded
+
+        except Exception as e:
+            self.alert_handler.alert("json_parse_error", file=file_path.name, error=str(e))
+            return False
+
+    def process_file(self, file_path: Path) -> bool:
+        """Parses, transforms and loads a single file, returning True when it made it into the database"""
+        with self.metrics.timer("parse", file_path.name) as record:
+            ingested = self._process_file(file_path)
+            record["errors"] = int(not ingested)
+            if self.metrics.enabled:
+                record["bytes"] = file_path.stat().st_size
+        return ingested
+
+    def _process_file(self, file_path: Path) -> bool:
+        suffix = source_path(file_path).suffix.lower()
+        if suffix == ".csv":
+            return self.parse_csv(file_path)
+        elif suffix == ".json":
+            return self.parse_json(file_path)
+        elif suffix in (".ndjson", ".jsonl"):
+            return self.parse_ndjson(file_path)
+
+        logger.warning("unsupported_file_skipped", file=file_path.name)
+        return False
+
+    def process_files(self, file_paths: Iterable[Path]) -> dict[Path, bool]:
+        """Processes each file, in this process or across file_workers processes; results keep the input order"""
+        file_paths = list(file_paths)
+        if self.file_workers > 1 and len(file_paths) > 1:
+            results = self._process_files_in_pool(file_paths)
+        else:
+            results = {file_path: self.process_file(file_path) for file_path in file_paths}
+
+        logger.info(
+            "files_processed",
+            total=len(results),
+            failed=sum(not ingested for ingested in results.values()),
+            workers=min(self.file_workers, max(len(file_paths), 1)),
+        )
+        return results
+
+    def _process_files_in_pool(self, file_paths: list[Path]) -> dict[Path, bool]:
+        workers = min(self.file_workers, len(file_paths))
+        results = {}
+        # spawn rather than fork: forking a process that already runs Polars' thread pool can deadlock the child
+        with _polars_threads_per_worker(workers), ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_file_worker,
+            initargs=(self.worker_config, self.metrics.enabled),
+        ) as executor:
+            futures = [(file_path, executor.submit(_process_file_in_worker, file_path)) for file_path in file_paths]
+            for file_path, future in futures:
+                try:
+                    results[file_path], worker_metrics = future.result()
+                    self.metrics.merge(worker_metrics)
+                except Exception as e:
+                    # Parse and load errors are alerted inside the worker; this catches a worker that died
+                    self.alert_handler.alert("file_worker_failed", file=file_path.name, error=repr(e))
+                    results[file_path] = False
+                logger.info("file_processed", file=file_path.name, ingested=results[file_path])
+        return results
+
+    def process_downloaded_files(self) -> dict[Path, bool]:
+        # Downloads still in progress sit in .part files until they are verified and renamed
+        paths = sorted(Path(self.download_dir).glob("*"))
+        return self.process_files([path for path in paths if not path.name.endswith((PART_SUFFIX, PROGRESS_SUFFIX))])
+
+
+_worker_ingestor: DataIngestor | None = None
+
+
+def _init_file_worker(ingestor_config: dict, metrics_enabled: bool):
+    """Builds the per-process ingestor, with its own transformer, database loader and metrics. The loader is closed
+    when the worker exits, so its connections end cleanly and it logs db_pool_metrics and dedup_index_metrics."""
+    global _worker_ingestor
+    _worker_ingestor = DataIngestor(metrics=RunMetrics() if metrics_enabled else None, **ingestor_config)
+    multiprocessing.util.Finalize(None, _worker_ingestor.loader.close, exitpriority=10)
+
+
+def _process_file_in_worker(file_path: Path) -> tuple[bool, dict]:
+    """Returns whether the file was ingested and the metrics it produced, for the parent to merge"""
+    ingested = _worker_ingestor.process_file(file_path)
+    metrics = _worker_ingestor.metrics.summary()
+    _worker_ingestor.metrics.reset()
+    return ingested, metrics
+
+
+@contextmanager
+def _polars_threads_per_worker(workers: int):
+    """Splits the cores between worker processes so N Polars thread pools do not each claim every core"""
+    if "POLARS_MAX_THREADS" in os.environ:
+        yield
+        return
+
+    os.environ["POLARS_MAX_THREADS"] = str(max((os.cpu_count() or 1) // workers, 1))
+    try:
+        yield
+    finally:
+        del os.environ["POLARS_MAX_THREADS"]
 
 
 class IngestionPipeline:
-    def __init__(self, sftp_config: dict, alert_handler=None):
+    def __init__(
+        self,
+        sftp_config: dict,
+        alert_handler=None,
+        ingestor_config: dict | None = None,
+        download_concurrency: int = DOWNLOAD_CONCURRENCY,
+        manifest: FileManifest | None = None,
+        metrics: RunMetrics | None = None,
+    ):
         self.alert_handler = alert_handler or AlertHandler()
-        self.sftp_manager = SFTPClientManager(alert_handler=self.alert_handler, **sftp_config)
-        self.data_ingestor = DataIngestor(alert_handler=self.alert_handler)
+        self.manifest = manifest
+        self.metrics = metrics or NULL_METRICS
+        if download_concurrency > 1:
+            self.sftp_manager = PooledSFTPClientManager(
+                alert_handler=self.alert_handler, pool_size=download_concurrency, metrics=self.metrics, **sftp_config
+            )
+        else:
+            self.sftp_manager = SFTPClientManager(alert_handler=self.alert_handler, metrics=self.metrics, **sftp_config)
+        self.data_ingestor = DataIngestor(
+            alert_handler=self.alert_handler, metrics=self.metrics, **(ingestor_config or {})
+        )
+
+    def _list_changed_files(self, filename: str | None) -> dict[str, SFTPAttributes]:
+        """Lists the remote files whose size or mtime differ from what the manifest recorded"""
+        return self._changed_files(self.sftp_manager.list_file_attrs(), filename)
+
+    def _changed_files(self, attrs: list[SFTPAttributes], filename: str | None) -> dict[str, SFTPAttributes]:
+        listing = {attr.filename: attr for attr in attrs if filename is None or attr.filename == filename}
+        changed = {
+            name: attr
+            for name, attr in listing.items()
+            if not self.manifest.is_unchanged(self.sftp_manager.remote_path(name), attr.st_size, attr.st_mtime)
+        }
+        logger.info("manifest_delta", listed=len(listing), changed=len(changed))
+        return changed
+
+    def _has_ingested_content(self, local_path: str) -> tuple[bool, str]:
+        name = os.path.basename(local_path)
+        sha256 = file_sha256(local_path)
+        if self.manifest.has_content(self.sftp_manager.remote_path(name), sha256):
+            logger.info("unchanged_file_skipped", file=name)
+            return True, sha256
+        return False, sha256
+
+    def _record_ingested(self, name: str, attr: SFTPAttributes, sha256: str):
+        self.manifest.record(self.sftp_manager.remote_path(name), attr.st_size, attr.st_mtime, sha256)
+
+    def _run_incremental(self, filename: str | None):
+        """Downloads and ingests only the remote files whose size, mtime or content changed since the last run"""
+        changed = self._list_changed_files(filename)
+        local_paths = self.sftp_manager.download_files(list(changed), self.data_ingestor.download_dir)
+        self.sftp_manager.disconnect()
+
+        for local_path in local_paths:
+            name = os.path.basename(local_path)
+            unchanged, sha256 = self._has_ingested_content(local_path)
+            if unchanged or self.data_ingestor.process_file(Path(local_path)):
+                self._record_ingested(name, changed[name], sha256)
 
     def run(self, filename: str | None = None):
         try:
-            logger.info("ingestion_started", filter=filename)
+            logger.info("ingestion_started", filter=filename, incremental=self.manifest is not None)
             self.sftp_manager.connect()
 
-            files = [filename] if filename else self.sftp_manager.list_files()
-            for file in files:
-                local_path = os.path.join(self.data_ingestor.download_dir, file)
-                self.sftp_manager.download_file(file, local_path)
+            if self.manifest:
+                self._run_incremental(filename)
+            else:
+                files = [filename] if filename else self.sftp_manager.list_files()
+                self.sftp_manager.download_files(files, self.data_ingestor.download_dir)
 
+                self.sftp_manager.disconnect()
+                self.data_ingestor.process_downloaded_files()
+            logger.info("ingestion_completed")
+
+        except RetryError as retry_err:
+            self.alert_handler.alert("retry_failed", error=str(retry_err))
+        except Exception as e:
+            self.alert_handler.alert("pipeline_failed", error=str(e))
+        finally:
+            self.data_ingestor.loader.close()
+            self.metrics.write(METRICS_DIR)
+
+
+class StageQueue(queue.Queue):
+    """Bounded queue between two pipeline stages that tracks its depth and how long producers and consumers wait"""
+
+    DONE = object()
+
+    def __init__(self, name: str, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.name = name
+        self.items = 0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.put_wait_s = 0.0
+        self.get_wait_s = 0.0
+        self._stats_lock = threading.Lock()
+
+    def put(self, item, block=True, timeout=None):
+        started_at = time.perf_counter()
+        super().put(item, block, timeout)
+        waited, depth = time.perf_counter() - started_at, self.qsize()
+        with self._stats_lock:
+            self.items += 1
+            self.put_wait_s += waited
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_total += depth
+
+    def get(self, block=True, timeout=None):
+        started_at = time.perf_counter()
+        item = super().get(block, timeout)
+        with self._stats_lock:
+            self.get_wait_s += time.perf_counter() - started_at
+        return item
+
+    def close(self, consumers: int):
+        """Tells each consuming worker to stop once the items queued before it are handled"""
+        for _ in range(consumers):
+            super().put(self.DONE)
+
+    def metrics(self) -> dict:
+        return {
+            "queue": self.name,
+            "items": self.items,
+            "max_depth": self.max_depth,
+            "mean_depth": round(self.depth_total / self.items, 2) if self.items else 0,
+            # Long put waits mean the consuming stage is the bottleneck, long get waits mean the producing one is
+            "put_wait_s": round(self.put_wait_s, 3),
+            "get_wait_s": round(self.get_wait_s, 3),
+        }
+
+
+class _QueueLoader:
+    """Stands in for DataLoader inside transform workers and hands each transformed frame to the load stage"""
+
+    def __init__(self, load_queue: StageQueue):
+        self.load_queue = load_queue
+        self.source: str | None = None
+
+    def load_to_db(self, df: pl.DataFrame | None) -> bool:
+        if df is not None and not df.is_empty():
+            self.load_queue.put((self.source, df))
+        return True
+
+
+class StagedIngestionPipeline(IngestionPipeline):
+    """Runs download, transform and load as concurrent stages joined by bounded queues, so file N+1 downloads
+    while file N transforms and file N-1 loads"""
+
+    def __init__(
+        self,
+        sftp_config: dict,
+        alert_handler=None,
+        ingestor_config: dict | None = None,
+        download_concurrency: int = DOWNLOAD_CONCURRENCY,
+        manifest: FileManifest | None = None,
+        metrics: RunMetrics | None = None,
+        transform_workers: int = TRANSFORM_WORKERS,
+        load_workers: int = LOAD_WORKERS,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        super().__init__(sftp_config, alert_handler, ingestor_config, download_concurrency, manifest, metrics)
+        self.ingestor_config = ingestor_config or {}
+        self.download_workers = getattr(self.sftp_manager, "pool_size", 1)
+        self.transform_workers = transform_workers
+        self.load_workers = load_workers
+        self.queue_size = queue_size
+
+    def _start_stage(self, name: str, workers: int, inbox: StageQueue, make_handler, on_failure) -> tuple[list, dict]:
+        """Starts the workers of a stage. A worker whose handler cannot be built, or whose handler raises, alerts and
+        passes the item to `on_failure`, but keeps taking items until DONE so the stages feeding it never block."""
+        stats = {"stage": name, "workers": workers, "processed": 0, "busy_s": 0.0}
+        stats_lock = threading.Lock()
+
+        def work():
+            try:
+                handle = make_handler()
+            except Exception as e:
+                self.alert_handler.alert("pipeline_stage_failed", stage=name, error=str(e))
+                handle = None
+            while (item := inbox.get()) is not StageQueue.DONE:
+                started_at = time.perf_counter()
+                try:
+                    if handle is None:
+                        on_failure(item)
+                    else:
+                        handle(item)
+                except Exception as e:
+                    self.alert_handler.alert("pipeline_stage_failed", stage=name, error=str(e))
+                    on_failure(item)
+                with stats_lock:
+                    stats["processed"] += 1
+                    stats["busy_s"] += time.perf_counter() - started_at
+
+        threads = [threading.Thread(target=work, name=f"{name}-{number}") for number in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads, stats
+
+    @staticmethod
+    def _finish_stage(threads: list, outbox: StageQueue | None = None, consumers: int = 0):
+        for thread in threads:
+            thread.join()
+        if outbox is not None:
+            outbox.close(consumers)
+
+    def run(self, filename: str | None = None):
+        try:
+            logger.info("ingestion_started", filter=filename, incremental=self.manifest is not None, staged=True)
+            self.sftp_manager.connect()
+
+            if self.manifest:
+                changed = self._list_changed_files(filename)
+                files = list(changed)
+            else:
+                files = [filename] if filename else self.sftp_manager.list_files()
+
+            download_queue = StageQueue("download")
+            transform_queue = StageQueue("transform", self.queue_size)
+            load_queue = StageQueue("load", self.queue_size)
+            # Per file: None while it is being transformed, False once any stage failed for it
+            outcomes: dict[str, bool | None] = {}
+            outcomes_lock = threading.Lock()
+            digests: dict[str, str] = {}
+
+            def set_outcome(name: str, ingested: bool | None):
+                with outcomes_lock:
+                    if outcomes.get(name) is not False or ingested is None:
+                        outcomes[name] = ingested
+
+            def download_handler():
+                def download(remote_file: str):
+                    local_path = self.sftp_manager.download_to_dir(remote_file, self.data_ingestor.download_dir)
+                    if local_path:
+                        transform_queue.put(local_path)
+
+                return download
+
+            def transform_handler():
+                loader = _QueueLoader(load_queue)
+                # Loading, and so the dedup index, belongs to the load stage
+                ingestor = DataIngestor(
+                    alert_handler=self.alert_handler, metrics=self.metrics, **{**self.ingestor_config, "dedup": False}
+                )
+                ingestor.loader = loader
+
+                def transform(local_path: str):
+                    name = os.path.basename(local_path)
+                    set_outcome(name, None)
+                    if self.manifest:
+                        unchanged, digests[name] = self._has_ingested_content(local_path)
+                        if unchanged:
+                            set_outcome(name, True)
+                            return
+                    loader.source = name
+                    set_outcome(name, ingestor.process_file(Path(local_path)))
+
+                return transform
+
+            def load_handler():
+                def load(item: tuple[str, pl.DataFrame]):
+                    name, df = item
+                    if not self.data_ingestor.loader.load_to_db(df):
+                        set_outcome(name, False)
+
+                return load
+
+            for remote_file in files:
+                download_queue.put(remote_file)
+            download_queue.close(self.download_workers)
+
+            downloaders, download_stats = self._start_stage(
+                "download",
+                self.download_workers,
+                download_queue,
+                download_handler,
+                lambda remote_file: set_outcome(os.path.basename(remote_file), False),
+            )
+            transformers, transform_stats = self._start_stage(
+                "transform",
+                self.transform_workers,
+                transform_queue,
+                transform_handler,
+                lambda local_path: set_outcome(os.path.basename(local_path), False),
+            )
+            loaders, load_stats = self._start_stage(
+                "load", self.load_workers, load_queue, load_handler, lambda item: set_outcome(item[0], False)
+            )
+
+            self._finish_stage(downloaders, transform_queue, self.transform_workers)
             self.sftp_manager.disconnect()
-            self.data_ingestor.process_downloaded_files()
+            self._finish_stage(transformers, load_queue, self.load_workers)
+            self._finish_stage(loaders)
+
+            if self.manifest:
+                for name, ingested in outcomes.items():
+                    if ingested:
+                        self._record_ingested(name, changed[name], digests[name])
+
+            logger.info(
+                "stage_metrics",
+                stages=[download_stats, transform_stats, load_stats],
+                queues=[transform_queue.metrics(), load_queue.metrics()],
+            )
             logger.info("ingestion_completed")
 
         except RetryError as retry_err:
             self.alert_handler.alert("retry_failed", error=str(retry_err))
         except Exception as e:
             self.alert_handler.alert("pipeline_failed", error=str(e))
+        finally:
+            self.data_ingestor.loader.close()
+            self.metrics.write(METRICS_DIR)
+
+
+class _AsyncLoaderBridge:
+    """Stands in for DataLoader inside the transform threads of AsyncIngestionPipeline: each frame is loaded by the
+    AsyncDataLoader on the event loop while the thread waits, so a slow database holds back the transforms"""
+
+    def __init__(self, loader: AsyncDataLoader, loop: asyncio.AbstractEventLoop):
+        self.loader = loader
+        self.loop = loop
+
+    def load_to_db(self, df: pl.DataFrame | None) -> bool:
+        return asyncio.run_coroutine_threadsafe(self.loader.load_to_db(df), self.loop).result()
+
+
+class AsyncIngestionPipeline(IngestionPipeline):
+    """asyncio variant of IngestionPipeline: files are listed and downloaded over one asyncssh connection, parsed and
+    transformed in transform_workers threads and COPYed through asyncpg. Each file moves to its next step as soon as
+    the previous one is done, so one process keeps dozens of transfers and loads in flight."""
+
+    def __init__(
+        self,
+        sftp_config: dict,
+        alert_handler=None,
+        ingestor_config: dict | None = None,
+        download_concurrency: int = ASYNC_DOWNLOAD_CONCURRENCY,
+        manifest: FileManifest | None = None,
+        metrics: RunMetrics | None = None,
+        transform_workers: int = TRANSFORM_WORKERS,
+    ):
+        self.alert_handler = alert_handler or AlertHandler()
+        self.manifest = manifest
+        self.metrics = metrics or NULL_METRICS
+        self.sftp_manager = AsyncSFTPClientManager(
+            alert_handler=self.alert_handler, concurrency=download_concurrency, metrics=self.metrics, **sftp_config
+        )
+        ingestor_config = dict(ingestor_config or {})
+        dedup = ingestor_config.pop("dedup", DEDUP)
+        dedup_path = ingestor_config.pop("dedup_path", DEDUP_PATH)
+        # Loading, and so the dedup index, belongs to the async loader
+        self.data_ingestor = DataIngestor(
+            alert_handler=self.alert_handler, metrics=self.metrics, dedup=False, **ingestor_config
+        )
+        self.loader = AsyncDataLoader(
+            load_mode=ingestor_config.get("load_mode", LOAD_MODE),
+            dedup_index=DedupIndex(dedup_path) if dedup else None,
+            metrics=self.metrics,
+        )
+        self.transform_workers = max(transform_workers, 1)
+
+    def run(self, filename: str | None = None):
+        asyncio.run(self.run_async(filename))
+
+    async def _ingest_file(self, remote_file: str, transform_pool: ThreadPoolExecutor) -> tuple[bool, str | None]:
+        """Downloads, transforms and loads one file; returns whether it was ingested and, with a manifest, its digest"""
+        local_path = await self.sftp_manager.download_to_dir(remote_file, self.data_ingestor.download_dir)
+        if local_path is None:
+            return False, None
+
+        loop = asyncio.get_running_loop()
+        sha256 = None
+        if self.manifest:
+            unchanged, sha256 = await asyncio.to_thread(self._has_ingested_content, local_path)
+            if unchanged:
+                return True, sha256
+        ingested = await loop.run_in_executor(transform_pool, self.data_ingestor.process_file, Path(local_path))
+        logger.info("file_processed", file=remote_file, ingested=ingested)
+        return ingested, sha256
+
+    async def run_async(self, filename: str | None = None):
+        try:
+            logger.info("ingestion_started", filter=filename, incremental=self.manifest is not None, asynchronous=True)
+            await self.sftp_manager.connect()
+
+            if self.manifest:
+                changed = self._changed_files(await self.sftp_manager.list_file_attrs(), filename)
+                files = list(changed)
+            else:
+                files = [filename] if filename else await self.sftp_manager.list_files()
+
+            self.data_ingestor.loader = _AsyncLoaderBridge(self.loader, asyncio.get_running_loop())
+            # A pool of its own, so transforms waiting on their loads never starve the threads asyncio.to_thread uses
+            with ThreadPoolExecutor(max_workers=self.transform_workers, thread_name_prefix="transform") as pool:
+                results = await asyncio.gather(*(self._ingest_file(remote_file, pool) for remote_file in files))
+            await self.sftp_manager.disconnect()
+
+            if self.manifest:
+                for remote_file, (ingested, sha256) in zip(files, results):
+                    if ingested:
+                        self._record_ingested(remote_file, changed[remote_file], sha256)
+
+            logger.info(
+                "files_processed",
+                total=len(results),
+                failed=sum(not ingested for ingested, _ in results),
+                workers=self.transform_workers,
+            )
+            logger.info("ingestion_completed")
+
+        except RetryError as retry_err:
+            self.alert_handler.alert("retry_failed", error=str(retry_err))
+        except Exception as e:
+            self.alert_handler.alert("pipeline_failed", error=str(e))
+        finally:
+            await self.sftp_manager.disconnect()
+            await self.loader.aclose()
+            self.metrics.write(METRICS_DIR)
 
 
 if __name__ == "__main__":
@@ -129,8 +866,77 @@ if __name__ == "__main__":
     DEFAULT_FILENAME = "customers-100.csv"
 
     parser.add_argument("--filename", help="Name of the file to download from SFTP", required=False)
+    parser.add_argument(
+        "--load-mode",
+        choices=LOAD_MODES,
+        default=LOAD_MODE,
+        help="How rows are written to PostgreSQL: 'insert' (executemany), 'copy' (COPY FROM STDIN + merge) or "
+        "'upsert' (like copy, but also rewrites stored customers whose content_hash changed; not with --dedup)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="Stream CSV files through transform/save/load in chunks of this many rows (0 = whole file)",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        default=OUTPUT_FORMAT,
+        help="Format of the files written to etl/transformed ('source' keeps CSV, writes JSON inputs as NDJSON)",
+    )
+    parser.add_argument(
+        "--file-workers",
+        type=int,
+        default=FILE_WORKERS,
+        help="Number of processes that parse, transform and load downloaded files in parallel",
+    )
+    parser.add_argument(
+        "--download-concurrency",
+        type=int,
+        default=DOWNLOAD_CONCURRENCY,
+        help="Number of SFTP sessions used to download files in parallel",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=INCREMENTAL,
+        help="Skip remote files already ingested with the same size, mtime and content (tracked in a manifest)",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        default=DEDUP,
+        help="Drop rows whose index or customer_id was loaded before, using an on-disk key index",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        default=METRICS_ENABLED,
+        help="Record per-stage and per-file timings and write run_metrics.json / run_metrics.prom to ETL_METRICS_DIR",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        default=STAGED,
+        help="Overlap downloading, transforming and loading with bounded queues between the stages",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        default=ASYNC,
+        help="Run on asyncio: asyncssh downloads, transform threads and asyncpg COPY loads, many files in flight",
+    )
+    parser.add_argument(
+        "--transform-workers", type=int, default=TRANSFORM_WORKERS, help="Staged and async mode: transform threads"
+    )
+    parser.add_argument("--load-workers", type=int, default=LOAD_WORKERS, help="Staged mode: database load threads")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Staged mode: max items between stages")
 
     args = parser.parse_args()
+    if args.load_mode == "upsert" and args.dedup:
+        parser.error("--load-mode upsert cannot be combined with --dedup (or ETL_DEDUP), which would drop every update")
 
     # For testing purposes, we are using the default filename because that's what the SFTP server has for testing
     if args.filename:
@@ -162,5 +968,34 @@ if __name__ == "__main__":
         "remote_folder": remote_folder,
     }
 
-    pipeline = IngestionPipeline(SFTP_CONFIG)
+    INGESTOR_CONFIG = {
+        "load_mode": args.load_mode,
+        "chunk_size": args.chunk_size,
+        "output_format": args.output_format,
+        "file_workers": args.file_workers,
+        "dedup": args.dedup,
+    }
+
+    PIPELINE_CONFIG = {
+        "ingestor_config": INGESTOR_CONFIG,
+        "download_concurrency": args.download_concurrency,
+        "manifest": FileManifest() if args.incremental else None,
+        "metrics": RunMetrics() if args.metrics else None,
+    }
+
+    if args.use_async:
+        # --download-concurrency defaults to 1 for the paramiko pool; the asyncio pipeline has its own default
+        if args.download_concurrency == DOWNLOAD_CONCURRENCY:
+            PIPELINE_CONFIG["download_concurrency"] = ASYNC_DOWNLOAD_CONCURRENCY
+        pipeline = AsyncIngestionPipeline(SFTP_CONFIG, transform_workers=args.transform_workers, **PIPELINE_CONFIG)
+    elif args.staged:
+        pipeline = StagedIngestionPipeline(
+            SFTP_CONFIG,
+            transform_workers=args.transform_workers,
+            load_workers=args.load_workers,
+            queue_size=args.queue_size,
+            **PIPELINE_CONFIG,
+        )
+    else:
+        pipeline = IngestionPipeline(SFTP_CONFIG, **PIPELINE_CONFIG)
     pipeline.run(filename=filename_to_use)
@@ -1,9 +1,19 @@
-from datetime import datetime
+import asyncio
+import datetime
+import queue
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
 
+import asyncpg
 import polars as pl
 import psycopg2
 import structlog
 from decouple import config
+from dedup import DedupIndex
+from metrics import NULL_METRICS
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
 logger = structlog.get_logger()
 
@@ -16,6 +26,63 @@ DATABASE_CONFIG = {
     "PORT": config("DB_PORT", default="5432"),
 }
 
+# "insert" pushes rows with executemany, "copy" streams the frame through COPY FROM STDIN, "upsert" does the same
+# but also rewrites existing rows whose content_hash changed
+LOAD_MODES = ("insert", "copy", "upsert")
+LOAD_MODE = config("ETL_LOAD_MODE", default="insert")
+COPY_BATCH_SIZE = config("ETL_COPY_BATCH_SIZE", cast=int, default=50_000)
+DB_POOL_SIZE = config("ETL_DB_POOL_SIZE", cast=int, default=4)
+DB_POOL_TIMEOUT = config("ETL_DB_POOL_TIMEOUT", cast=float, default=30.0)  # seconds to wait for a free connection
+
+CUSTOMER_COLUMNS = (
+    "index",
+    "customer_id",
+    "first_name",
+    "last_name",
+    "company",
+    "city",
+    "country",
+    "phone_1",
+    "phone_2",
+    "email",
+    "subscription_date",
+    "website",
+    "source_file",
+    "ingested_at",
+)
+OPTIONAL_COLUMNS = ("phone_1", "phone_2", "website")
+
+# The API caches responses per ingestion generation (app.models.IngestionGeneration), so every load that wrote rows
+# bumps it in the same transaction; readers never see new rows under an old generation
+BUMP_GENERATION_SQL = """
+    INSERT INTO ingestion_generation (id, value, updated_at) VALUES (1, 1, now())
+    ON CONFLICT (id) DO UPDATE SET value = ingestion_generation.value + 1, updated_at = now();
+"""
+# customer.content_hash identifies a version of a customer by its business columns
+BUSINESS_COLUMNS = tuple(col for col in CUSTOMER_COLUMNS if col not in ("source_file", "ingested_at"))
+STAGING_TABLE_SQL = "CREATE TEMP TABLE customer_staging (LIKE customer INCLUDING DEFAULTS) ON COMMIT DROP;"
+# Folds a `delta` CTE of (country, city, subscription_date, customers) into the customer_rollup totals (see
+# app.models.CustomerRollup). Taking the groups in a fixed order keeps concurrent loads from deadlocking on them
+ROLLUP_DELTA_CTE = """
+    rolled_up AS (
+        INSERT INTO customer_rollup (country, city, subscription_month, customer_count)
+        SELECT country, city, date_trunc('month', subscription_date)::date, sum(customers)
+        FROM delta
+        GROUP BY 1, 2, 3
+        HAVING sum(customers) <> 0
+        ORDER BY 1, 2, 3
+        ON CONFLICT (country, city, subscription_month)
+        DO UPDATE SET customer_count = customer_rollup.customer_count + EXCLUDED.customer_count
+    )
+"""
+# customer is range-partitioned by ingested_at, one partition per UTC month (app/migrations/0007_partition_customer.py).
+# Rows of a month without a partition land in customer_default, which works but defeats pruning, so the loader
+# creates the partitions of the months it is about to write first
+PARTITION_LOCK_ID = 4_210_722  # advisory lock serialising partition DDL between concurrent loaders
+ATTACHED_PARTITION_SQL = """
+    SELECT 1 FROM pg_inherits WHERE inhparent = 'customer'::regclass AND inhrelid = to_regclass(%s);
+"""
+
 
 def get_db_connection():
     """Establish connection to PostgreSQL"""
@@ -28,58 +95,527 @@ def get_db_connection():
     )
 
 
+def month_start(value: datetime.date) -> datetime.date:
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(month: datetime.date) -> datetime.date:
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"customer_{month:%Y_%m}"
+
+
+def _ingested_at_utc(dtype: pl.DataType) -> pl.Expr:
+    """ingested_at as a UTC Datetime, so every driver writes the same instant whatever the session TimeZone. Naive
+    values, from frames written before the transform emitted UTC, are taken to be UTC already; ISO strings come from
+    frames written before ingested_at became a Datetime column."""
+    col = pl.col("ingested_at")
+    if dtype == pl.Utf8:
+        return col.str.to_datetime(time_unit="us", time_zone="UTC")
+    if isinstance(dtype, pl.Datetime) and dtype.time_zone is None:
+        return col.dt.replace_time_zone("UTC").dt.cast_time_unit("us")
+    return col.dt.convert_time_zone("UTC").dt.cast_time_unit("us")
+
+
+def content_hash_sql(table: str) -> str:
+    """SQL for the content_hash of the row of `table`: the first 64 bits of the MD5 of its business columns in record
+    text form, which tells NULL from '' and does not change between PostgreSQL or Polars versions. The date is
+    rendered explicitly so DateStyle cannot change it."""
+    columns = [
+        f"to_char({table}.{col}, 'YYYY-MM-DD')" if col == "subscription_date" else f"{table}.{col}"
+        for col in BUSINESS_COLUMNS
+    ]
+    return f"('x' || left(md5(ROW({', '.join(columns)})::text), 16))::bit(64)::bigint"
+
+
+def ensure_partitions(conn, months) -> list[datetime.date]:
+    """Creates the monthly partitions that do not exist yet, first moving rows of those months out of
+    customer_default (a partition cannot be added while the default one holds rows of its range). One short
+    transaction per month; returns the months that were created."""
+    created = []
+    columns = ", ".join(CUSTOMER_COLUMNS + ("content_hash",))
+    for month in sorted({month_start(month) for month in months}):
+        name = partition_name(month)
+        bounds = (f"{month:%Y-%m-%d} 00:00+00", f"{next_month(month):%Y-%m-%d} 00:00+00")
+        with conn, conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_ID,))
+            cursor.execute(ATTACHED_PARTITION_SQL, (name,))
+            if cursor.fetchone() is not None:
+                continue
+
+            cursor.execute("CREATE TEMP TABLE customer_moved (LIKE customer INCLUDING DEFAULTS) ON COMMIT DROP")
+            cursor.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM customer_default WHERE ingested_at >= %s AND ingested_at < %s RETURNING {columns}
+                )
+                INSERT INTO customer_moved ({columns}) SELECT {columns} FROM moved
+                """,
+                bounds,
+            )
+            moved = cursor.rowcount
+            cursor.execute(f"CREATE TABLE {name} PARTITION OF customer FOR VALUES FROM (%s) TO (%s)", bounds)
+            if moved:
+                cursor.execute(f"INSERT INTO customer ({columns}) SELECT {columns} FROM customer_moved")
+        created.append(month)
+        logger.info("partition_created", partition=name, moved_from_default=moved)
+    return created
+
+
+class ConnectionPool:
+    """Thread-safe pool of at most `size` PostgreSQL connections, opened lazily and checked before each reuse"""
+
+    def __init__(self, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.size = max(size, 1)
+        self.timeout = timeout
+        # LIFO hands out the most recently used connection, so idle ones past the working set stay unopened
+        self._pool: queue.LifoQueue[psycopg2.extensions.connection | None] = queue.LifoQueue()
+        for _ in range(self.size):
+            self._pool.put(None)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.reused = 0
+        self.opened = 0
+        self.discarded = 0
+        self.wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        if conn.closed:
+            return False
+        try:
+            if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._stats_lock:
+            self.discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg2.extensions.connection]:
+        """Checks out a connection; it is rolled back if the block raises and returned to the pool either way"""
+        started_at = time.perf_counter()
+        try:
+            conn = self._pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection free within {self.timeout}s (pool size {self.size})")
+        waited = time.perf_counter() - started_at
+
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                logger.warning("db_connection_reconnecting")
+                self._discard(conn)
+                conn = None
+            reused = conn is not None
+            if conn is None:
+                conn = get_db_connection()
+
+            with self._stats_lock:
+                self.checkouts += 1
+                self.reused += reused
+                self.opened += not reused
+                self.wait_s += waited
+                self.max_wait_s = max(self.max_wait_s, waited)
+
+            yield conn
+
+        except Exception:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    # The connection itself broke, so the next checkout opens a fresh one
+                    self._discard(conn)
+                    conn = None
+            raise
+        finally:
+            self._pool.put(conn)
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            return {
+                "size": self.size,
+                "checkouts": self.checkouts,
+                "reused": self.reused,
+                "opened": self.opened,
+                "discarded": self.discarded,
+                "reuse_ratio": round(self.reused / self.checkouts, 3) if self.checkouts else None,
+                # A wait time that grows with the run means the pool is smaller than the number of concurrent loaders
+                "wait_s": round(self.wait_s, 3),
+                "max_wait_s": round(self.max_wait_s, 3),
+            }
+
+    def close(self):
+        while not self._pool.empty():
+            conn = self._pool.get_nowait()
+            if conn is not None and not conn.closed:
+                conn.close()
+        logger.info("db_pool_metrics", **self.metrics())
+
+
+class FrameCSVStream:
+    """File-like object that serializes a DataFrame to CSV one slice at a time for COPY FROM STDIN"""
+
+    def __init__(self, df: pl.DataFrame, batch_size: int = COPY_BATCH_SIZE):
+        self._slices = df.iter_slices(batch_size)
+        self._buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._slices, None)
+            if chunk is None:
+                break
+            self._buffer += chunk.write_csv(include_header=False).encode("utf-8")
+
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
 class DataLoader:
-    def load_to_db(self, df: pl.DataFrame | None):
+    def __init__(
+        self,
+        load_mode: str = LOAD_MODE,
+        copy_batch_size: int = COPY_BATCH_SIZE,
+        pool: ConnectionPool | None = None,
+        dedup_index: DedupIndex | None = None,
+        metrics=None,
+    ):
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"Unsupported load mode '{load_mode}', expected one of {LOAD_MODES}")
+        if load_mode == "upsert" and dedup_index is not None:
+            raise ValueError("The dedup index drops rows whose key was loaded before, so it would drop every update")
+        self.load_mode = load_mode
+        self.copy_batch_size = copy_batch_size
+        self.pool = pool or ConnectionPool()
+        self.dedup_index = dedup_index
+        self.metrics = metrics or NULL_METRICS
+        # Months whose customer partition is known to exist, so most loads skip the catalog lookup
+        self._partitioned_months: set[datetime.date] = set()
+
+    def close(self):
+        """Closes the pooled connections and the dedup index, logging how both were used"""
+        self.pool.close()
+        if self.dedup_index is not None:
+            self.dedup_index.close()
+
+    def load_to_db(self, df: pl.DataFrame | None) -> bool:
+        """Loads the frame into the customer table, returning False when the load failed"""
         if df is None or df.is_empty():
             logger.warning("no_data_to_insert")
+            return True
+
+        source_file = df["source_file"][0] if "source_file" in df.columns else None
+        with self.metrics.timer("load", source_file) as record:
+            loaded = self._load(df)
+            record.update(rows=df.height, errors=int(not loaded))
+        return loaded
+
+    def _loaded_keys(self, column: str, values: list) -> set:
+        """The values of a customer_key column that PostgreSQL still holds, for the dedup index to confirm its hits"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT {column} FROM customer_key WHERE {column} = ANY(%s)", (values,))
+                keys = {key for (key,) in cursor.fetchall()}
+            conn.rollback()
+        return keys
+
+    def _filter_new(self, df: pl.DataFrame) -> pl.DataFrame | None:
+        try:
+            return self.dedup_index.filter_new(df, self._loaded_keys)
+        except Exception as e:
+            logger.error("dedup_filter_failed", error=str(e))
+            return None
+
+    def _load(self, df: pl.DataFrame) -> bool:
+        if self.dedup_index is not None:
+            df = self._filter_new(df)
+            if df is None:
+                return False
+            if df.is_empty():
+                return True
+
+        loaded = self._insert_to_db(df) if self.load_mode == "insert" else self._copy_to_db(df)
+        if loaded and self.dedup_index is not None:
+            self.dedup_index.record(df)
+        return loaded
+
+    @staticmethod
+    def _log_throughput(count: int, started_at: float, mode: str, **kwargs):
+        elapsed = time.perf_counter() - started_at
+        logger.info(
+            "records_loaded_to_db",
+            count=count,
+            mode=mode,
+            duration_s=round(elapsed, 3),
+            rows_per_sec=round(count / elapsed) if elapsed > 0 else None,
+            **kwargs,
+        )
+
+    @staticmethod
+    def _prepare_frame(df: pl.DataFrame) -> pl.DataFrame:
+        """Select the customer table columns in order, filling the optional ones the source did not provide"""
+        defaults = [pl.lit(None, dtype=pl.Utf8).alias(col) for col in OPTIONAL_COLUMNS if col not in df.columns]
+        if "source_file" not in df.columns:
+            defaults.append(pl.lit("unknown.csv").alias("source_file"))
+        if defaults:
+            df = df.with_columns(defaults)
+
+        casts = {"index": pl.Int64, "subscription_date": pl.Date}
+        columns = [pl.col(col).cast(casts[col]) if col in casts else pl.col(col) for col in CUSTOMER_COLUMNS]
+        columns[CUSTOMER_COLUMNS.index("ingested_at")] = _ingested_at_utc(df.schema["ingested_at"])
+        return df.select(columns)
+
+    def _missing_partitions(self, prepared: pl.DataFrame) -> set[datetime.date]:
+        months = prepared.get_column("ingested_at").dt.truncate("1mo").unique().drop_nulls().to_list()
+        return {value.date() for value in months} - self._partitioned_months
+
+    def _ensure_partitions(self, prepared: pl.DataFrame):
+        """Creates the partitions of the months in ingested_at before the load transaction takes its locks"""
+        missing = self._missing_partitions(prepared)
+        if not missing:
             return
+        try:
+            with self.pool.connection() as conn:
+                ensure_partitions(conn, missing)
+            self._partitioned_months |= missing
+        except Exception as e:
+            # The rows still load, into customer_default
+            logger.warning("partition_ensure_failed", months=sorted(str(month) for month in missing), error=str(e))
+
+    def _insert_to_db(self, df: pl.DataFrame) -> bool:
+        started_at = time.perf_counter()
 
-        # Convert to list of tuples for DB insert
+        # Typed columns in table order; iter_rows converts them to Python values column-wise, one tuple per row,
+        # so no per-row dicts, casts or datetime parsing happen in Python
         try:
-            values = [
-                (
-                    int(row["index"]),
-                    row["customer_id"],
-                    row["first_name"],
-                    row["last_name"],
-                    row["company"],
-                    row["city"],
-                    row["country"],
-                    row.get("phone_1"),
-                    row.get("phone_2"),
-                    row["email"],
-                    row["subscription_date"],
-                    row.get("website"),
-                    row.get("source_file", "unknown.csv"),
-                    datetime.fromisoformat(row["ingested_at"]),
-                )
-                for row in df.to_dicts()
-            ]
+            prepared = self._prepare_frame(df)
         except Exception as e:
             logger.error("dataframe_row_parse_failed", error=str(e))
-            return
+            return False
+
+        self._ensure_partitions(prepared)
 
-        # Perform DB insert
+        # Perform DB insert, through the same staging table as COPY so the merge can maintain the rollup
+        columns = ", ".join(CUSTOMER_COLUMNS)
+        placeholders = ", ".join(["%s"] * len(CUSTOMER_COLUMNS))
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.executemany(
-                """
-                INSERT INTO customer (
-                    index, customer_id, first_name, last_name, company, city, country,
-                    phone_1, phone_2, email, subscription_date, website, source_file, ingested_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (index) DO NOTHING;
-            """,
-                values,
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(STAGING_TABLE_SQL)
+                    cursor.executemany(
+                        f"INSERT INTO customer_staging ({columns}) VALUES ({placeholders});", prepared.iter_rows()
+                    )
+                    written = self._merge_staging(cursor)
+
+                conn.commit()
+            self._log_throughput(prepared.height, started_at, mode="insert", written=written)
+            return True
+
+        except Exception as e:
+            logger.error("sql_bulk_insert_failed", error=str(e))
+            return False
+
+    def _merge_sql(self) -> str:
+        """One statement that merges customer_staging into customer, applies the change to customer_rollup and
+        returns the number of customers written. customer_key stands in for the primary key and the customer_id
+        constraint the partitioned table cannot have: a row is written only if its index was claimed there, and a
+        claim that conflicts on either key is skipped rather than failing the batch."""
+        columns = ", ".join(CUSTOMER_COLUMNS)
+        # Within one load the first staged version of an index wins, in upsert mode the last one
+        order = "ctid DESC" if self.load_mode == "upsert" else "ctid"
+        return f"""
+            WITH staged AS (
+                SELECT DISTINCT ON (index) {columns} FROM customer_staging ORDER BY index, {order}
+            ),
+            keys AS (
+                INSERT INTO customer_key (index, customer_id)
+                SELECT index, customer_id FROM staged
+                ON CONFLICT DO NOTHING
+                RETURNING index
+            ),
+            written AS (
+                INSERT INTO customer ({columns}, content_hash)
+                -- Hashed here, so only the rows actually written pay for it
+                SELECT {", ".join(f"staged.{col}" for col in CUSTOMER_COLUMNS)}, {content_hash_sql("staged")}
+                FROM staged JOIN keys USING (index)
+                RETURNING country, city, subscription_date
+            ),
+            delta AS (
+                SELECT country, city, subscription_date, 1 AS customers FROM written
+            ),
+            {ROLLUP_DELTA_CTE}
+            SELECT count(*) FROM written;
+        """
+
+    # Upsert mode deletes the stored versions whose content_hash changed before the merge writes the new ones: a
+    # changed row may move to another partition, and ON CONFLICT cannot see across partitions. A version whose new
+    # customer_id belongs to another index is kept, since the merge could not claim it back.
+    REPLACE_CHANGED_SQL = f"""
+        WITH staged AS (
+            SELECT DISTINCT ON (index) {", ".join(BUSINESS_COLUMNS)} FROM customer_staging ORDER BY index, ctid DESC
+        ),
+        replaced AS (
+            DELETE FROM customer USING staged
+            WHERE customer.index = staged.index AND customer.content_hash IS DISTINCT FROM {content_hash_sql("staged")}
+            AND NOT EXISTS (
+                SELECT 1 FROM customer_key
+                WHERE customer_key.customer_id = staged.customer_id AND customer_key.index <> staged.index
             )
+            RETURNING customer.index, customer.country, customer.city, customer.subscription_date
+        ),
+        released AS (
+            DELETE FROM customer_key USING replaced WHERE customer_key.index = replaced.index
+        ),
+        delta AS (
+            SELECT country, city, subscription_date, -1 AS customers FROM replaced
+        ),
+        {ROLLUP_DELTA_CTE}
+        SELECT count(*) FROM replaced;
+    """
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+    def _merge_staging(self, cursor) -> int:
+        if self.load_mode == "upsert":
+            cursor.execute(self.REPLACE_CHANGED_SQL)
+        cursor.execute(self._merge_sql())
+        # Inserted plus, in upsert mode, replaced rows; unchanged rows are not written
+        written = cursor.fetchone()[0]
+        if written:
+            cursor.execute(BUMP_GENERATION_SQL)
+        return written
+
+    def _copy_to_db(self, df: pl.DataFrame) -> bool:
+        """COPY the frame into a temporary staging table, then merge it into customer in a single statement"""
+        started_at = time.perf_counter()
+
+        try:
+            prepared = self._prepare_frame(df)
+        except Exception as e:
+            logger.error("dataframe_row_parse_failed", error=str(e))
+            return False
+
+        self._ensure_partitions(prepared)
+
+        columns = ", ".join(CUSTOMER_COLUMNS)
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(STAGING_TABLE_SQL)
+                    cursor.copy_expert(
+                        f"COPY customer_staging ({columns}) FROM STDIN WITH (FORMAT csv)",
+                        FrameCSVStream(prepared, self.copy_batch_size),
+                    )
+                    written = self._merge_staging(cursor)
+
+                conn.commit()
+            self._log_throughput(prepared.height, started_at, mode=self.load_mode, written=written)
+            return True
+
+        except Exception as e:
+            logger.error("sql_bulk_insert_failed", error=str(e))
+            return False
+
+
+class AsyncDataLoader(DataLoader):
+    """asyncpg counterpart of DataLoader for the asyncio pipeline: each load binary-COPYs the frame into the staging
+    table and runs the same merge, on a pool of up to `pool_size` connections. Every mode stages through COPY, so
+    "insert" behaves like "copy". Dedup lookups and the monthly partition DDL stay on psycopg2/SQLite, in threads."""
+
+    def __init__(self, *args, pool_size: int = DB_POOL_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_size = pool_size
+        self._async_pool: asyncpg.Pool | None = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _connection_pool(self) -> asyncpg.Pool:
+        async with self._pool_lock:
+            if self._async_pool is None:
+                self._async_pool = await asyncpg.create_pool(
+                    database=DATABASE_CONFIG["NAME"],
+                    user=DATABASE_CONFIG["USER"],
+                    password=DATABASE_CONFIG["PASSWORD"],
+                    host=DATABASE_CONFIG["HOST"],
+                    port=int(DATABASE_CONFIG["PORT"]),
+                    min_size=1,
+                    max_size=self.pool_size,
+                )
+            return self._async_pool
+
+    async def aclose(self):
+        if self._async_pool is not None:
+            await self._async_pool.close()
+            self._async_pool = None
+        await asyncio.to_thread(self.close)
+
+    async def load_to_db(self, df: pl.DataFrame | None) -> bool:
+        """Loads the frame into the customer table, returning False when the load failed"""
+        if df is None or df.is_empty():
+            logger.warning("no_data_to_insert")
+            return True
+
+        source_file = df["source_file"][0] if "source_file" in df.columns else None
+        with self.metrics.timer("load", source_file) as record:
+            loaded = await self._load(df)
+            record.update(rows=df.height, errors=int(not loaded))
+        return loaded
+
+    async def _load(self, df: pl.DataFrame) -> bool:
+        if self.dedup_index is not None:
+            df = await asyncio.to_thread(self._filter_new, df)
+            if df is None:
+                return False
+            if df.is_empty():
+                return True
+
+        loaded = await self._copy_to_db(df)
+        if loaded and self.dedup_index is not None:
+            await asyncio.to_thread(self.dedup_index.record, df)
+        return loaded
+
+    async def _copy_to_db(self, df: pl.DataFrame) -> bool:
+        started_at = time.perf_counter()
+
+        try:
+            prepared = self._prepare_frame(df)
+        except Exception as e:
+            logger.error("dataframe_row_parse_failed", error=str(e))
+            return False
+
+        if self._missing_partitions(prepared):
+            await asyncio.to_thread(self._ensure_partitions, prepared)
+
+        try:
+            pool = await self._connection_pool()
+            async with pool.acquire() as conn, conn.transaction():
+                await conn.execute(STAGING_TABLE_SQL)
+                # Binary COPY of the typed values; ingested_at is already UTC
+                await conn.copy_records_to_table(
+                    "customer_staging", records=prepared.iter_rows(), columns=CUSTOMER_COLUMNS
+                )
+                if self.load_mode == "upsert":
+                    await conn.execute(self.REPLACE_CHANGED_SQL)
+                written = await conn.fetchval(self._merge_sql())
+                if written:
+                    await conn.execute(BUMP_GENERATION_SQL)
 
-            logger.info("records_loaded_to_db", count=len(values))
+            self._log_throughput(prepared.height, started_at, mode=f"async-{self.load_mode}", written=written)
+            return True
 
         except Exception as e:
             logger.error("sql_bulk_insert_failed", error=str(e))
+            return False
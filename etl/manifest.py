@@ -0,0 +1,72 @@
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import structlog
+from decouple import config
+
+logger = structlog.get_logger()
+
+MANIFEST_PATH = config("ETL_MANIFEST_PATH", default="etl/manifest.sqlite3")
+
+
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """Remembers the size, mtime and content hash of every remote file that was ingested successfully"""
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ingested_file (
+                    remote_path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    ingested_at TEXT NOT NULL
+                )
+            """
+            )
+
+    def _fetch(self, remote_path: str) -> tuple | None:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT size, mtime, sha256 FROM ingested_file WHERE remote_path = ?", (remote_path,)
+            ).fetchone()
+
+    def is_unchanged(self, remote_path: str, size: int, mtime: int) -> bool:
+        """True when the remote listing still reports the size and mtime recorded at the last ingestion"""
+        entry = self._fetch(remote_path)
+        return entry is not None and entry[0] == size and entry[1] == mtime
+
+    def has_content(self, remote_path: str, sha256: str) -> bool:
+        """True when a re-downloaded file turns out to have the same content as the last ingested version"""
+        entry = self._fetch(remote_path)
+        return entry is not None and entry[2] == sha256
+
+    def record(self, remote_path: str, size: int, mtime: int, sha256: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO ingested_file (remote_path, size, mtime, sha256, ingested_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (remote_path) DO UPDATE SET
+                    size = excluded.size, mtime = excluded.mtime, sha256 = excluded.sha256,
+                    ingested_at = excluded.ingested_at
+            """,
+                (remote_path, size, mtime, sha256, datetime.now(timezone.utc).isoformat()),
+            )
+        logger.info("manifest_recorded", remote_path=remote_path, size=size, mtime=mtime)
+
+    def close(self):
+        self._conn.close()
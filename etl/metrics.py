@@ -0,0 +1,178 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import structlog
+from decouple import config
+
+logger = structlog.get_logger()
+
+METRICS_ENABLED = config("ETL_METRICS", cast=bool, default=False)
+METRICS_DIR = config("ETL_METRICS_DIR", default="etl/logs")
+
+COUNTERS = ("calls", "duration_s", "rows", "bytes", "retries", "errors")
+PROMETHEUS_HELP = {
+    "calls": "Number of times the stage ran",
+    "duration_s": "Seconds spent in the stage",
+    "rows": "Rows handled by the stage",
+    "bytes": "Bytes downloaded, read or written by the stage",
+    "retries": "Retried attempts inside the stage",
+    "errors": "Stage runs that failed",
+    "rss_bytes_max": "Highest resident memory seen at the end of a stage run",
+}
+PROMETHEUS_NAMES = {"duration_s": "duration_seconds"}
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak rather than current RSS, in kilobytes on Linux and bytes on macOS; close enough off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _empty_entry() -> dict:
+    return {**dict.fromkeys(COUNTERS, 0), "rss_bytes_max": 0}
+
+
+def _accumulate(entry: dict, values: dict):
+    for key in COUNTERS:
+        entry[key] += values.get(key, 0)
+    entry["rss_bytes_max"] = max(entry["rss_bytes_max"], values.get("rss_bytes_max", 0))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """Thread-safe per-stage and per-file totals (time, rows, bytes, retries, errors, memory) for one pipeline run"""
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now(timezone.utc)
+            self._stages: dict[str, dict] = {}
+            self._files: dict[tuple[str, str], dict] = {}
+
+    def add(self, stage: str, file: str | None = None, **values):
+        """Adds counter values (calls, duration_s, rows, bytes, retries, errors) and an rss_bytes_max sample"""
+        with self._lock:
+            _accumulate(self._stages.setdefault(stage, _empty_entry()), values)
+            if file is not None:
+                _accumulate(self._files.setdefault((stage, file), _empty_entry()), values)
+
+    @contextmanager
+    def timer(self, stage: str, file: str | None = None):
+        """Times the block; the caller fills rows, bytes or errors into the yielded dict"""
+        record = {"calls": 1}
+        started_at = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record["errors"] = 1
+            raise
+        finally:
+            record["duration_s"] = time.perf_counter() - started_at
+            record["rss_bytes_max"] = current_rss_bytes()
+            self.add(stage, file, **record)
+
+    def merge(self, summary: dict):
+        """Folds in the summary of another RunMetrics, e.g. one collected in a worker process"""
+        for stage, values in summary["stages"].items():
+            self.add(stage, **values)
+        with self._lock:
+            for values in summary["files"]:
+                _accumulate(self._files.setdefault((values["stage"], values["file"]), _empty_entry()), values)
+
+    @staticmethod
+    def _rounded(entry: dict) -> dict:
+        return {key: round(value, 3) if isinstance(value, float) else value for key, value in entry.items()}
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(),
+                "duration_s": round((datetime.now(timezone.utc) - self.started_at).total_seconds(), 3),
+                "stages": {stage: self._rounded(entry) for stage, entry in self._stages.items()},
+                "files": [
+                    {"stage": stage, "file": file, **self._rounded(entry)}
+                    for (stage, file), entry in self._files.items()
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        """Renders the run in the Prometheus text exposition format, e.g. for the node_exporter textfile collector"""
+        summary = self.summary()
+        lines = [
+            "# HELP etl_run_duration_seconds Wall time of the pipeline run",
+            "# TYPE etl_run_duration_seconds gauge",
+            f"etl_run_duration_seconds {summary['duration_s']}",
+        ]
+        for key, help_text in PROMETHEUS_HELP.items():
+            name = PROMETHEUS_NAMES.get(key, key)
+            for scope, entries in (
+                ("stage", [{"stage": stage, **entry} for stage, entry in summary["stages"].items()]),
+                ("file", summary["files"]),
+            ):
+                metric = f"etl_{scope}_{name}"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+                for entry in entries:
+                    labels = f'stage="{_escape_label(entry["stage"])}"'
+                    if scope == "file":
+                        labels += f',file="{_escape_label(entry["file"])}"'
+                    lines.append(f"{metric}{{{labels}}} {entry[key]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str = METRICS_DIR) -> tuple[str, str]:
+        """Writes run_metrics.json and run_metrics.prom; the .prom file is replaced atomically for scrapers"""
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, "run_metrics.json")
+        prom_path = os.path.join(directory, "run_metrics.prom")
+
+        summary = self.summary()
+        with open(json_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        with open(f"{prom_path}.tmp", "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(f"{prom_path}.tmp", prom_path)
+
+        logger.info("run_metrics_written", json=json_path, prometheus=prom_path, stages=summary["stages"])
+        return json_path, prom_path
+
+
+class NullMetrics:
+    """Stand-in used when metrics are disabled; every call returns immediately"""
+
+    enabled = False
+
+    def add(self, stage: str, file: str | None = None, **values):
+        pass
+
+    def timer(self, stage: str, file: str | None = None):
+        return nullcontext({})
+
+    def merge(self, summary: dict):
+        pass
+
+    def summary(self) -> dict:
+        return {}
+
+    def reset(self):
+        pass
+
+    def write(self, directory: str = METRICS_DIR):
+        return None
+
+
+NULL_METRICS = NullMetrics()
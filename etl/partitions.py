@@ -0,0 +1,91 @@
+import argparse
+import datetime
+
+import structlog
+from decouple import config
+from load import (
+    ATTACHED_PARTITION_SQL,
+    BUMP_GENERATION_SQL,
+    PARTITION_LOCK_ID,
+    ROLLUP_DELTA_CTE,
+    ensure_partitions,
+    get_db_connection,
+    month_start,
+    next_month,
+    partition_name,
+)
+
+logger = structlog.get_logger()
+
+# Months after the current one whose partitions are created in advance, e.g. by a monthly cron job
+PARTITION_MONTHS_AHEAD = config("ETL_PARTITION_MONTHS_AHEAD", cast=int, default=2)
+
+
+def ensure_partitions_ahead(conn, months_ahead: int = PARTITION_MONTHS_AHEAD) -> list[datetime.date]:
+    """Creates the partitions of the current month and the next `months_ahead` months"""
+    month = month_start(datetime.datetime.now(datetime.timezone.utc).date())
+    months = [month]
+    for _ in range(months_ahead):
+        months.append(next_month(months[-1]))
+    return ensure_partitions(conn, months)
+
+
+def archive_partition(conn, month: datetime.date) -> int:
+    """Detaches a month from customer and takes its rows out of customer_rollup and customer_key, instead of a
+    DELETE over the whole table. The detached table is kept as customer_YYYY_MM_archived, to be dumped and dropped."""
+    month = month_start(month)
+    name = partition_name(month)
+    with conn, conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_ID,))
+        cursor.execute(ATTACHED_PARTITION_SQL, (name,))
+        if cursor.fetchone() is None:
+            raise ValueError(f"'{name}' is not a partition of customer")
+
+        # Renamed so a later load of the same month gets a fresh partition
+        cursor.execute(f"ALTER TABLE customer DETACH PARTITION {name}")
+        cursor.execute(f"ALTER TABLE {name} RENAME TO {name}_archived")
+        cursor.execute(
+            f"""
+            WITH delta AS (
+                SELECT country, city, subscription_date, -1 AS customers FROM {name}_archived
+            ),
+            {ROLLUP_DELTA_CTE}
+            DELETE FROM customer_key USING {name}_archived WHERE customer_key.index = {name}_archived.index;
+            """
+        )
+        archived = cursor.rowcount
+        if archived:
+            cursor.execute(BUMP_GENERATION_SQL)
+    logger.info("partition_archived", partition=name, table=f"{name}_archived", rows=archived)
+    return archived
+
+
+def _month(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, "%Y-%m").date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the customer table")
+    parser.add_argument(
+        "--ahead",
+        type=int,
+        default=PARTITION_MONTHS_AHEAD,
+        help="Create the partitions of the current month and this many months after it",
+    )
+    parser.add_argument(
+        "--archive",
+        type=_month,
+        nargs="+",
+        default=[],
+        metavar="YYYY-MM",
+        help="Detach these months from customer and drop their rows from the rollup and key tables",
+    )
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        ensure_partitions_ahead(conn, args.ahead)
+        for month in args.archive:
+            archive_partition(conn, month)
+    finally:
+        conn.close()
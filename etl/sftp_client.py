@@ -1,13 +1,145 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import stat
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+import asyncssh
 import paramiko
 import structlog
 from alerts import AlertHandler
-from tenacity import retry, stop_after_attempt, wait_exponential
+from decouple import config
+from manifest import file_sha256
+from metrics import NULL_METRICS
+from tenacity import RetryCallState, retry, stop_after_attempt, wait_exponential
 
 logger = structlog.get_logger()
 
+DOWNLOAD_CONCURRENCY = config("SFTP_DOWNLOAD_CONCURRENCY", cast=int, default=1)
+# Downloads the asyncio pipeline keeps in flight over its single SSH connection
+ASYNC_DOWNLOAD_CONCURRENCY = config("SFTP_ASYNC_DOWNLOAD_CONCURRENCY", cast=int, default=32)
+# Files at least this large are fetched by the pooled manager as SFTP_RANGE_PARTS byte ranges over separate sessions
+RANGE_THRESHOLD = config("SFTP_RANGE_THRESHOLD", cast=int, default=256 * 1024 * 1024)
+RANGE_PARTS = config("SFTP_RANGE_PARTS", cast=int, default=4)
+# A `<file>.sha256` the server publishes next to a file is checked against the download; empty disables the check
+CHECKSUM_SUFFIX = config("SFTP_CHECKSUM_SUFFIX", default=".sha256")
+
+PART_SUFFIX = ".part"
+PROGRESS_SUFFIX = ".progress"
+# Progress is saved after this many bytes of a range, bounding what a killed run downloads again
+CHECKPOINT_BYTES = 8 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+# asyncssh logs every channel and file transfer at INFO; the file_downloaded events already cover them
+logging.getLogger("asyncssh").setLevel(logging.WARNING)
+
+
+def _count_retry(retry_state: RetryCallState):
+    manager, *args = retry_state.args
+    remote_file = args[0] if retry_state.fn.__name__ == "download_file" else None
+    manager.metrics.add("download" if remote_file else "sftp", remote_file, retries=1)
+
+
+sftp_retry = retry(
+    stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2), reraise=True, before_sleep=_count_retry
+)
+
+
+def _is_data_file(name: str) -> bool:
+    return not (CHECKSUM_SUFFIX and name.endswith(CHECKSUM_SUFFIX))
+
+
+class PartialDownload:
+    """A download written to `<local_path>.part`, with the remote size and mtime and how far each byte range got kept
+    in a `.progress` file beside it, so a retry or the next run continues where the last attempt stopped. A part of
+    another version of the remote file is truncated and starts over."""
+
+    def __init__(self, local_path: str, size: int, mtime: float, parts: int = 1):
+        self.local_path = local_path
+        self.size = size
+        self.mtime = int(mtime)
+        self.part_path = local_path + PART_SUFFIX
+        self.progress_path = self.part_path + PROGRESS_SUFFIX
+        self._lock = threading.Lock()
+        ranges = self._load_progress()
+        if ranges is None:
+            ranges = self._split(max(parts, 1))
+            open(self.part_path, "wb").close()
+        self.ranges: list[list[int]] = ranges
+        self.resumed_bytes = sum(done - start for start, done, _ in ranges)
+        self._save_progress()
+
+    def _load_progress(self) -> list[list[int]] | None:
+        if not os.path.exists(self.part_path):
+            return None
+        try:
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # Without a readable progress file nothing in the part can be trusted
+            return None
+        if not isinstance(progress, dict) or (progress.get("size"), progress.get("mtime")) != (self.size, self.mtime):
+            return None
+        return progress["ranges"]
+
+    def _split(self, parts: int) -> list[list[int]]:
+        step = max(-(-self.size // parts), 1)
+        return [[start, start, min(start + step, self.size)] for start in range(0, self.size, step)] or [[0, 0, 0]]
+
+    def _save_progress(self):
+        with open(self.progress_path, "w") as f:
+            json.dump({"size": self.size, "mtime": self.mtime, "ranges": self.ranges}, f)
+
+    def pending(self) -> list[int]:
+        return [index for index, (_, done, end) in enumerate(self.ranges) if done < end]
+
+    def advance(self, index: int, done: int):
+        """Records that range `index` is on disk up to byte `done`; call it only after the bytes are flushed"""
+        with self._lock:
+            self.ranges[index][1] = done
+            self._save_progress()
+
+    def discard(self):
+        for path in (self.part_path, self.progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def commit(self, size: int, mtime: float, checksum: str | None = None):
+        """Renames the part to local_path once it is complete, the remote file did not change meanwhile and, when
+        the server publishes one, its SHA-256 matches. A part that fails the checks is discarded."""
+        if self.pending():
+            raise IOError(f"{self.part_path} has unfinished ranges")
+        actual = os.path.getsize(self.part_path)
+        if actual != self.size:
+            self.discard()
+            raise IOError(f"{self.part_path} holds {actual} of {self.size} bytes")
+        if (size, int(mtime)) != (self.size, self.mtime):
+            self.discard()
+            raise IOError(f"{self.local_path} changed on the server while it was downloaded")
+        if checksum and file_sha256(self.part_path) != checksum.lower():
+            self.discard()
+            raise IOError(f"{self.local_path} does not match its published SHA-256")
+        os.replace(self.part_path, self.local_path)
+        os.remove(self.progress_path)
+
 
 class SFTPClientManager:
-    def __init__(self, host: str, port: int, username: str, password: str, remote_folder=".", alert_handler=None):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        remote_folder=".",
+        alert_handler=None,
+        metrics=None,
+    ):
         self.host = host
         self.port = port
         self.username = username
@@ -15,24 +147,314 @@ class SFTPClientManager:
         self.remote_folder = remote_folder
         self.client: paramiko.SFTPClient | None = None
         self.alert_handler = alert_handler or AlertHandler()
+        self.metrics = metrics or NULL_METRICS
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2), reraise=True)
-    def connect(self):
+    def _open_client(self) -> paramiko.SFTPClient:
         transport = paramiko.Transport((self.host, self.port))
         transport.connect(username=self.username, password=self.password)
-        self.client = paramiko.SFTPClient.from_transport(transport)
+        return paramiko.SFTPClient.from_transport(transport)
+
+    @staticmethod
+    def _close_client(client: paramiko.SFTPClient):
+        transport = client.get_channel().get_transport()
+        client.close()
+        transport.close()
+
+    @sftp_retry
+    def connect(self):
+        self.client = self._open_client()
         logger.info("sftp_connected", host=self.host)
 
     def disconnect(self):
         if self.client:
-            self.client.close()
+            self._close_client(self.client)
             logger.info("sftp_disconnected")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2), reraise=True)
+    @sftp_retry
     def list_files(self) -> list[str]:
-        return self.client.listdir(self.remote_folder)
+        return [name for name in self.client.listdir(self.remote_folder) if _is_data_file(name)]
+
+    @sftp_retry
+    def list_file_attrs(self) -> list[paramiko.SFTPAttributes]:
+        """Lists the regular files in the remote folder with their size and mtime, leaving out checksum files"""
+        return [
+            attr
+            for attr in self.client.listdir_attr(self.remote_folder)
+            if stat.S_ISREG(attr.st_mode or 0) and _is_data_file(attr.filename)
+        ]
+
+    def remote_path(self, remote_file: str) -> str:
+        return f"{self.remote_folder}/{remote_file}"
+
+    @contextmanager
+    def _session(self) -> Iterator[paramiko.SFTPClient]:
+        yield self.client
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2), reraise=True)
+    def _range_parts(self, size: int) -> int:
+        return 1
+
+    @sftp_retry
     def download_file(self, remote_file: str, local_path: str):
-        self.client.get(f"{self.remote_folder}/{remote_file}", local_path)
-        logger.info("file_downloaded", remote_file=remote_file, local_path=local_path)
+        """Downloads into a .part file next to local_path, resuming whatever an earlier attempt left there, and
+        renames it to local_path once it is verified"""
+        remote_path = self.remote_path(remote_file)
+        with self._session() as client:
+            attr = client.stat(remote_path)
+        download = PartialDownload(local_path, attr.st_size, attr.st_mtime, self._range_parts(attr.st_size))
+        self._fetch_ranges(remote_path, download)
+        with self._session() as client:
+            attr = client.stat(remote_path)
+            checksum = self._published_checksum(client, remote_path)
+        download.commit(attr.st_size, attr.st_mtime, checksum)
+        logger.info(
+            "file_downloaded",
+            remote_file=remote_file,
+            local_path=local_path,
+            resumed_bytes=download.resumed_bytes,
+            ranges=len(download.ranges),
+        )
+
+    def _fetch_ranges(self, remote_path: str, download: PartialDownload):
+        for index in download.pending():
+            self._fetch_range(remote_path, download, index)
+
+    def _fetch_range(self, remote_path: str, download: PartialDownload, index: int):
+        _, done, end = download.ranges[index]
+        with (
+            self._session() as client,
+            client.open(remote_path, "rb") as remote,
+            open(download.part_path, "r+b") as local,
+        ):
+            remote.seek(done)
+            local.seek(done)
+            # Requests every 32 KiB block up to the end of the range at once instead of one round trip per read
+            remote.prefetch(end)
+            checkpoint = done
+            try:
+                while done < end:
+                    data = remote.read(min(READ_SIZE, end - done))
+                    if not data:
+                        raise EOFError(f"{remote_path} ended at byte {done} of {end}")
+                    local.write(data)
+                    done += len(data)
+                    if done - checkpoint >= CHECKPOINT_BYTES:
+                        local.flush()
+                        download.advance(index, done)
+                        checkpoint = done
+            finally:
+                # Whatever arrived before a failure is kept for the retry
+                local.flush()
+                download.advance(index, done)
+
+    @staticmethod
+    def _published_checksum(client: paramiko.SFTPClient, remote_path: str) -> str | None:
+        if not CHECKSUM_SUFFIX:
+            return None
+        try:
+            with client.open(remote_path + CHECKSUM_SUFFIX, "r") as f:
+                digest = f.read().split()
+        except FileNotFoundError:
+            return None
+        return digest[0].decode() if digest else None
+
+    def download_to_dir(self, remote_file: str, local_dir: str) -> str | None:
+        local_path = os.path.join(local_dir, remote_file)
+        with self.metrics.timer("download", remote_file) as record:
+            try:
+                self.download_file(remote_file, local_path)
+            except Exception as e:
+                record["errors"] = 1
+                self.alert_handler.alert("file_download_failed", remote_file=remote_file, error=str(e))
+                return None
+            if self.metrics.enabled:
+                record["bytes"] = os.path.getsize(local_path)
+        return local_path
+
+    def download_files(self, remote_files: list[str], local_dir: str) -> list[str]:
+        """Downloads each file into local_dir, alerting on the ones that still fail after retries"""
+        local_paths = [self.download_to_dir(remote_file, local_dir) for remote_file in remote_files]
+        return [path for path in local_paths if path]
+
+
+class PooledSFTPClientManager(SFTPClientManager):
+    """Keeps pool_size authenticated SFTP sessions open and downloads files over them concurrently. Files of at
+    least range_threshold bytes are split into range_parts byte ranges fetched over separate sessions."""
+
+    def __init__(
+        self,
+        *args,
+        pool_size: int = DOWNLOAD_CONCURRENCY,
+        range_parts: int = RANGE_PARTS,
+        range_threshold: int = RANGE_THRESHOLD,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.pool_size = max(pool_size, 1)
+        self.range_parts = max(range_parts, 1)
+        self.range_threshold = range_threshold
+        self._pool: queue.Queue[paramiko.SFTPClient | None] = queue.Queue()
+
+    def connect(self):
+        super().connect()
+        self._pool.put(self.client)
+        # The remaining sessions are opened lazily by the first download that needs them
+        for _ in range(self.pool_size - 1):
+            self._pool.put(None)
+
+    def disconnect(self):
+        while not self._pool.empty():
+            client = self._pool.get_nowait()
+            if client is not None and client is not self.client:
+                self._close_client(client)
+        super().disconnect()
+
+    @contextmanager
+    def _session(self) -> Iterator[paramiko.SFTPClient]:
+        client = self._pool.get()
+        try:
+            if client is None:
+                client = self._open_client()
+            yield client
+        except Exception:
+            # Drop the session so the retry starts on a fresh transport
+            if client is not None:
+                self._close_client(client)
+            client = None
+            raise
+        finally:
+            self._pool.put(client)
+
+    def _range_parts(self, size: int) -> int:
+        return min(self.range_parts, self.pool_size) if size >= self.range_threshold else 1
+
+    def _fetch_ranges(self, remote_path: str, download: PartialDownload):
+        pending = download.pending()
+        if len(pending) < 2:
+            return super()._fetch_ranges(remote_path, download)
+        # Each range checks a session out only while it transfers, so files and ranges share the pool without
+        # a file holding a session while it waits for more
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="sftp-range") as executor:
+            for future in [executor.submit(self._fetch_range, remote_path, download, i) for i in pending]:
+                future.result()
+
+    def download_files(self, remote_files: list[str], local_dir: str) -> list[str]:
+        with ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="sftp") as executor:
+            local_paths = list(executor.map(partial(self.download_to_dir, local_dir=local_dir), remote_files))
+        return [path for path in local_paths if path]
+
+
+def _as_sftp_attributes(entry: asyncssh.SFTPName) -> paramiko.SFTPAttributes:
+    attr = paramiko.SFTPAttributes()
+    attr.filename = entry.filename
+    attr.st_size = entry.attrs.size
+    attr.st_mtime = entry.attrs.mtime
+    attr.st_mode = entry.attrs.permissions
+    return attr
+
+
+class AsyncSFTPClientManager(SFTPClientManager):
+    """asyncssh counterpart of SFTPClientManager for the asyncio pipeline. One SSH connection carries up to
+    `concurrency` downloads at once, each pipelining its block reads; retries wait with asyncio.sleep."""
+
+    def __init__(self, *args, concurrency: int = ASYNC_DOWNLOAD_CONCURRENCY, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.concurrency = max(concurrency, 1)
+        self.connection: asyncssh.SSHClientConnection | None = None
+        self.client: asyncssh.SFTPClient | None = None
+        self._connect_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    @sftp_retry
+    async def connect(self):
+        # Like the paramiko transport, the host key is not checked against known_hosts
+        self.connection = await asyncssh.connect(
+            self.host, self.port, username=self.username, password=self.password, known_hosts=None
+        )
+        self.client = await self.connection.start_sftp_client()
+        logger.info("sftp_connected", host=self.host, concurrency=self.concurrency)
+
+    async def disconnect(self):
+        if self.connection:
+            self.connection.close()
+            await self.connection.wait_closed()
+            self.connection = self.client = None
+            logger.info("sftp_disconnected")
+
+    async def _session(self) -> asyncssh.SFTPClient:
+        """The open SFTP session; after the connection dropped, the first caller reconnects for everyone"""
+        async with self._connect_lock:
+            if self.connection is None or self.connection.is_closed():
+                await self.connect()
+            return self.client
+
+    @sftp_retry
+    async def list_files(self) -> list[str]:
+        client = await self._session()
+        names = await client.listdir(self.remote_folder)
+        return [name for name in names if name not in (".", "..") and _is_data_file(name)]
+
+    @sftp_retry
+    async def list_file_attrs(self) -> list[paramiko.SFTPAttributes]:
+        """Lists the regular files in the remote folder, as paramiko attributes so the manifest code is shared"""
+        client = await self._session()
+        entries = await client.readdir(self.remote_folder)
+        return [
+            _as_sftp_attributes(entry)
+            for entry in entries
+            if stat.S_ISREG(entry.attrs.permissions or 0) and _is_data_file(entry.filename)
+        ]
+
+    @sftp_retry
+    async def download_file(self, remote_file: str, local_path: str):
+        """Resumable like the paramiko download, as a single range since the transfers share one connection"""
+        remote_path = self.remote_path(remote_file)
+        client = await self._session()
+        attrs = await client.stat(remote_path)
+        download = PartialDownload(local_path, attrs.size, attrs.mtime)
+        resumed = download.resumed_bytes
+        for index in download.pending():
+            _, done, end = download.ranges[index]
+            async with client.open(remote_path, "rb") as remote:
+                with open(download.part_path, "r+b") as local:
+                    local.seek(done)
+                    while done < end:
+                        # asyncssh splits a large read into pipelined block requests
+                        data = await remote.read(min(CHECKPOINT_BYTES, end - done), done)
+                        if not data:
+                            raise EOFError(f"{remote_path} ended at byte {done} of {end}")
+                        local.write(data)
+                        local.flush()
+                        done += len(data)
+                        download.advance(index, done)
+        attrs = await client.stat(remote_path)
+        download.commit(attrs.size, attrs.mtime, await self._published_checksum_async(client, remote_path))
+        logger.info("file_downloaded", remote_file=remote_file, local_path=local_path, resumed_bytes=resumed)
+
+    @staticmethod
+    async def _published_checksum_async(client: asyncssh.SFTPClient, remote_path: str) -> str | None:
+        if not CHECKSUM_SUFFIX:
+            return None
+        try:
+            async with client.open(remote_path + CHECKSUM_SUFFIX) as f:
+                digest = (await f.read()).split()
+        except asyncssh.SFTPNoSuchFile:
+            return None
+        return digest[0] if digest else None
+
+    async def download_to_dir(self, remote_file: str, local_dir: str) -> str | None:
+        local_path = os.path.join(local_dir, remote_file)
+        async with self._slots:
+            with self.metrics.timer("download", remote_file) as record:
+                try:
+                    await self.download_file(remote_file, local_path)
+                except Exception as e:
+                    record["errors"] = 1
+                    self.alert_handler.alert("file_download_failed", remote_file=remote_file, error=str(e))
+                    return None
+                if self.metrics.enabled:
+                    record["bytes"] = os.path.getsize(local_path)
+        return local_path
+
+    async def download_files(self, remote_files: list[str], local_dir: str) -> list[str]:
+        local_paths = await asyncio.gather(*(self.download_to_dir(name, local_dir) for name in remote_files))
+        return [path for path in local_paths if path]
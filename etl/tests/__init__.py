@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The ETL modules run as scripts from inside etl/ and import their siblings directly (e.g. `from alerts import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,319 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from datetime import date, datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+import asyncssh
+import polars as pl
+import psycopg2
+from tenacity import wait_none
+
+from etl.benchmark import BENCHMARK_INDEX_OFFSET, _delete_benchmark_rows, synthetic_customers
+from etl.ingest import AsyncIngestionPipeline
+from etl.load import AsyncDataLoader, DataLoader, get_db_connection
+from etl.metrics import RunMetrics
+from etl.sftp_client import AsyncSFTPClientManager
+from etl.transform import DataTransformer
+
+
+class _PasswordServer(asyncssh.SSHServer):
+    def begin_auth(self, username: str) -> bool:
+        return True
+
+    def password_auth_supported(self) -> bool:
+        return True
+
+    def validate_password(self, username: str, password: str) -> bool:
+        return (username, password) == ("user", "secret")
+
+
+class LocalSFTPServer:
+    """asyncssh SFTP server on 127.0.0.1 serving `root` from its own event loop thread. Opening one of `flaky`
+    files fails the first time, like a transfer cut off by the network."""
+
+    def __init__(self, root: str, flaky: tuple[str, ...] = ()):
+        self.root = root
+        self.flaky = set(flaky)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def _sftp_server(self, channel):
+        flaky = self.flaky
+
+        class FlakySFTPServer(asyncssh.SFTPServer):
+            def _fail_once(self, path: bytes):
+                name = os.path.basename(path.decode())
+                if name in flaky:
+                    flaky.discard(name)
+                    raise asyncssh.SFTPFailure(f"{name}: connection reset")
+
+            def open(self, path, pflags, attrs):
+                self._fail_once(path)
+                return super().open(path, pflags, attrs)
+
+            def open56(self, path, desired_access, flags, attrs):
+                self._fail_once(path)
+                return super().open56(path, desired_access, flags, attrs)
+
+        return FlakySFTPServer(channel, chroot=self.root.encode())
+
+    async def _listen(self) -> asyncssh.SSHAcceptor:
+        return await asyncssh.listen(
+            "127.0.0.1",
+            0,
+            server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+            server_factory=_PasswordServer,
+            sftp_factory=self._sftp_server,
+        )
+
+    def __enter__(self) -> "LocalSFTPServer":
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(self._listen(), self.loop).result(timeout=10)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.close()
+        asyncio.run_coroutine_threadsafe(self.server.wait_closed(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class RecordingLoader:
+    """Async stand-in for AsyncDataLoader that keeps every frame it is given"""
+
+    def __init__(self):
+        self.frames: list[pl.DataFrame] = []
+
+    async def load_to_db(self, df: pl.DataFrame | None) -> bool:
+        await asyncio.sleep(0)
+        self.frames.append(df)
+        return True
+
+    async def aclose(self):
+        pass
+
+
+class TestAsyncIngestionPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.remote_dir = os.path.join(self.tmp_dir.name, "remote")
+        self.download_dir = os.path.join(self.tmp_dir.name, "downloads")
+        os.makedirs(os.path.join(self.remote_dir, "inbox"))
+        os.makedirs(self.download_dir)
+
+        self.files = [f"customers-{number:02}.csv" for number in range(12)]
+        for number, name in enumerate(self.files):
+            rows = "\n".join(f"{number * 10 + i},{name}-{i},2023-12-01" for i in range(5))
+            Path(self.remote_dir, "inbox", name).write_text(f"Index,Customer Id,Subscription Date\n{rows}\n")
+
+        patcher = mock.patch.object(AsyncSFTPClientManager.download_file.retry, "wait", wait_none())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pipeline(self, port: int, **kwargs) -> AsyncIngestionPipeline:
+        sftp_config = {"host": "127.0.0.1", "port": port, "username": "user", "password": "secret"}
+        pipeline = AsyncIngestionPipeline(
+            {**sftp_config, "remote_folder": "inbox"},
+            alert_handler=mock.Mock(),
+            ingestor_config={"download_dir": self.download_dir, "transformed_dir": self.tmp_dir.name, "chunk_size": 2},
+            download_concurrency=4,
+            transform_workers=3,
+            **kwargs,
+        )
+        pipeline.loader = RecordingLoader()
+        return pipeline
+
+    def test_run_downloads_and_loads_every_file(self):
+        with LocalSFTPServer(self.remote_dir) as server:
+            pipeline = self.pipeline(server.port)
+            pipeline.run()
+
+        pipeline.alert_handler.alert.assert_not_called()
+        self.assertEqual(sorted(os.listdir(self.download_dir)), self.files)
+        frames = pipeline.loader.frames
+        self.assertEqual(sum(df.height for df in frames), 60)
+        self.assertEqual({df["source_file"][0] for df in frames}, set(self.files))
+        self.assertIsNone(pipeline.sftp_manager.connection)
+
+    def test_single_file_run(self):
+        with LocalSFTPServer(self.remote_dir) as server:
+            pipeline = self.pipeline(server.port)
+            pipeline.run(filename="customers-03.csv")
+
+        self.assertEqual(os.listdir(self.download_dir), ["customers-03.csv"])
+        loaded = pl.concat(pipeline.loader.frames)
+        self.assertEqual(sorted(loaded["index"].to_list()), [30, 31, 32, 33, 34])
+
+    def test_failed_transfer_is_retried_without_blocking_the_others(self):
+        metrics = RunMetrics()
+        with LocalSFTPServer(self.remote_dir, flaky=("customers-05.csv",)) as server:
+            pipeline = self.pipeline(server.port, metrics=metrics)
+            with mock.patch.object(metrics, "write"):
+                pipeline.run()
+
+        pipeline.alert_handler.alert.assert_not_called()
+        self.assertEqual(len(os.listdir(self.download_dir)), len(self.files))
+        self.assertEqual(metrics.summary()["stages"]["download"]["retries"], 1)
+
+    def test_unreachable_server_alerts(self):
+        with LocalSFTPServer(self.remote_dir) as server:
+            port = server.port
+        pipeline = self.pipeline(port)
+        with mock.patch.object(AsyncSFTPClientManager.connect.retry, "wait", wait_none()):
+            pipeline.run()
+
+        self.assertEqual(pipeline.alert_handler.alert.call_args.args[0], "pipeline_failed")
+        self.assertEqual(pipeline.loader.frames, [])
+
+
+class TestAsyncDataLoader(unittest.TestCase):
+    """Loads through asyncpg into the local PostgreSQL the ETL is configured for; skipped without one"""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            conn = get_db_connection()
+        except psycopg2.Error as e:
+            raise unittest.SkipTest(f"PostgreSQL is not reachable: {e}")
+        try:
+            with conn, conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass('customer_key')")
+                migrated = cursor.fetchone()[0] is not None
+        finally:
+            conn.close()
+        if not migrated:
+            raise unittest.SkipTest("The database is not migrated")
+
+    def setUp(self):
+        _delete_benchmark_rows()
+        self.addCleanup(_delete_benchmark_rows)
+        self.df = DataTransformer().transform(synthetic_customers(0, 500), source_file="async.csv")
+
+    def count_loaded(self, where: str = "TRUE") -> int:
+        conn = get_db_connection()
+        try:
+            with conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT count(*) FROM customer WHERE index >= %s AND {where}", (BENCHMARK_INDEX_OFFSET,)
+                )
+                return cursor.fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_concurrent_loads_and_upsert(self):
+        async def load():
+            loader = AsyncDataLoader(load_mode="copy", pool_size=4)
+            batches = [self.df.slice(offset, 50) for offset in range(0, self.df.height, 50)]
+            results = await asyncio.gather(*(loader.load_to_db(batch) for batch in batches))
+
+            upserter = AsyncDataLoader(load_mode="upsert", pool_size=1)
+            changed = self.df.head(10).with_columns(city=pl.lit("Async City"))
+            results.append(await upserter.load_to_db(changed))
+            await loader.aclose()
+            await upserter.aclose()
+            return results
+
+        self.assertTrue(all(asyncio.run(load())))
+        self.assertEqual(self.count_loaded(), self.df.height)
+        self.assertEqual(self.count_loaded("city = 'Async City'"), 10)
+
+    @mock.patch.dict(os.environ, {"PGTZ": "America/New_York"})
+    def test_both_loaders_write_the_same_ingested_at(self):
+        async def load():
+            loader = AsyncDataLoader(load_mode="copy", pool_size=1)
+            loaded = await loader.load_to_db(self.df.slice(5, 5))
+            await loader.aclose()
+            return loaded
+
+        # Sessions run in New York time; neither loader may shift the UTC instant the transform stamped
+        loader = DataLoader(load_mode="copy")
+        self.assertTrue(loader.load_to_db(self.df.head(5)))
+        loader.close()
+        self.assertTrue(asyncio.run(load()))
+
+        stamped = self.df["ingested_at"][0]
+        self.assertEqual(self.count_loaded(f"ingested_at = '{stamped.isoformat()}'"), 10)
+
+    def test_content_hash_is_computed_by_postgres(self):
+        customer = pl.DataFrame(
+            {
+                "index": [BENCHMARK_INDEX_OFFSET + 1],
+                "customer_id": ["PIN-1"],
+                "first_name": ["Ada"],
+                "last_name": ["Lovelace"],
+                "company": ["Acme"],
+                "city": ["London"],
+                "country": ["UK"],
+                "email": ["ada@example.com"],
+                "subscription_date": [date(2023, 12, 1)],
+                "source_file": ["a.csv"],
+                "ingested_at": [datetime.now(timezone.utc)],
+            }
+        )
+        # The business columns in record text form, NULL phones and website left empty
+        record = f"({BENCHMARK_INDEX_OFFSET + 1},PIN-1,Ada,Lovelace,Acme,London,UK,,,ada@example.com,2023-12-01,)"
+
+        async def load():
+            loader = AsyncDataLoader(load_mode="copy", pool_size=1)
+            upserter = AsyncDataLoader(load_mode="upsert", pool_size=1)
+            results = [
+                await loader.load_to_db(customer),
+                # Only the business columns are hashed, so a re-delivery in another file is left alone
+                await upserter.load_to_db(customer.with_columns(source_file=pl.lit("b.csv"))),
+            ]
+            await loader.aclose()
+            await upserter.aclose()
+            return results
+
+        self.assertEqual(asyncio.run(load()), [True, True])
+        conn = get_db_connection()
+        try:
+            with conn, conn.cursor() as cursor:
+                cursor.execute("SELECT content_hash, source_file FROM customer WHERE customer_id = 'PIN-1'")
+                stored = cursor.fetchone()
+        finally:
+            conn.close()
+        expected = int.from_bytes(hashlib.md5(record.encode()).digest()[:8], "big", signed=True)
+        self.assertEqual(stored, (expected, "a.csv"))
+        self.assertEqual(expected, 4363920042757498676)
+
+    def test_customer_id_taken_by_another_index_is_skipped(self):
+        first, taken = self.df.row(0, named=True), self.df.row(1, named=True)
+        redelivered = pl.concat(
+            [
+                # A new index reusing a stored customer_id, next to a customer that is genuinely new
+                self.df.head(1).with_columns(index=pl.col("index") + 10_000, city=pl.lit("Duplicate City")),
+                self.df.slice(10, 1),
+            ]
+        )
+        # And a changed version of the first customer that moved onto the second one's customer_id
+        moved = self.df.head(1).with_columns(customer_id=pl.lit(taken["customer_id"]), city=pl.lit("Moved City"))
+
+        async def load():
+            loader = AsyncDataLoader(load_mode="copy", pool_size=1)
+            upserter = AsyncDataLoader(load_mode="upsert", pool_size=1)
+            results = [
+                await loader.load_to_db(self.df.head(10)),
+                await loader.load_to_db(redelivered),
+                await upserter.load_to_db(moved),
+            ]
+            await loader.aclose()
+            await upserter.aclose()
+            return results
+
+        self.assertEqual(asyncio.run(load()), [True, True, True])
+        self.assertEqual(self.count_loaded(), 11)
+        self.assertEqual(self.count_loaded("city IN ('Duplicate City', 'Moved City')"), 0)
+        self.assertEqual(self.count_loaded(f"index = {first['index']} AND customer_id = '{first['customer_id']}'"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import polars as pl
+
+from etl.benchmark import (
+    BENCHMARK_INDEX_OFFSET,
+    CUSTOMER_SCHEMA,
+    find_regressions,
+    generate_file,
+    row_count,
+    run_benchmark,
+    synthetic_customers,
+)
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_synthetic_customers_match_sample_schema(self):
+        df = synthetic_customers(0, 300)
+
+        self.assertEqual(tuple(df.columns), CUSTOMER_SCHEMA)
+        self.assertEqual(df["Index"].min(), BENCHMARK_INDEX_OFFSET)
+        self.assertEqual(df.n_unique(), 297)
+        self.assertTrue(df.equals(synthetic_customers(0, 300)))
+
+    def test_generated_formats_hold_the_same_rows(self):
+        csv = generate_file(Path(self.tmp_dir.name, "c.csv"), 250, "csv")
+        json = generate_file(Path(self.tmp_dir.name, "c.json"), 250, "json")
+        ndjson = generate_file(Path(self.tmp_dir.name, "c.ndjson"), 250, "ndjson")
+
+        expected = pl.read_csv(csv)
+        self.assertEqual(expected.height, 250)
+        self.assertTrue(pl.read_json(json).equals(expected))
+        self.assertTrue(pl.read_ndjson(ndjson).equals(expected))
+
+    def test_report_and_regressions(self):
+        report = run_benchmark([500], ["csv"], ["transform", "parse"], ["copy"], self.tmp_dir.name)
+
+        results = report["results"]
+        self.assertEqual([result["stage"] for result in results], ["transform", "parse"])
+        self.assertTrue(all(result["ok"] and result["rows_per_sec"] > 0 for result in results))
+        self.assertTrue(all(result["peak_rss_mb"] >= result["baseline_rss_mb"] for result in results))
+
+        faster = {"results": [dict(result, rows_per_sec=result["rows_per_sec"] * 2) for result in results]}
+        self.assertEqual(find_regressions(report, report, tolerance=0.2), [])
+        self.assertEqual(len(find_regressions(report, faster, tolerance=0.2)), 2)
+
+    def test_row_count_suffixes(self):
+        self.assertEqual(
+            [row_count(value) for value in ("10000", "10k", "1M", "2.5m")], [10_000, 10_000, 10**6, 2_500_000]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from datetime import date, datetime
+from unittest import mock
+
+import polars as pl
+import psycopg2
+
+from etl.benchmark import BENCHMARK_INDEX_OFFSET, _delete_benchmark_rows, synthetic_customers
+from etl.dedup import DedupIndex
+from etl.load import DataLoader, get_db_connection
+from etl.partitions import archive_partition
+from etl.transform import DataTransformer
+
+
+class TestDedupIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "dedup.sqlite3")
+        self.index = DedupIndex(self.path)
+        self.addCleanup(self.index.close)
+
+    def test_repeated_keys_within_a_frame_keep_the_first_row(self):
+        df = pl.DataFrame({"index": [1, 2, 1, 3], "customer_id": ["A", "B", "C", "B"]})
+
+        result = self.index.filter_new(df)
+
+        self.assertEqual(result.rows(), [(1, "A"), (2, "B")])
+        self.assertEqual(self.index.metrics()["batch_duplicates"], 2)
+
+    def test_recorded_keys_survive_reopen(self):
+        self.index.record(pl.DataFrame({"index": [1, 2], "customer_id": ["A", "B"]}))
+        reopened = DedupIndex(self.path)
+        self.addCleanup(reopened.close)
+
+        result = reopened.filter_new(pl.DataFrame({"index": [2, 3, 4], "customer_id": ["X", "A", "D"]}))
+
+        self.assertEqual(result.rows(), [(4, "D")])
+        self.assertEqual(
+            reopened.metrics(),
+            {"checked": 3, "batch_duplicates": 0, "seen_before": 2, "released": 0, "hit_rate": 0.6667},
+        )
+
+    def test_keys_released_by_postgres_are_forgotten(self):
+        self.index.record(pl.DataFrame({"index": [1, 2, 3], "customer_id": ["A", "B", "C"]}))
+        # customer_key lost index 1 and 2 (an archived partition), but customer_id "B" went to another index since
+        held = {"index": {3}, "customer_id": {"B", "C"}}
+        loaded_keys = mock.Mock(side_effect=lambda column, values: held[column] & set(values))
+
+        result = self.index.filter_new(pl.DataFrame({"index": [1, 2, 3], "customer_id": ["A", "B", "C"]}), loaded_keys)
+
+        self.assertEqual(result.rows(), [(1, "A")])
+        self.assertEqual(self.index.metrics()["released"], 1)
+        loaded_keys.assert_any_call("index", [1, 2, 3])
+        # Forgotten locally, so the next frame is not sent for confirmation again
+        self.assertEqual(self.index.filter_new(pl.DataFrame({"index": [1], "customer_id": ["A"]})).height, 1)
+
+    def test_frame_without_key_columns_passes_through(self):
+        df = pl.DataFrame({"email": ["a@example.com"]})
+
+        self.assertIs(self.index.filter_new(df), df)
+
+    def test_loader_records_only_loaded_rows(self):
+        loader = DataLoader(dedup_index=self.index)
+        mock.patch.object(loader, "_loaded_keys", side_effect=lambda column, values: set(values)).start()
+        self.addCleanup(mock.patch.stopall)
+        df = pl.DataFrame({"index": [1, 2], "customer_id": ["A", "B"]})
+
+        with mock.patch.object(loader, "_insert_to_db", return_value=False):
+            self.assertFalse(loader.load_to_db(df))
+        with mock.patch.object(loader, "_insert_to_db", return_value=True) as insert_to_db:
+            self.assertTrue(loader.load_to_db(df))
+            self.assertTrue(loader.load_to_db(df))
+
+        insert_to_db.assert_called_once()
+
+
+class TestDedupIndexAgainstPostgres(unittest.TestCase):
+    """Archives a partition of the local PostgreSQL the ETL is configured for; skipped without one"""
+
+    MONTH = date(2031, 1, 1)
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            conn = get_db_connection()
+        except psycopg2.Error as e:
+            raise unittest.SkipTest(f"PostgreSQL is not reachable: {e}")
+        try:
+            with conn, conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass('customer_key')")
+                migrated = cursor.fetchone()[0] is not None
+        finally:
+            conn.close()
+        if not migrated:
+            raise unittest.SkipTest("The database is not migrated")
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.index = DedupIndex(os.path.join(tmp_dir.name, "dedup.sqlite3"))
+        self.addCleanup(self.index.close)
+        self.loader = DataLoader(load_mode="copy", dedup_index=self.index)
+        self.addCleanup(self.loader.close)
+        self.conn = get_db_connection()
+        self.addCleanup(self.conn.close)
+        # The reloaded rows leave the rollup through _delete_benchmark_rows before their partition is dropped
+        self.addCleanup(self.execute, "DROP TABLE IF EXISTS customer_2031_01_archived, customer_2031_01")
+        _delete_benchmark_rows()
+        self.addCleanup(_delete_benchmark_rows)
+
+    def execute(self, sql: str):
+        with self.conn, self.conn.cursor() as cursor:
+            cursor.execute(sql, (BENCHMARK_INDEX_OFFSET,))
+            return cursor.fetchone() if cursor.description else None
+
+    def test_archived_customers_can_be_ingested_again(self):
+        df = DataTransformer().transform(
+            synthetic_customers(0, 20), source_file="archive.csv", ingested_at=datetime(2031, 1, 15)
+        )
+        self.assertTrue(self.loader.load_to_db(df))
+
+        self.assertEqual(archive_partition(self.conn, self.MONTH), 20)
+        self.assertTrue(self.loader.load_to_db(df))
+
+        self.assertEqual(self.execute("SELECT count(*) FROM customer WHERE index >= %s"), (20,))
+        self.assertEqual(self.index.metrics()["released"], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
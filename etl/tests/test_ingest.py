@@ -0,0 +1,304 @@
+import bz2
+import gzip
+import json
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import polars as pl
+import zstandard
+from paramiko import SFTPAttributes
+from structlog.testing import capture_logs
+
+from etl.ingest import DataIngestor, IngestionPipeline, StagedIngestionPipeline
+from etl.manifest import FileManifest
+from etl.metrics import RunMetrics
+
+SFTP_CONFIG = {"host": "localhost", "port": 22, "username": "user", "password": "secret", "remote_folder": "."}
+
+
+def remote_attr(filename: str, size: int, mtime: int) -> SFTPAttributes:
+    attr = SFTPAttributes()
+    attr.filename, attr.st_size, attr.st_mtime = filename, size, mtime
+    return attr
+
+
+class TestDataIngestor(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.records = [
+            {"index": str(i), "customer": {"id": f"C{i % 4}", "contact": {"email": f"c{i % 4}@example.com"}}}
+            for i in range(10)
+        ]
+
+    def ingest(self, file_name: str, content: str | bytes, **ingestor_config) -> pl.DataFrame:
+        file_path = Path(self.tmp_dir.name, file_name)
+        file_path.write_bytes(content if isinstance(content, bytes) else content.encode())
+        ingestor = DataIngestor(download_dir=self.tmp_dir.name, transformed_dir=self.tmp_dir.name, **ingestor_config)
+        ingestor.loader = mock.Mock()
+        ingestor.loader.load_to_db.return_value = True
+
+        self.assertTrue(ingestor.process_file(file_path))
+        return pl.concat([call.args[0] for call in ingestor.loader.load_to_db.call_args_list])
+
+    def test_json_and_ndjson_are_flattened_alike(self):
+        ndjson = "\n".join(json.dumps(record) for record in self.records)
+
+        from_json = self.ingest("customers.json", json.dumps(self.records))
+        from_ndjson = self.ingest("customers.ndjson", ndjson)
+        from_chunks = self.ingest("customers.jsonl", ndjson, chunk_size=3)
+
+        for df in (from_json, from_ndjson, from_chunks):
+            self.assertEqual(df.height, 10)
+            self.assertIn("customer_contact_email", df.columns)
+            self.assertEqual(sorted(df["index"].to_list()), list(range(10)))
+
+    def test_compressed_files_are_parsed_like_plain_ones(self):
+        ndjson = "\n".join(json.dumps(record) for record in self.records).encode()
+        # The quoted address spans two lines, across where a 3-line batch would otherwise end
+        rows = [f'{i},C{i},2023-12-01,"{i} Main St"' for i in range(10)]
+        rows[2] = '2,C2,2023-12-01,"2 Main St\nFloor 3"'
+        csv = ("Index,Customer Id,Subscription Date,Address\n" + "\n".join(rows) + "\n").encode()
+
+        for chunk_size in (0, 3):
+            from_gzip = self.ingest("customers.json.gz", gzip.compress(json.dumps(self.records).encode()))
+            from_zstd = self.ingest("customers.ndjson.zst", zstandard.compress(ndjson), chunk_size=chunk_size)
+            from_bz2 = self.ingest("customers.csv.bz2", bz2.compress(csv), chunk_size=chunk_size)
+
+            for df in (from_gzip, from_zstd):
+                self.assertEqual(sorted(df["index"].to_list()), list(range(10)))
+                self.assertIn("customer_contact_email", df.columns)
+            self.assertEqual(sorted(from_bz2["index"].to_list()), list(range(10)))
+            self.assertEqual(from_bz2.filter(pl.col("index") == 2)["address"][0], "2 Main St\nFloor 3")
+            self.assertEqual(from_bz2["source_file"][0], "customers.csv.bz2")
+
+        self.assertTrue(Path(self.tmp_dir.name, "customers.csv.bz2_transformed.csv").exists())
+        self.assertTrue(Path(self.tmp_dir.name, "customers.ndjson.zst_transformed.ndjson").exists())
+
+    def test_compressed_delivery_keeps_its_own_output(self):
+        plain_csv = "Index,Customer Id\n" + "".join(f"{i},C{i}\n" for i in range(5))
+        compressed_csv = "Index,Customer Id\n" + "".join(f"{i},Z{i}\n" for i in range(5))
+
+        self.ingest("customers.csv", plain_csv)
+        self.ingest("customers.csv.gz", gzip.compress(compressed_csv.encode()))
+
+        plain = pl.read_csv(Path(self.tmp_dir.name, "customers.csv_transformed.csv"))
+        compressed = pl.read_csv(Path(self.tmp_dir.name, "customers.csv.gz_transformed.csv"))
+        self.assertEqual(sorted(plain["customer_id"].to_list()), [f"C{i}" for i in range(5)])
+        self.assertEqual(sorted(compressed["customer_id"].to_list()), [f"Z{i}" for i in range(5)])
+
+    def test_json_source_is_written_as_ndjson(self):
+        self.ingest("customers.json", json.dumps(self.records))
+
+        output = Path(self.tmp_dir.name, "customers.json_transformed.ndjson")
+        self.assertEqual(pl.read_ndjson(output).height, 10)
+        self.assertFalse(Path(self.tmp_dir.name, "customers.json_transformed.json").exists())
+
+    def test_columnar_output_formats(self):
+        ndjson = "\n".join(json.dumps(record) for record in self.records)
+
+        self.ingest("whole.ndjson", ndjson, output_format="parquet", parquet_row_group_size=4)
+        self.ingest("chunked.ndjson", ndjson, output_format="ipc", chunk_size=4)
+
+        whole = Path(self.tmp_dir.name, "whole.ndjson_transformed.parquet")
+        self.assertEqual(pl.read_parquet(whole).height, 10)
+        parts = sorted(Path(self.tmp_dir.name, "chunked.ndjson_transformed").iterdir())
+        self.assertEqual([part.name for part in parts], ["part-00000.arrow", "part-00001.arrow", "part-00002.arrow"])
+        self.assertEqual(pl.scan_ipc(parts).collect().height, 10)
+
+    def test_sources_sharing_a_stem_keep_their_own_output(self):
+        ndjson = "\n".join(json.dumps(record) for record in self.records)
+        csv = "Index,Customer Id\n" + "".join(f"{i},C{i}\n" for i in range(20, 25))
+
+        self.ingest("customers.ndjson", ndjson, output_format="parquet")
+        self.ingest("customers.csv", csv, output_format="parquet")
+
+        from_ndjson = pl.read_parquet(Path(self.tmp_dir.name, "customers.ndjson_transformed.parquet"))
+        from_csv = pl.read_parquet(Path(self.tmp_dir.name, "customers.csv_transformed.parquet"))
+        self.assertEqual(sorted(from_ndjson["index"].to_list()), list(range(10)))
+        self.assertEqual(sorted(from_csv["index"].to_list()), list(range(20, 25)))
+
+    def test_file_workers_keep_order_and_isolate_failures(self):
+        # Every row has a null, so the good files load nothing and never reach the database
+        Path(self.tmp_dir.name, "a.csv").write_text("Index,Customer Id\n1,\n")
+        Path(self.tmp_dir.name, "b.json").write_text("{not json")
+        Path(self.tmp_dir.name, "c.ndjson").write_text('{"index": "2", "customer_id": null}\n')
+        Path(self.tmp_dir.name, "d.txt").write_text("ignored")
+        # A download still in progress is not picked up
+        Path(self.tmp_dir.name, "e.csv.part").write_text("Index,Customer Id\n3,")
+        Path(self.tmp_dir.name, "e.csv.part.progress").write_text(
+            '{"size": 64, "mtime": 1700000000, "ranges": [[0, 20, 64]]}'
+        )
+        ingestor = DataIngestor(download_dir=self.tmp_dir.name, transformed_dir=self.tmp_dir.name, file_workers=2)
+
+        results = ingestor.process_downloaded_files()
+
+        self.assertEqual([path.name for path in results], ["a.csv", "b.json", "c.ndjson", "d.txt"])
+        self.assertEqual(list(results.values()), [True, False, True, False])
+
+    def test_metrics_are_collected_from_file_workers(self):
+        for name in ("a", "b"):
+            Path(self.tmp_dir.name, f"{name}.csv").write_text("Index,Customer Id\n1,\n")
+        metrics = RunMetrics()
+        ingestor = DataIngestor(
+            download_dir=self.tmp_dir.name, transformed_dir=self.tmp_dir.name, file_workers=2, metrics=metrics
+        )
+
+        ingestor.process_downloaded_files()
+
+        stages = metrics.summary()["stages"]
+        self.assertEqual(stages["parse"]["calls"], 2)
+        self.assertEqual(stages["parse"]["bytes"], 2 * len("Index,Customer Id\n1,\n"))
+        self.assertEqual(stages["transform"]["calls"], 2)
+
+    def test_file_workers_close_their_loader(self):
+        for name in ("a", "b"):
+            Path(self.tmp_dir.name, f"{name}.csv").write_text("Index,Customer Id\n1,\n")
+        ingestor = DataIngestor(download_dir=self.tmp_dir.name, transformed_dir=self.tmp_dir.name, file_workers=2)
+        # Only the workers open a dedup index, kept out of the download directory
+        dedup_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dedup_dir.cleanup)
+        ingestor.worker_config.update(dedup=True, dedup_path=os.path.join(dedup_dir.name, "dedup.sqlite3"))
+
+        # Spawned workers log to the stdout they inherit, so point file descriptor 1 at a file while they run
+        with tempfile.TemporaryFile() as output:
+            stdout = os.dup(1)
+            os.dup2(output.fileno(), 1)
+            try:
+                ingestor.process_downloaded_files()
+            finally:
+                os.dup2(stdout, 1)
+                os.close(stdout)
+            output.seek(0)
+            logged = output.read().decode()
+
+        self.assertIn("db_pool_metrics", logged)
+        self.assertIn("dedup_index_metrics", logged)
+
+    def test_unknown_output_format_rejected(self):
+        with self.assertRaises(ValueError):
+            DataIngestor(output_format="xlsx")
+
+
+class TestIncrementalIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.manifest = FileManifest(os.path.join(self.tmp_dir.name, "manifest.sqlite3"))
+        self.addCleanup(self.manifest.close)
+
+        self.pipeline = IngestionPipeline(
+            SFTP_CONFIG, ingestor_config={"download_dir": self.tmp_dir.name}, manifest=self.manifest
+        )
+        self.sftp_manager = self.pipeline.sftp_manager = mock.Mock(wraps=self.pipeline.sftp_manager)
+        self.sftp_manager.connect = mock.Mock()
+        self.sftp_manager.disconnect = mock.Mock()
+        self.sftp_manager.download_files = mock.Mock(side_effect=self._download)
+        self.data_ingestor = self.pipeline.data_ingestor = mock.Mock(download_dir=self.tmp_dir.name)
+        self.data_ingestor.process_file.return_value = True
+        self.contents = {"a.csv": b"index\n1\n", "b.csv": b"index\n2\n"}
+
+    def _download(self, remote_files, local_dir):
+        for name in remote_files:
+            Path(local_dir, name).write_bytes(self.contents[name])
+        return [os.path.join(local_dir, name) for name in remote_files]
+
+    def processed_files(self):
+        return [call.args[0].name for call in self.data_ingestor.process_file.call_args_list]
+
+    def test_only_new_or_changed_files_are_fetched(self):
+        self.sftp_manager.list_file_attrs = mock.Mock(
+            return_value=[remote_attr("a.csv", 8, 1), remote_attr("b.csv", 8, 1)]
+        )
+        self.pipeline.run()
+        self.assertEqual(self.processed_files(), ["a.csv", "b.csv"])
+
+        self.sftp_manager.list_file_attrs.return_value = [remote_attr("a.csv", 8, 1), remote_attr("b.csv", 8, 2)]
+        self.contents["b.csv"] = b"index\n3\n"
+        self.pipeline.run()
+
+        self.assertEqual(self.sftp_manager.download_files.call_args.args[0], ["b.csv"])
+        self.assertEqual(self.processed_files(), ["a.csv", "b.csv", "b.csv"])
+
+    def test_touched_file_with_same_content_is_not_reprocessed(self):
+        self.sftp_manager.list_file_attrs = mock.Mock(return_value=[remote_attr("a.csv", 8, 1)])
+        self.pipeline.run()
+
+        self.sftp_manager.list_file_attrs.return_value = [remote_attr("a.csv", 8, 5)]
+        self.pipeline.run()
+
+        self.assertEqual(self.processed_files(), ["a.csv"])
+        self.assertTrue(self.manifest.is_unchanged("./a.csv", 8, 5))
+
+    def test_failed_file_is_retried_next_run(self):
+        self.sftp_manager.list_file_attrs = mock.Mock(return_value=[remote_attr("a.csv", 8, 1)])
+        self.data_ingestor.process_file.return_value = False
+        self.pipeline.run()
+
+        self.assertFalse(self.manifest.is_unchanged("./a.csv", 8, 1))
+
+
+class TestStagedIngestionPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.download_dir = os.path.join(self.tmp_dir.name, "downloads")
+        os.makedirs(self.download_dir)
+
+        self.pipeline = StagedIngestionPipeline(
+            SFTP_CONFIG,
+            ingestor_config={"download_dir": self.download_dir, "transformed_dir": self.tmp_dir.name, "chunk_size": 2},
+            transform_workers=2,
+            load_workers=2,
+            queue_size=1,
+        )
+        self.sftp_manager = self.pipeline.sftp_manager = mock.Mock()
+        self.sftp_manager.list_files.return_value = ["a.csv", "b.csv", "c.csv"]
+        self.sftp_manager.download_to_dir.side_effect = self._download
+        self.loader = self.pipeline.data_ingestor.loader = mock.Mock()
+        self.loader.load_to_db.return_value = True
+
+    def _download(self, remote_file, local_dir):
+        rows = "\n".join(f"{i},{remote_file}-{i},2023-12-01" for i in range(5))
+        Path(local_dir, remote_file).write_text(f"Index,Customer Id,Subscription Date\n{rows}\n")
+        return os.path.join(local_dir, remote_file)
+
+    def test_every_chunk_reaches_the_load_stage(self):
+        with capture_logs() as logs:
+            self.pipeline.run()
+
+        loaded = [call.args[0] for call in self.loader.load_to_db.call_args_list]
+        self.assertEqual(sum(df.height for df in loaded), 15)
+        self.assertEqual({df["source_file"][0] for df in loaded}, {"a.csv", "b.csv", "c.csv"})
+        self.sftp_manager.disconnect.assert_called_once()
+
+        metrics = next(log for log in logs if log["event"] == "stage_metrics")
+        self.assertEqual([stage["processed"] for stage in metrics["stages"]], [3, 3, len(loaded)])
+        self.assertEqual(metrics["queues"][1]["items"], len(loaded))
+        self.assertLessEqual(metrics["queues"][1]["max_depth"], 1)
+
+    @mock.patch("etl.ingest.DataIngestor", side_effect=RuntimeError("transformed_dir is read-only"))
+    def test_stage_that_cannot_start_fails_its_items_without_hanging(self, data_ingestor):
+        self.pipeline.alert_handler = mock.Mock()
+        self.pipeline.manifest = mock.Mock()
+        self.pipeline._list_changed_files = mock.Mock(return_value={name: None for name in ("a.csv", "b.csv", "c.csv")})
+        # More files than the transform queue holds, so the downloads block unless the broken stage keeps draining it
+        run = threading.Thread(target=self.pipeline.run, daemon=True)
+
+        run.start()
+        run.join(timeout=10)
+
+        self.assertFalse(run.is_alive())
+        self.pipeline.alert_handler.alert.assert_any_call(
+            "pipeline_stage_failed", stage="transform", error="transformed_dir is read-only"
+        )
+        self.loader.load_to_db.assert_not_called()
+        self.pipeline.manifest.record.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
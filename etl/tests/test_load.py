@@ -0,0 +1,247 @@
+import unittest
+from datetime import date, datetime, timezone
+from unittest import mock
+
+import polars as pl
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from etl.load import (
+    BUMP_GENERATION_SQL,
+    CUSTOMER_COLUMNS,
+    STAGING_TABLE_SQL,
+    ConnectionPool,
+    DataLoader,
+    FrameCSVStream,
+    content_hash_sql,
+    ensure_partitions,
+)
+
+
+class TestDataLoader(unittest.TestCase):
+    def setUp(self):
+        self.df = pl.DataFrame(
+            {
+                "index": [1, 2],
+                "customer_id": ["ABC123", "XYZ456"],
+                "first_name": ["Alice", "Bob"],
+                "last_name": ["Smith", "Jones"],
+                "company": ["Acme, Inc", "Beta"],
+                "city": ["Berlin", "Munich"],
+                "country": ["Germany", "Germany"],
+                "email": ["alice@example.com", "bob@example.com"],
+                "subscription_date": [datetime(2023, 12, 1), datetime(2023, 12, 2)],
+                "ingested_at": ["2025-03-21T10:00:00", "2025-03-21T10:00:00"],
+            }
+        )
+
+    def test_prepare_frame_fills_optional_columns(self):
+        prepared = DataLoader._prepare_frame(self.df)
+
+        self.assertEqual(tuple(prepared.columns), CUSTOMER_COLUMNS)
+        self.assertEqual(prepared["phone_1"].to_list(), [None, None])
+        self.assertEqual(prepared["source_file"].to_list(), ["unknown.csv", "unknown.csv"])
+        self.assertEqual(prepared["subscription_date"].dtype, pl.Date)
+
+    def test_prepare_frame_writes_ingested_at_as_utc(self):
+        expected = [datetime(2025, 3, 21, 10, 0, tzinfo=timezone.utc)] * 2
+        naive = self.df.with_columns(pl.col("ingested_at").str.to_datetime())
+        berlin = naive.with_columns(
+            pl.col("ingested_at").dt.replace_time_zone("UTC").dt.convert_time_zone("Europe/Berlin")
+        )
+
+        for df in (self.df, naive, berlin):
+            prepared = DataLoader._prepare_frame(df)
+            self.assertEqual(prepared.schema["ingested_at"], pl.Datetime("us", "UTC"))
+            self.assertEqual(prepared["ingested_at"].to_list(), expected)
+
+    def test_frame_csv_stream_reads_in_slices(self):
+        stream = FrameCSVStream(DataLoader._prepare_frame(self.df), batch_size=1)
+
+        data = b""
+        while chunk := stream.read(16):
+            data += chunk
+
+        lines = data.decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('1,ABC123,Alice,Smith,"Acme, Inc",Berlin'))
+
+    @mock.patch("etl.load.ensure_partitions")
+    @mock.patch("etl.load.get_db_connection")
+    def test_copy_mode_stages_and_merges(self, get_db_connection, ensure_partitions):
+        cursor = get_db_connection.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (2,)
+
+        DataLoader(load_mode="copy").load_to_db(self.df)
+
+        copy_sql, stream = cursor.copy_expert.call_args.args
+        self.assertIn("COPY customer_staging", copy_sql)
+        self.assertIsInstance(stream, FrameCSVStream)
+        merge_sql, bump_sql = [call.args[0] for call in cursor.execute.call_args_list[1:]]
+        self.assertIn("INSERT INTO customer_key (index, customer_id)", merge_sql)
+        self.assertIn("ON CONFLICT DO NOTHING", merge_sql)
+        self.assertIn("FROM staged JOIN keys USING (index)", merge_sql)
+        self.assertIn("INSERT INTO customer_rollup", merge_sql)
+        self.assertEqual(bump_sql, BUMP_GENERATION_SQL)
+        get_db_connection.return_value.commit.assert_called_once()
+        ensure_partitions.assert_called_once_with(get_db_connection.return_value, {date(2025, 3, 1)})
+
+    @mock.patch("etl.load.ensure_partitions")
+    @mock.patch("etl.load.get_db_connection")
+    def test_copy_mode_keeps_generation_when_nothing_written(self, get_db_connection, ensure_partitions):
+        cursor = get_db_connection.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (0,)
+
+        self.assertTrue(DataLoader(load_mode="copy").load_to_db(self.df))
+
+        executed = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertNotIn(BUMP_GENERATION_SQL, executed)
+
+    @mock.patch("etl.load.ensure_partitions")
+    @mock.patch("etl.load.get_db_connection")
+    def test_insert_mode_sends_typed_rows(self, get_db_connection, ensure_partitions):
+        cursor = get_db_connection.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (2,)
+
+        self.assertTrue(DataLoader(load_mode="insert").load_to_db(self.df))
+
+        insert_sql, rows = cursor.executemany.call_args.args
+        self.assertIn("INSERT INTO customer_staging", insert_sql)
+        rows = list(rows)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][:2], (1, "ABC123"))
+        self.assertEqual(rows[0][10], date(2023, 12, 1))
+        self.assertEqual(rows[0][13], datetime(2025, 3, 21, 10, 0, tzinfo=timezone.utc))
+        staging_sql, merge_sql, bump_sql = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertEqual(staging_sql, STAGING_TABLE_SQL)
+        self.assertIn("INSERT INTO customer_rollup", merge_sql)
+        self.assertEqual(bump_sql, BUMP_GENERATION_SQL)
+
+    @mock.patch("etl.load.ensure_partitions")
+    @mock.patch("etl.load.get_db_connection")
+    def test_upsert_mode_updates_changed_rows_only(self, get_db_connection, ensure_partitions):
+        cursor = get_db_connection.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (1,)
+
+        self.assertTrue(DataLoader(load_mode="upsert").load_to_db(self.df))
+
+        replace_sql, merge_sql = [call.args[0] for call in cursor.execute.call_args_list[1:3]]
+        # Changed versions are deleted, released from customer_key and taken back out of the rollup first
+        self.assertIn(f"customer.content_hash IS DISTINCT FROM {content_hash_sql('staged')}", replace_sql)
+        self.assertIn("DELETE FROM customer_key USING replaced", replace_sql)
+        self.assertIn("-1 AS customers FROM replaced", replace_sql)
+        # so the merge writes the last staged version of each index again
+        self.assertIn("ORDER BY index, ctid DESC", merge_sql)
+        self.assertIn("INSERT INTO customer_key (index, customer_id)", merge_sql)
+
+    @mock.patch("etl.load.ensure_partitions")
+    @mock.patch("etl.load.get_db_connection")
+    def test_partitions_are_ensured_once_per_month(self, get_db_connection, ensure_partitions):
+        get_db_connection.return_value.cursor.return_value.__enter__.return_value.fetchone.return_value = (2,)
+        loader = DataLoader(load_mode="copy")
+
+        loader.load_to_db(self.df)
+        loader.load_to_db(self.df.with_columns(ingested_at=pl.lit("2025-04-02T00:00:00")))
+        loader.load_to_db(self.df)
+
+        self.assertEqual(
+            [call.args[1] for call in ensure_partitions.call_args_list], [{date(2025, 3, 1)}, {date(2025, 4, 1)}]
+        )
+
+    @mock.patch("etl.load.ensure_partitions", side_effect=RuntimeError("permission denied"))
+    @mock.patch("etl.load.get_db_connection")
+    def test_load_continues_when_partitions_cannot_be_created(self, get_db_connection, ensure_partitions):
+        get_db_connection.return_value.cursor.return_value.__enter__.return_value.fetchone.return_value = (2,)
+        loader = DataLoader(load_mode="copy")
+
+        # The rows go to customer_default and the next load tries again
+        self.assertTrue(loader.load_to_db(self.df))
+        self.assertTrue(loader.load_to_db(self.df))
+        self.assertEqual(ensure_partitions.call_count, 2)
+
+    def test_ensure_partitions_skips_existing_and_moves_default_rows(self):
+        conn = mock.MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchone.side_effect = [(1,), None]
+        cursor.rowcount = 5
+
+        created = ensure_partitions(conn, [date(2025, 4, 17), date(2025, 3, 2), date(2025, 4, 1)])
+
+        self.assertEqual(created, [date(2025, 4, 1)])
+        executed = [call.args for call in cursor.execute.call_args_list]
+        self.assertIn("DELETE FROM customer_default", executed[5][0])
+        self.assertEqual(executed[5][1], ("2025-04-01 00:00+00", "2025-05-01 00:00+00"))
+        self.assertEqual(
+            executed[6],
+            (
+                "CREATE TABLE customer_2025_04 PARTITION OF customer FOR VALUES FROM (%s) TO (%s)",
+                ("2025-04-01 00:00+00", "2025-05-01 00:00+00"),
+            ),
+        )
+        self.assertIn("INSERT INTO customer (index", executed[7][0])
+
+    def test_upsert_mode_rejects_dedup_index(self):
+        with self.assertRaises(ValueError):
+            DataLoader(load_mode="upsert", dedup_index=mock.Mock())
+
+    def test_unknown_load_mode_rejected(self):
+        with self.assertRaises(ValueError):
+            DataLoader(load_mode="bulk")
+
+
+@mock.patch("etl.load.get_db_connection")
+class TestConnectionPool(unittest.TestCase):
+    @staticmethod
+    def make_connection():
+        conn = mock.MagicMock(closed=0)
+        conn.get_transaction_status.return_value = TRANSACTION_STATUS_IDLE
+        return conn
+
+    def test_connection_is_reused(self, get_db_connection):
+        get_db_connection.side_effect = self.make_connection
+        pool = ConnectionPool(size=2)
+
+        for _ in range(3):
+            with pool.connection() as conn:
+                conn.commit()
+
+        self.assertEqual(get_db_connection.call_count, 1)
+        self.assertEqual(pool.metrics()["reused"], 2)
+        self.assertEqual(pool.metrics()["reuse_ratio"], 0.667)
+
+    def test_broken_connection_is_replaced(self, get_db_connection):
+        get_db_connection.side_effect = self.make_connection
+        pool = ConnectionPool(size=1)
+
+        with pool.connection() as first:
+            first.closed = 2
+        with pool.connection() as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.metrics()["discarded"], 1)
+        self.assertEqual(pool.metrics()["opened"], 2)
+
+    def test_failed_block_rolls_back_and_returns_connection(self, get_db_connection):
+        get_db_connection.side_effect = self.make_connection
+        pool = ConnectionPool(size=1)
+
+        with self.assertRaises(RuntimeError):
+            with pool.connection() as conn:
+                raise RuntimeError("boom")
+
+        conn.rollback.assert_called_once()
+        with pool.connection() as again:
+            self.assertIs(again, conn)
+
+    def test_pool_is_bounded(self, get_db_connection):
+        get_db_connection.side_effect = self.make_connection
+        pool = ConnectionPool(size=1, timeout=0.01)
+
+        with pool.connection():
+            with self.assertRaises(TimeoutError):
+                with pool.connection():
+                    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
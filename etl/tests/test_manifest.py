@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from etl.manifest import FileManifest, file_sha256
+
+
+class TestFileManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "manifest.sqlite3")
+        self.manifest = FileManifest(self.path)
+        self.addCleanup(self.manifest.close)
+
+    def test_unknown_file_is_changed(self):
+        self.assertFalse(self.manifest.is_unchanged("./customers.csv", 100, 1700000000))
+        self.assertFalse(self.manifest.has_content("./customers.csv", "abc"))
+
+    def test_recorded_file_survives_reopen(self):
+        self.manifest.record("./customers.csv", 100, 1700000000, "abc")
+        reopened = FileManifest(self.path)
+        self.addCleanup(reopened.close)
+
+        self.assertTrue(reopened.is_unchanged("./customers.csv", 100, 1700000000))
+        self.assertFalse(reopened.is_unchanged("./customers.csv", 120, 1700000000))
+        self.assertFalse(reopened.is_unchanged("./customers.csv", 100, 1700000500))
+        self.assertTrue(reopened.has_content("./customers.csv", "abc"))
+
+    def test_record_replaces_previous_version(self):
+        self.manifest.record("./customers.csv", 100, 1700000000, "abc")
+        self.manifest.record("./customers.csv", 120, 1700000500, "def")
+
+        self.assertTrue(self.manifest.is_unchanged("./customers.csv", 120, 1700000500))
+        self.assertFalse(self.manifest.has_content("./customers.csv", "abc"))
+
+    def test_file_sha256(self):
+        file_path = os.path.join(self.tmp_dir.name, "data.csv")
+        with open(file_path, "wb") as f:
+            f.write(b"index,name\n1,Alice\n")
+
+        self.assertEqual(file_sha256(file_path, block_size=4), file_sha256(file_path))
+        self.assertEqual(len(file_sha256(file_path)), 64)
+
+
+if __name__ == "__main__":
+    unittest.main()
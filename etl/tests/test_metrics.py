@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+
+from etl.metrics import NULL_METRICS, RunMetrics
+
+
+class TestRunMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = RunMetrics()
+
+    def test_timer_records_stage_and_file_totals(self):
+        for file in ("a.csv", "b.csv", "a.csv"):
+            with self.metrics.timer("load", file) as record:
+                record["rows"] = 10
+        with self.assertRaises(ValueError):
+            with self.metrics.timer("load", "b.csv"):
+                raise ValueError("boom")
+
+        summary = self.metrics.summary()
+        load = summary["stages"]["load"]
+        self.assertEqual((load["calls"], load["rows"], load["errors"]), (4, 30, 1))
+        self.assertGreater(load["rss_bytes_max"], 0)
+        files = {entry["file"]: entry for entry in summary["files"]}
+        self.assertEqual((files["a.csv"]["calls"], files["a.csv"]["rows"]), (2, 20))
+        self.assertEqual(files["b.csv"]["errors"], 1)
+
+    def test_merge_adds_worker_summaries(self):
+        worker = RunMetrics()
+        worker.add("parse", "a.csv", calls=1, bytes=100, rss_bytes_max=5)
+        self.metrics.add("parse", "b.csv", calls=1, bytes=50, rss_bytes_max=9)
+
+        self.metrics.merge(worker.summary())
+
+        parse = self.metrics.summary()["stages"]["parse"]
+        self.assertEqual((parse["calls"], parse["bytes"], parse["rss_bytes_max"]), (2, 150, 9))
+        self.assertEqual(len(self.metrics.summary()["files"]), 2)
+
+    def test_prometheus_export_and_json_summary(self):
+        self.metrics.add("download", 'odd "name".csv', calls=1, bytes=2048, retries=2)
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        json_path, prom_path = self.metrics.write(tmp_dir.name)
+
+        with open(prom_path) as f:
+            exposition = f.read()
+        self.assertIn('etl_stage_bytes{stage="download"} 2048\n', exposition)
+        self.assertIn('etl_file_retries{stage="download",file="odd \\"name\\".csv"} 2\n', exposition)
+        self.assertIn("# TYPE etl_stage_duration_seconds gauge\n", exposition)
+        with open(json_path) as f:
+            self.assertEqual(json.load(f)["stages"]["download"]["retries"], 2)
+        self.assertEqual(sorted(os.listdir(tmp_dir.name)), ["run_metrics.json", "run_metrics.prom"])
+
+    def test_disabled_metrics_do_nothing(self):
+        with NULL_METRICS.timer("load", "a.csv") as record:
+            record["rows"] = 10
+        NULL_METRICS.add("load", rows=1)
+
+        self.assertEqual(NULL_METRICS.summary(), {})
+        self.assertIsNone(NULL_METRICS.write())
+
+
+if __name__ == "__main__":
+    unittest.main()
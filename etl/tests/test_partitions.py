@@ -0,0 +1,40 @@
+import unittest
+from datetime import date
+from unittest import mock
+
+from etl.partitions import BUMP_GENERATION_SQL, archive_partition, ensure_partitions_ahead
+
+
+class TestPartitions(unittest.TestCase):
+    def setUp(self):
+        self.conn = mock.MagicMock()
+        self.cursor = self.conn.cursor.return_value.__enter__.return_value
+
+    @mock.patch("etl.partitions.ensure_partitions")
+    @mock.patch("etl.partitions.datetime")
+    def test_ensure_ahead_covers_current_and_following_months(self, datetime_module, ensure_partitions):
+        datetime_module.datetime.now.return_value.date.return_value = date(2025, 11, 30)
+
+        ensure_partitions_ahead(self.conn, months_ahead=2)
+
+        ensure_partitions.assert_called_once_with(self.conn, [date(2025, 11, 1), date(2025, 12, 1), date(2026, 1, 1)])
+
+    def test_archive_detaches_and_unwinds_derived_tables(self):
+        self.cursor.fetchone.return_value = (1,)
+        self.cursor.rowcount = 3
+
+        self.assertEqual(archive_partition(self.conn, date(2024, 1, 15)), 3)
+
+        executed = [call.args[0] for call in self.cursor.execute.call_args_list]
+        self.assertEqual(executed[2], "ALTER TABLE customer DETACH PARTITION customer_2024_01")
+        self.assertEqual(executed[3], "ALTER TABLE customer_2024_01 RENAME TO customer_2024_01_archived")
+        self.assertIn("-1 AS customers FROM customer_2024_01_archived", executed[4])
+        self.assertIn("DELETE FROM customer_key USING customer_2024_01_archived", executed[4])
+        self.assertEqual(executed[5], BUMP_GENERATION_SQL)
+
+    def test_archive_rejects_missing_partition(self):
+        self.cursor.fetchone.return_value = None
+
+        with self.assertRaises(ValueError):
+            archive_partition(self.conn, date(2024, 1, 1))
+        self.assertEqual(self.cursor.execute.call_count, 2)
@@ -0,0 +1,226 @@
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import paramiko
+from tenacity import wait_none
+
+from etl.metrics import RunMetrics
+from etl.sftp_client import PartialDownload, PooledSFTPClientManager
+
+SFTP_CONFIG = {"host": "localhost", "port": 22, "username": "user", "password": "secret", "remote_folder": "inbox"}
+
+
+class LocalSFTPFile:
+    """Read side of paramiko.SFTPFile over a local file; `on_read` sees the offset of every read"""
+
+    def __init__(self, path: str, mode: str, on_read):
+        self.file = open(path, "rb")
+        self.on_read = on_read
+
+    def __enter__(self) -> "LocalSFTPFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def seek(self, offset: int):
+        self.file.seek(offset)
+
+    def prefetch(self, file_size: int):
+        pass
+
+    def read(self, size: int = -1) -> bytes:
+        self.on_read(self.file.name, self.file.tell())
+        return self.file.read(size)
+
+
+class LocalSFTPClient:
+    """The paramiko.SFTPClient calls a download makes, served from a local directory"""
+
+    def __init__(self, root: str, on_open, on_read):
+        self.root = root
+        self.on_open = on_open
+        self.on_read = on_read
+
+    def stat(self, path: str) -> paramiko.SFTPAttributes:
+        return paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.root, path)))
+
+    def open(self, path: str, mode: str = "r") -> LocalSFTPFile:
+        self.on_open(path)
+        return LocalSFTPFile(os.path.join(self.root, path), mode, self.on_read)
+
+
+class TestPooledSFTPClientManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.remote_dir = os.path.join(self.tmp_dir.name, "remote")
+        self.local_dir = os.path.join(self.tmp_dir.name, "downloads")
+        os.makedirs(os.path.join(self.remote_dir, "inbox"))
+        os.makedirs(self.local_dir)
+
+        self.alert_handler = mock.Mock()
+        self.metrics = RunMetrics()
+        self.manager = PooledSFTPClientManager(
+            pool_size=3, alert_handler=self.alert_handler, metrics=self.metrics, **SFTP_CONFIG
+        )
+        self.on_open = mock.Mock()
+        self.reads = []
+        self.failing_reads = set()
+        self.opened = []
+
+        def open_client():
+            client = LocalSFTPClient(self.remote_dir, self.on_open, self.on_read)
+            self.opened.append(client)
+            return client
+
+        for patcher in (
+            mock.patch.object(self.manager, "_open_client", side_effect=open_client),
+            mock.patch.object(PooledSFTPClientManager.download_file.retry, "wait", wait_none()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.closed = mock.patch.object(self.manager, "_close_client").start()
+        self.addCleanup(mock.patch.stopall)
+
+        self.manager.connect()
+
+    def on_read(self, path: str, offset: int):
+        self.reads.append((os.path.basename(path), offset))
+        if offset in self.failing_reads:
+            self.failing_reads.discard(offset)
+            raise OSError("connection reset")
+
+    def remote_file(self, name: str, content: bytes) -> bytes:
+        Path(self.remote_dir, "inbox", name).write_bytes(content)
+        return content
+
+    def test_downloads_concurrently_over_bounded_pool(self):
+        # Each download blocks until three are in flight, so this only finishes if the pool runs them concurrently
+        barrier = threading.Barrier(3, timeout=5)
+        self.on_open.side_effect = lambda path: path.endswith(".csv") and barrier.wait()
+        files = [f"file-{i}.csv" for i in range(6)]
+        for name in files:
+            self.remote_file(name, b"1,2\n")
+
+        local_paths = self.manager.download_files(files, self.local_dir)
+
+        self.assertEqual(local_paths, [os.path.join(self.local_dir, f"file-{i}.csv") for i in range(6)])
+        self.assertEqual(sorted(os.listdir(self.local_dir)), files)
+        self.assertEqual(len(self.opened), 3)
+        self.on_open.assert_any_call("inbox/file-0.csv")
+        self.alert_handler.alert.assert_not_called()
+        self.assertEqual(self.metrics.summary()["stages"]["download"]["bytes"], 24)
+
+    def test_failed_download_is_retried_on_fresh_session_then_alerted(self):
+        self.remote_file("broken.csv", b"1,2\n")
+        self.on_open.side_effect = OSError("reset")
+
+        local_paths = self.manager.download_files(["broken.csv"], self.local_dir)
+
+        self.assertEqual(local_paths, [])
+        self.assertEqual(self.on_open.call_count, 3)
+        # Every failed attempt dropped its session
+        self.assertEqual(len({call.args[0] for call in self.closed.call_args_list}), 3)
+        self.alert_handler.alert.assert_called_once_with(
+            "file_download_failed", remote_file="broken.csv", error="reset"
+        )
+        download = self.metrics.summary()["stages"]["download"]
+        self.assertEqual((download["calls"], download["retries"], download["errors"]), (1, 2, 1))
+
+    def test_retry_resumes_from_the_last_offset(self):
+        content = self.remote_file("big.csv", os.urandom(3 * 1024 * 1024 + 10))
+        self.failing_reads.add(2 * 1024 * 1024)
+
+        self.manager.download_files(["big.csv"], self.local_dir)
+
+        self.assertEqual(Path(self.local_dir, "big.csv").read_bytes(), content)
+        self.assertEqual(os.listdir(self.local_dir), ["big.csv"])
+        offsets = [offset for _, offset in self.reads]
+        # The retry starts at the 2 MiB that were already on disk instead of at byte zero
+        self.assertEqual(offsets, [0, 1024 * 1024, 2 * 1024 * 1024, 2 * 1024 * 1024, 3 * 1024 * 1024])
+        self.assertEqual(self.metrics.summary()["stages"]["download"]["retries"], 1)
+
+    def test_large_file_is_fetched_as_parallel_ranges(self):
+        self.manager.range_threshold = 1000
+        content = self.remote_file("big.csv", os.urandom(3000))
+        barrier = threading.Barrier(3, timeout=5)
+        self.on_open.side_effect = lambda path: path.endswith(".csv") and barrier.wait()
+
+        self.manager.download_files(["big.csv"], self.local_dir)
+
+        self.assertEqual(Path(self.local_dir, "big.csv").read_bytes(), content)
+        self.assertEqual(sorted(offset for _, offset in self.reads), [0, 1000, 2000])
+        self.assertEqual(len(self.opened), 3)
+
+    def test_checksum_mismatch_is_discarded_and_alerted(self):
+        content = self.remote_file("good.csv", b"1,2\n")
+        Path(self.remote_dir, "inbox", "good.csv.sha256").write_text(f"{hashlib.sha256(content).hexdigest()}  good.csv")
+        self.remote_file("bad.csv", b"1,2\n")
+        Path(self.remote_dir, "inbox", "bad.csv.sha256").write_text(hashlib.sha256(b"3,4\n").hexdigest())
+
+        local_paths = self.manager.download_files(["good.csv", "bad.csv"], self.local_dir)
+
+        self.assertEqual(local_paths, [os.path.join(self.local_dir, "good.csv")])
+        self.assertEqual(os.listdir(self.local_dir), ["good.csv"])
+        self.assertEqual(self.alert_handler.alert.call_args.kwargs["remote_file"], "bad.csv")
+
+    def test_checksum_files_are_not_listed(self):
+        self.manager.client = mock.Mock()
+        self.manager.client.listdir.return_value = ["a.csv", "a.csv.sha256"]
+
+        self.assertEqual(self.manager.list_files(), ["a.csv"])
+
+
+class TestPartialDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.local_path = os.path.join(self.tmp_dir.name, "customers.csv")
+
+    def test_progress_survives_a_new_run(self):
+        download = PartialDownload(self.local_path, 100, 1700000000.5, parts=3)
+        self.assertEqual(download.ranges, [[0, 0, 34], [34, 34, 68], [68, 68, 100]])
+        download.advance(1, 50)
+
+        resumed = PartialDownload(self.local_path, 100, 1700000000, parts=3)
+
+        self.assertEqual(resumed.ranges, [[0, 0, 34], [34, 50, 68], [68, 68, 100]])
+        self.assertEqual(resumed.resumed_bytes, 16)
+        self.assertEqual(resumed.pending(), [0, 1, 2])
+
+    def test_new_remote_version_starts_over(self):
+        stale = PartialDownload(self.local_path, 100, 1700000000)
+        Path(stale.part_path).write_bytes(b"x" * 60)
+        stale.advance(0, 60)
+        Path(self.tmp_dir.name, "customers.csv.gz.part").touch()
+
+        download = PartialDownload(self.local_path, 120, 1700000100)
+
+        self.assertEqual(download.ranges, [[0, 0, 120]])
+        self.assertEqual(download.resumed_bytes, 0)
+        self.assertEqual(os.path.getsize(download.part_path), 0)
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir.name)),
+            ["customers.csv.gz.part", "customers.csv.part", "customers.csv.part.progress"],
+        )
+
+    def test_incomplete_or_changed_part_is_not_committed(self):
+        download = PartialDownload(self.local_path, 4, 1700000000)
+        with self.assertRaises(IOError):
+            download.commit(4, 1700000000)
+
+        Path(download.part_path).write_bytes(b"1,2\n")
+        download.advance(0, 4)
+        with self.assertRaises(IOError):
+            download.commit(5, 1700000001)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,13 @@
+import os
+import tempfile
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 import polars as pl
 
-from etl.transform import DataTransformer
+from etl.transform import DataTransformer, RowHashIndex
+
+ROW_KEYS = {"row_hash": pl.UInt64, "key": pl.UInt64}
 
 
 class TestDataTransformer(unittest.TestCase):
@@ -35,7 +39,87 @@ class TestDataTransformer(unittest.TestCase):
 
         # Check metadata columns
         self.assertTrue(all(val == "test.csv" for val in result["source_file"]))
-        self.assertTrue(all(isinstance(val, str) for val in result["ingested_at"]))
+        self.assertEqual(result["ingested_at"].dtype, pl.Datetime("us", "UTC"))
+        self.assertTrue(all(isinstance(val, datetime) for val in result["ingested_at"]))
+
+    def test_transform_accepts_lazy_scan(self):
+        df = pl.DataFrame({"Index": ["1", "1", "2"], "Customer Id": [" A", "A", None]})
+        ingested_at = datetime(2025, 3, 21, 10, 0)
+
+        eager = self.transformer.transform(df, source_file="test.csv", ingested_at=ingested_at)
+        lazy = self.transformer.transform(df.lazy(), source_file="test.csv", ingested_at=ingested_at)
+
+        self.assertEqual(lazy.to_dicts(), eager.to_dicts())
+        self.assertEqual(lazy["customer_id"].to_list(), ["A"])
+
+    def test_ingested_at_is_utc(self):
+        df = pl.DataFrame({"Index": ["1"]})
+        berlin = datetime(2025, 3, 21, 11, 0, tzinfo=timezone(timedelta(hours=1)))
+
+        naive = self.transformer.transform(df, source_file="a.csv", ingested_at=datetime(2025, 3, 21, 10, 0))
+        aware = self.transformer.transform(df, source_file="a.csv", ingested_at=berlin)
+
+        expected = datetime(2025, 3, 21, 10, 0, tzinfo=timezone.utc)
+        self.assertEqual(naive["ingested_at"].item(), expected)
+        self.assertEqual(aware["ingested_at"].item(), expected)
+
+    def test_transform_batches_dedups_across_chunks(self):
+        df = pl.DataFrame(
+            {
+                "Index": ["1", "2", "1", "3", "2", "4"],
+                "Customer Id": ["A", "B", "A ", "C", "B", "D"],
+                "Subscription Date": ["2023-12-01"] * 6,
+            }
+        )
+
+        whole = self.transformer.transform(df, source_file="test.csv")
+        chunks = list(self.transformer.transform_batches(df.iter_slices(2), source_file="test.csv"))
+        chunked = pl.concat(chunks)
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunked.height, whole.height)
+        self.assertEqual(sorted(chunked["index"].to_list()), [1, 2, 3, 4])
+        self.assertEqual(chunked["ingested_at"].n_unique(), 1)
+
+    def test_row_hash_index(self):
+        index = RowHashIndex()
+        for start in range(0, 40, 10):
+            index.add(pl.DataFrame({"row_hash": range(start, start + 10), "key": range(10)}, schema=ROW_KEYS))
+
+        found = index.contains(pl.DataFrame({"row_hash": [5, 39, 40, 1000], "key": [5, 9, 0, 0]}, schema=ROW_KEYS))
+
+        self.assertEqual(len(index), 40)
+        self.assertEqual(found.to_list(), [True, True, False, False])
+
+    def test_row_hash_collision_keeps_distinct_customers(self):
+        index = RowHashIndex()
+        index.add(pl.DataFrame({"row_hash": [7, 7, 7, 9], "key": [1, 3, 5, 1]}, schema=ROW_KEYS))
+
+        found = index.contains(pl.DataFrame({"row_hash": [7, 7, 7, 9], "key": [5, 2, 6, 1]}, schema=ROW_KEYS))
+
+        self.assertEqual(found.to_list(), [True, False, False, True])
+
+    def test_row_hash_index_spills_to_disk(self):
+        spill_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spill_dir.cleanup)
+        index = RowHashIndex(memory_rows=8, spill_dir=spill_dir.name)
+        added = set()
+        for start in range(0, 100, 5):
+            # Hashes repeat across chunks with other keys, like rows colliding on the hash
+            chunk = [((start + i) % 37, start + i) for i in range(5)]
+            index.add(pl.DataFrame({"row_hash": [h for h, _ in chunk], "key": [k for _, k in chunk]}, schema=ROW_KEYS))
+            added.update(chunk)
+
+        probes = [(h, k) for h in range(40) for k in range(0, 110, 3)]
+        found = index.contains(
+            pl.DataFrame({"row_hash": [h for h, _ in probes], "key": [k for _, k in probes]}, schema=ROW_KEYS)
+        )
+
+        self.assertEqual(len(index), 100)
+        self.assertEqual(found.to_list(), [probe in added for probe in probes])
+        self.assertTrue(os.listdir(spill_dir.name))
+        index.close()
+        self.assertEqual(os.listdir(spill_dir.name), [])
 
     def test_flatten(self):
         nested = {"id": 1, "user": {"name": "Alice", "contact": {"email": "alice@example.com", "phone": "123456789"}}}
@@ -47,6 +131,20 @@ class TestDataTransformer(unittest.TestCase):
         self.assertEqual(flattened["user_name"], "Alice")
         self.assertEqual(flattened["user_contact_email"], "alice@example.com")
 
+    def test_flatten_frame_matches_flatten(self):
+        records = [
+            {"id": 1, "user": {"name": "Alice", "contact": {"email": "alice@example.com", "phone": "123"}}},
+            {"id": 2, "user": {"name": "Bob", "contact": {"email": "bob@example.com", "phone": None}}},
+        ]
+
+        expected = pl.DataFrame([self.transformer.flatten(record) for record in records])
+        flattened = self.transformer.flatten_frame(pl.DataFrame(records))
+        flattened_lazy = self.transformer.flatten_frame(pl.DataFrame(records).lazy()).collect()
+
+        self.assertEqual(flattened.columns, ["id", "user_name", "user_contact_email", "user_contact_phone"])
+        self.assertTrue(flattened.equals(expected))
+        self.assertTrue(flattened_lazy.equals(expected))
+
 
 if __name__ == "__main__":
     import unittest
@@ -1,47 +1,223 @@
 import datetime
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator
 
 import polars as pl
+from decouple import config
+from metrics import NULL_METRICS
+
+# Polars engine used to collect the transform plan; "streaming" keeps peak memory well below the eager engine
+TRANSFORM_ENGINE = config("ETL_TRANSFORM_ENGINE", default="streaming")
+
+# Row keys the chunked transform's dedup index keeps in memory (16 bytes each) before it spills runs to disk
+CHUNK_DEDUP_MEMORY_ROWS = config("ETL_CHUNK_DEDUP_MEMORY_ROWS", cast=int, default=4_000_000)
+# Directory for the spilled runs; empty for the system temporary directory
+CHUNK_DEDUP_DIR = config("ETL_CHUNK_DEDUP_DIR", default="") or None
+
+METADATA_COLUMNS = ["source_file", "ingested_at"]
+NUMERIC_CANDIDATES = ["index"]
+DATETIME_CANDIDATES = ["subscription_date"]
+# ingested_at is an instant: stored as timestamptz, so both the psycopg2 and the asyncpg loader write the same value
+INGESTED_AT_DTYPE = pl.Datetime("us", "UTC")
+
+
+def _utc(value: datetime.datetime | None) -> datetime.datetime:
+    """The ingestion time in UTC; naive values are taken to be UTC already"""
+    if value is None:
+        return datetime.datetime.now(datetime.timezone.utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+class RowHashIndex:
+    """Set of (row_hash, key) pairs kept as sorted runs that are merged LSM-style, so a lookup is a binary search per
+    run. A row is only seen if both match, so two customers whose rows collide on the 64-bit hash are both kept as
+    long as their keys differ.
+
+    Runs of up to `memory_rows` pairs (16 bytes each) stay in memory. Larger merges are written piece by piece to
+    uncompressed Arrow IPC files in `spill_dir` and memory-mapped, so their pages are file-backed and the OS can drop
+    them; the index then holds about 48 bytes x `memory_rows` of its own memory whatever the size of the file, and
+    16 bytes per distinct row on disk (twice that while the largest runs merge). Call close() to remove the files."""
+
+    def __init__(self, memory_rows: int = CHUNK_DEDUP_MEMORY_ROWS, spill_dir: str | None = CHUNK_DEDUP_DIR):
+        self.memory_rows = memory_rows
+        self.spill_dir = spill_dir
+        self._runs: list[pl.DataFrame] = []
+        # The files backing each run, empty for runs held in memory
+        self._files: list[list[str]] = []
+        self._tmp_dir: str | None = None
+        self._pieces = 0
+
+    def __len__(self) -> int:
+        return sum(run.height for run in self._runs)
+
+    def contains(self, rows: pl.DataFrame) -> pl.Series:
+        found = pl.repeat(False, rows.height, eager=True)
+        hashes, keys = rows.get_column("row_hash"), rows.get_column("key")
+        for run in self._runs:
+            run_hashes, run_keys = run.get_column("row_hash"), run.get_column("key")
+            positions = run.select(pl.col("row_hash").search_sorted(hashes)).to_series()
+            # Equal hashes sit next to each other; step through them only for rows whose hash matched another key
+            pending = pl.repeat(True, rows.height, eager=True)
+            while pending.any():
+                in_run = positions < run.height
+                at = positions.clip(upper_bound=run.height - 1)
+                same_hash = pending & in_run & (run_hashes.gather(at) == hashes)
+                same_key = same_hash & (run_keys.gather(at) == keys)
+                found = found | same_key
+                pending = same_hash & ~same_key
+                positions = positions + 1
+        return found
+
+    def add(self, rows: pl.DataFrame):
+        run, files = rows.select("row_hash", "key").unique().sort("row_hash", "key"), []
+        while self._runs and self._runs[-1].height <= run.height:
+            older, older_files = self._runs.pop(), self._files.pop()
+            if older.height + run.height <= self.memory_rows:
+                run = pl.concat([older, run]).sort("row_hash", "key")
+            else:
+                run, merged_files = self._merge_to_disk(run, older)
+                # Unlinking a mapped file is safe; its pages go away with the last mapping
+                for path in files + older_files:
+                    os.remove(path)
+                files = merged_files
+        self._runs.append(run)
+        self._files.append(files)
+
+    def _merge_to_disk(self, larger: pl.DataFrame, smaller: pl.DataFrame) -> tuple[pl.DataFrame, list[str]]:
+        """Merges two sorted runs into memory-mapped pieces of about `memory_rows` pairs each: a slice of the larger
+        run together with the rows of the smaller one that sort up to its last hash"""
+        step = max(self.memory_rows // 2, 1)
+        pieces, files, taken = [], [], 0
+        for offset in range(0, larger.height, step):
+            part = larger.slice(offset, step)
+            if offset + step < larger.height:
+                upper = smaller.select(pl.col("row_hash").search_sorted(part["row_hash"][-1], side="right")).item()
+            else:
+                upper = smaller.height
+            piece = pl.concat([part, smaller.slice(taken, upper - taken)]).sort("row_hash", "key")
+            taken = upper
+            files.append(self._spill_path())
+            piece.write_ipc(files[-1], compression="uncompressed")
+            pieces.append(pl.read_ipc(files[-1], memory_map=True, rechunk=False))
+        return pl.concat(pieces, rechunk=False), files
+
+    def _spill_path(self) -> str:
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="etl-dedup-", dir=self.spill_dir)
+        self._pieces += 1
+        return os.path.join(self._tmp_dir, f"{self._pieces:06d}.arrow")
+
+    def close(self):
+        self._runs, self._files = [], []
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
 
 
 class DataTransformer:
+    def __init__(self, engine: str = TRANSFORM_ENGINE, metrics=None):
+        self.engine = engine
+        self.metrics = metrics or NULL_METRICS
 
     @staticmethod
     def _normalize_key(key: str) -> str:
         return key.strip().lower().replace(" ", "_")
 
-    def transform(self, df: pl.DataFrame, source_file: str) -> pl.DataFrame:
-        # Normalize column names
-        df = df.rename({col: self._normalize_key(col) for col in df.columns})
-
-        # Trim string fields
-        df = df.with_columns([pl.col(col).str.strip_chars() for col in df.columns if df[col].dtype == pl.Utf8])
-
-        # Cast numeric-like columns (optional)
-        numeric_candidates = ["index"]
-        for col in numeric_candidates:
-            if col in df.columns:
-                df = df.with_columns([pl.col(col).cast(pl.Int64)])
-
-        # Parse date columns
-        datetime_candidates = ["subscription_date"]
-        for col in datetime_candidates:
-            if col in df.columns and df[col].dtype == pl.Utf8:
-                df = df.with_columns([pl.col("subscription_date").str.strptime(pl.Datetime, format="%Y-%m-%d")])
-
-        # Drop nulls
-        df = df.drop_nulls()
-
-        # Remove duplicates
-        df = df.unique()
-
-        # Add metadata
-        df = df.with_columns(
-            [
-                pl.lit(source_file).alias("source_file"),
-                pl.lit(datetime.datetime.utcnow().isoformat()).alias("ingested_at"),
-            ]
+    def transform_lazy(
+        self, frame: pl.DataFrame | pl.LazyFrame, source_file: str, ingested_at: datetime.datetime | None = None
+    ) -> pl.LazyFrame:
+        """Builds the whole cleaning pass as one query plan; nothing is computed until the caller collects it"""
+        lf = frame.lazy()
+        schema = lf.collect_schema()
+
+        columns = []
+        for original, dtype in schema.items():
+            # Normalize column names
+            col = self._normalize_key(original)
+            expr = pl.col(original)
+
+            # Trim string fields
+            if dtype == pl.Utf8:
+                expr = expr.str.strip_chars()
+
+            # Cast numeric-like columns (optional)
+            if col in NUMERIC_CANDIDATES:
+                expr = expr.cast(pl.Int64)
+
+            # Parse date columns
+            if col in DATETIME_CANDIDATES and dtype == pl.Utf8:
+                expr = expr.str.strptime(pl.Datetime, format="%Y-%m-%d")
+
+            columns.append(expr.alias(col))
+
+        return (
+            lf.select(columns)
+            # Drop nulls
+            .drop_nulls()
+            # Remove duplicates
+            .unique()
+            # Add metadata
+            .with_columns(
+                [
+                    pl.lit(source_file).alias("source_file"),
+                    pl.lit(_utc(ingested_at), dtype=INGESTED_AT_DTYPE).alias("ingested_at"),
+                ]
+            )
         )
 
+    def transform(
+        self, df: pl.DataFrame | pl.LazyFrame, source_file: str, ingested_at: datetime.datetime | None = None
+    ) -> pl.DataFrame:
+        with self.metrics.timer("transform", source_file) as record:
+            df = self.transform_lazy(df, source_file=source_file, ingested_at=ingested_at).collect(engine=self.engine)
+            record["rows"] = df.height
+        return df
+
+    def transform_batches(self, batches: Iterable[pl.DataFrame], source_file: str) -> Iterator[pl.DataFrame]:
+        """Transforms a file chunk by chunk, dropping rows already emitted for an earlier chunk so the
+        concatenated output matches transforming the whole file at once"""
+        ingested_at = _utc(None)
+        seen = RowHashIndex()
+
+        try:
+            for batch in batches:
+                df = self.transform(batch, source_file=source_file, ingested_at=ingested_at)
+                rows = self._row_keys(df.drop(METADATA_COLUMNS))
+                is_new = ~seen.contains(rows)
+                seen.add(rows.filter(is_new))
+                yield df.filter(is_new)
+        finally:
+            seen.close()
+
+    @staticmethod
+    def _row_keys(df: pl.DataFrame) -> pl.DataFrame:
+        """The row hash paired with the business key, or with a second, independently seeded hash without one"""
+        if df.schema.get("index") == pl.Int64:
+            key = df.get_column("index").reinterpret(signed=False)
+        else:
+            key = df.hash_rows(seed=1)
+        return pl.DataFrame({"row_hash": df.hash_rows(), "key": key})
+
+    @staticmethod
+    def flatten_frame(df: pl.DataFrame | pl.LazyFrame, sep: str = "_") -> pl.DataFrame | pl.LazyFrame:
+        """Columnar counterpart of flatten: expands struct columns into parent_child columns, level by level"""
+        schema = df.collect_schema()
+        while any(isinstance(dtype, pl.Struct) for dtype in schema.values()):
+            columns = []
+            for name, dtype in schema.items():
+                if isinstance(dtype, pl.Struct):
+                    columns.extend(
+                        pl.col(name).struct.field(field.name).alias(f"{name}{sep}{field.name}")
+                        for field in dtype.fields
+                    )
+                else:
+                    columns.append(pl.col(name))
+            df = df.select(columns)
+            schema = df.collect_schema()
         return df
 
     @staticmethod
@@ -1,9 +1,14 @@
 import argparse
+import bz2
+import gzip
 import logging
 import os
+import shutil
+from functools import partial
 
 import paramiko
 import structlog
+import zstandard
 from decouple import config
 
 # Set up structlog
@@ -20,6 +25,13 @@ structlog.configure(
 
 logger = structlog.get_logger()
 
+# Suffix and writer per --compress choice; the ingestor reads all three back by suffix
+COMPRESSORS = {
+    "gzip": (".gz", partial(gzip.open, compresslevel=6)),
+    "bz2": (".bz2", bz2.open),
+    "zstd": (".zst", zstandard.open),
+}
+
 # Load from .env using decouple
 host = config("SFTP_HOST")
 port = config("SFTP_PORT", cast=int, default=22)
@@ -29,10 +41,17 @@ password = config("SFTP_PASSWORD")
 # Parse CLI arguments
 parser = argparse.ArgumentParser(description="Upload a file to SFTP")
 parser.add_argument("file", help="Path to the local file to upload")
+parser.add_argument(
+    "--compress",
+    choices=sorted(COMPRESSORS),
+    help="Compress the file while it is uploaded, adding .gz, .bz2 or .zst to the remote name",
+)
 args = parser.parse_args()
 
 local_file = args.file
 remote_path = f"/{os.path.basename(local_file)}"
+if args.compress:
+    remote_path += COMPRESSORS[args.compress][0]
 
 try:
     transport = paramiko.Transport((host, port))
@@ -41,8 +60,15 @@ try:
     sftp = paramiko.SFTPClient.from_transport(transport)
     logger.info("sftp_connected", host=host, port=port)
 
-    sftp.put(local_file, remote_path)
-    logger.info("file_uploaded", local_file=local_file, remote_path=remote_path)
+    if args.compress:
+        # Compressed as it is written, so no compressed copy is made on disk first
+        with open(local_file, "rb") as source, sftp.open(remote_path, "wb") as remote:
+            remote.set_pipelined(True)
+            with COMPRESSORS[args.compress][1](remote, "wb") as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+    else:
+        sftp.put(local_file, remote_path)
+    logger.info("file_uploaded", local_file=local_file, remote_path=remote_path, compress=args.compress)
 
     sftp.close()
     transport.close()